@@ -2,8 +2,35 @@
 # CONSTANTS
 #######################################
 import re
+import os
+import sys
+import math
+import json
+import time
+import mmap
+import copy
+import operator
+import pickle
+import hashlib
+import marshal
+import threading
+from collections import OrderedDict, Counter
+from contextlib import contextmanager, nullcontext
+from itertools import groupby
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from strings_with_arrows import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 WORD_REGEX = re.compile(r'[a-zA-Z0-9]+(?: [a-zA-Z0-9]+)*')
 
+ENGINE_CHAR = 'char'
+ENGINE_REGEX = 'regex'
+
 
 DIGITS = '0123456789'
 
@@ -27,30 +54,91 @@ class IllegalCharError(Error):
     def __init__(self, pos_start, pos_end, details):
         super().__init__(pos_start, pos_end, 'Illegal Character', details)
 
+class InvalidSyntaxError(Error):
+    def __init__(self, pos_start, pos_end, details=''):
+        super().__init__(pos_start, pos_end, 'Invalid Syntax', details)
+
+# Frames a traceback repeats before collapsing the rest of the run.
+TRACEBACK_REPEATS = 3
+
+class RTError(Error):
+    def __init__(self, pos_start, pos_end, details, context):
+        super().__init__(pos_start, pos_end, 'Runtime Error', details)
+        self.context = context
+
+    def as_string(self):
+        result  = self.generate_traceback()
+        result += f'{self.error_name}: {self.details}'
+        result += '\n\n' + string_with_arrows(self.pos_start.ftxt, self.pos_start, self.pos_end)
+        return result
+
+    def generate_traceback(self):
+        lines = []
+        pos = self.pos_start
+        ctx = self.context
+
+        while ctx:
+            lines.append(f'  File {pos.fn}, line {str(pos.ln + 1)}, in {ctx.display_name}\n')
+            pos = ctx.parent_entry_pos
+            ctx = ctx.parent
+
+        # Deep recursion repeats the same frame; like Python, only the first
+        # TRACEBACK_REPEATS of a run are written out.
+        result = []
+        for line, run in groupby(reversed(lines)):
+            count = sum(1 for _ in run)
+            result.extend([line] * min(count, TRACEBACK_REPEATS))
+            if count > TRACEBACK_REPEATS:
+                result.append(f'  [Previous line repeated {count - TRACEBACK_REPEATS} more times]\n')
+
+        return 'Traceback (most recent call last):\n' + ''.join(result)
+
 #######################################
 # POSITION
 #######################################
 
 class Position:
+    # An offset into ftxt. ln and col are looked up in the text's LineIndex
+    # the first time they are read, so creating and advancing positions
+    # only touches idx. The ln and col passed in are only kept when there is
+    # no ftxt to look them up in (token streams read from a file).
+    __slots__ = ('idx', 'fn', 'ftxt', 'cached_ln', 'cached_col')
+
     def __init__(self, idx, ln, col, fn, ftxt):
         self.idx = idx
-        self.ln = ln
-        self.col = col
         self.fn = fn
         self.ftxt = ftxt
+        if ftxt is None:
+            self.cached_ln, self.cached_col = ln, col
+        else:
+            self.cached_ln = self.cached_col = None
+
+    @property
+    def ln(self):
+        if self.cached_ln is None:
+            self.cached_ln, self.cached_col = line_index(self.ftxt).line_col(self.idx)
+        return self.cached_ln
 
-    def advance(self, current_char):
+    @property
+    def col(self):
+        if self.cached_ln is None:
+            self.cached_ln, self.cached_col = line_index(self.ftxt).line_col(self.idx)
+        return self.cached_col
+
+    def advance(self, current_char=None):
         self.idx += 1
-        self.col += 1
 
-        if current_char == '\n':
-            self.ln += 1
-            self.col = 0
+        if self.cached_ln is not None:
+            if current_char == '\n':
+                self.cached_ln += 1
+                self.cached_col = 0
+            else:
+                self.cached_col += 1
 
         return self
 
     def copy(self):
-        return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+        return Position(self.idx, self.cached_ln, self.cached_col, self.fn, self.ftxt)
 
 #######################################
 # TOKENS
@@ -109,17 +197,428 @@ TT_DATE = 'DATE'
 TT_ODD = 'ODD'
 TT_EVEN = 'EVEN'
 TT_DIGIT = 'DIGIT'  # Add this line
+TT_OTHER = 'OTHER'
+
+# Token types the Parser works with. Lexer.make_grammar_tokens derives them
+# from the lexer's own stream.
+TT_IDENTIFIER = 'IDENTIFIER'
+TT_KEYWORD = 'KEYWORD'
+TT_EQ = 'EQ'
+TT_POW = 'POW'
+TT_EE = 'EE'
+TT_LT = 'LT'
+TT_GT = 'GT'
+TT_LTE = 'LTE'
+TT_GTE = 'GTE'
+TT_ARROW = 'ARROW'
+TT_EOF = 'EOF'
+
+KEYWORDS = [
+    'VAR',
+    'AND',
+    'OR',
+    'NOT',
+    'IF',
+    'THEN',
+    'ELIF',
+    'ELSE',
+    'FOR',
+    'TO',
+    'STEP',
+    'WHILE',
+    'FUN',
+]
+
+# Comparison token types and the operator each one applies. Comparisons
+# evaluate to 1 or 0.
+COMPARISON_OPERATORS = {
+    TT_EE: operator.eq,
+    TT_LT: operator.lt,
+    TT_GT: operator.gt,
+    TT_LTE: operator.le,
+    TT_GTE: operator.ge,
+}
+
+# Characters the lexer turns into a token on their own. The multi-character
+# branches of Lexer.make_tokens ('while', '<<', ...) compare a single
+# character against a longer string and never match, so they are not listed.
+SINGLE_CHAR_TOKENS = {
+    '+': TT_PLUS,
+    '-': TT_MINUS,
+    '*': TT_MUL,
+    '/': TT_DIV,
+    '%': TT_MOD,
+    '(': TT_LPAREN,
+    ')': TT_RPAREN,
+    '\\': TT_SINGLE_LINE_COMMENT,
+    ',': TT_COMMA,
+    ';': TT_SEMICOLON,
+    '>': TT_GE,
+    '<': TT_SM,
+    '&': TT_BIT_AND,
+    '|': TT_BIT_OR,
+    '^': TT_BIT_XOR,
+    '~': TT_BIT_NOT,
+}
+
+# Master pattern for the regex engine. Alternatives are ordered like the
+# branches of Lexer.make_tokens; runs are matched longest-first in one go.
+TOKEN_REGEX = re.compile(
+    r'(?P<BLANK>[ \t]+)'
+    r'|(?P<LINE>\n+)'
+    r'|(?P<DIGIT>[0-9]+)'
+    r'|(?P<SINGLE>[' + ''.join(re.escape(char) for char in SINGLE_CHAR_TOKENS) + r'])'
+    r'|(?P<WORD>[a-zA-Z][a-zA-Z0-9]*)'
+    r'|(?P<OTHER>.)',
+    re.DOTALL
+)
+
+# Inputs the regex engine scans as they are, without decoding them first.
+# Token offsets into them are byte offsets, and token values are decoded
+# from UTF-8 only when they are read.
+BYTES_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+# TOKEN_REGEX for bytes. OTHER takes a whole UTF-8 sequence, so a multibyte
+# character is one token, like in a str.
+TOKEN_BYTES_REGEX = re.compile(
+    rb'(?P<BLANK>[ \t]+)'
+    rb'|(?P<LINE>\n+)'
+    rb'|(?P<DIGIT>[0-9]+)'
+    rb'|(?P<SINGLE>[' + ''.join(re.escape(char) for char in SINGLE_CHAR_TOKENS).encode('ascii') + rb'])'
+    rb'|(?P<WORD>[a-zA-Z][a-zA-Z0-9]*)'
+    rb'|(?P<OTHER>[\xc2-\xf4][\x80-\xbf]{1,3}|.)',
+    re.DOTALL
+)
+
+def decode_text(data):
+    if isinstance(data, str):
+        return data
+    return bytes(data).decode('utf-8', 'replace')
 
 
 class Token:
-    def __init__(self, type_, value=None):
+    __slots__ = ('type', 'value', 'pos_start', 'pos_end')
+
+    def __init__(self, type_, value=None, pos_start=None, pos_end=None):
         self.type = type_
         self.value = value
+        self.pos_start = pos_start
+        self.pos_end = pos_end
     
+    def matches(self, type_, value):
+        return self.type == type_ and self.value == value
+
     def __repr__(self):
         if self.value: return f'{self.type}:{self.value}'
         return f'{self.type}'
-    
+
+#######################################
+# TOKEN BUFFER
+#######################################
+
+# Small integer codes for the token types the lexer emits.
+TOKEN_TYPES = (
+    TT_WORD, TT_SPACE, TT_TAB, TT_LINE, TT_DIGIT, TT_OTHER, TT_EVEN, TT_ODD,
+) + tuple(SINGLE_CHAR_TOKENS.values())
+TOKEN_CODES = {type_: code for code, type_ in enumerate(TOKEN_TYPES)}
+SINGLE_CHAR_CODES = {char: TOKEN_CODES[type_] for char, type_ in SINGLE_CHAR_TOKENS.items()}
+SINGLE_BYTE_CODES = {ord(char): code for char, code in SINGLE_CHAR_CODES.items()}
+
+class TokenBuffer:
+    # Column storage for a token stream: one type code and start/end offsets
+    # per token, kept in arrays. Values are sliced or counted from the source
+    # only when they are read, lines and columns come from the source's
+    # LineIndex, and indexing returns TokenView objects that behave like
+    # Token. The source may also be one of BYTES_TYPES (see
+    # Lexer.make_token_buffer); values are then decoded as they are read.
+    #
+    # apply_edit leaves the offset shift of the tokens after an edit
+    # pending, so an edit only rewrites the tokens it re-lexes. The tokens
+    # are split into segments at shift_starts; starts/ends of the tokens from
+    # shift_starts[i] up to the next segment are stored without
+    # shift_offsets[i]. An edit moves the segments after it, and past
+    # max_shifts segments the shortest one is folded into the one before.
+    max_shifts = 256
+
+    def __init__(self, fn, source):
+        self.fn = fn
+        self.source = source
+        self.types = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.shift_starts = [0]
+        self.shift_offsets = [0]
+
+    def append(self, type_, start, end):
+        shift_offset = self.shift_offsets[-1]
+        self.types.append(TOKEN_CODES[type_])
+        self.starts.append(start - shift_offset)
+        self.ends.append(end - shift_offset)
+
+    def columns(self):
+        self.settle_shifts()
+        return {
+            'types': memoryview(self.types),
+            'starts': memoryview(self.starts),
+            'ends': memoryview(self.ends),
+        }
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TokenView(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('token index out of range')
+        return TokenView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield TokenView(self, index)
+
+    def offset_of(self, index):
+        shift_starts = self.shift_starts
+        if len(shift_starts) == 1:
+            return self.shift_offsets[0]
+        return self.shift_offsets[bisect_right(shift_starts, index) - 1]
+
+    def start_of(self, index):
+        return self.starts[index] + self.offset_of(index)
+
+    def end_of(self, index):
+        return self.ends[index] + self.offset_of(index)
+
+    def type_of(self, index):
+        return TOKEN_TYPES[self.types[index]]
+
+    def value_of(self, index):
+        type_ = TOKEN_TYPES[self.types[index]]
+        start, end = self.start_of(index), self.end_of(index)
+        if type_ in (TT_WORD, TT_DIGIT, TT_OTHER):
+            return decode_text(self.source[start:end])
+        elif type_ == TT_SPACE:
+            return self.count_char(' ', start, end)
+        elif type_ == TT_TAB:
+            return self.count_char('\t', start, end)
+        elif type_ == TT_LINE:
+            return end - start
+        return None
+
+    def count_char(self, char, start, end):
+        if isinstance(self.source, str):
+            return self.source.count(char, start, end)
+        return decode_text(self.source[start:end]).count(char)
+
+    def pos_start_of(self, index):
+        return Position(self.start_of(index), None, None, self.fn, self.source)
+
+    def pos_end_of(self, index):
+        return Position(self.end_of(index), None, None, self.fn, self.source)
+
+    def add_offset(self, low, high, offset):
+        if offset and low < high:
+            for column in (self.starts, self.ends):
+                column[low:high] = array('q', map(offset.__add__, column[low:high]))
+
+    def settle_shifts(self):
+        # Apply every pending shift, leaving a single segment.
+        highs = self.shift_starts[1:] + [len(self.types)]
+        for low, high, shift_offset in zip(self.shift_starts, highs, self.shift_offsets):
+            self.add_offset(low, high, shift_offset)
+        self.shift_starts = [0]
+        self.shift_offsets = [0]
+
+    def merge_shortest_shift(self):
+        # Fold the segment with the fewest tokens into the one before it.
+        shift_starts, shift_offsets = self.shift_starts, self.shift_offsets
+        highs = shift_starts[2:] + [len(self.types)]
+        lengths = [high - low for low, high in zip(shift_starts[1:], highs)]
+        segment = lengths.index(min(lengths)) + 1
+        low = shift_starts[segment]
+        self.add_offset(low, low + lengths[segment - 1], shift_offsets[segment] - shift_offsets[segment - 1])
+        del shift_starts[segment]
+        del shift_offsets[segment]
+
+    def apply_edit(self, offset, deleted, inserted):
+        # Replace `deleted` characters at `offset` with `inserted` and re-lex
+        # only the affected tokens: scanning starts at the token touching the
+        # edit and stops at the first token boundary past the edit that lines
+        # up with an old one, from where the old tokens are kept (shifted).
+        # Returns (first, old_stop, new_stop): tokens [first, old_stop) were
+        # replaced by the tokens now at [first, new_stop).
+        if not isinstance(self.source, str):
+            raise TypeError('apply_edit needs a str source')
+        old_source = self.source
+        source = old_source[:offset] + inserted + old_source[offset + deleted:]
+        edited_line_index(old_source, source, offset, deleted, inserted)
+        delta = len(inserted) - deleted
+        edit_end = offset + len(inserted)
+        types, starts, ends = self.types, self.starts, self.ends
+
+        parity_codes = (TOKEN_CODES[TT_EVEN], TOKEN_CODES[TT_ODD])
+        if types and types[-1] in parity_codes:
+            for column in (types, starts, ends):
+                column.pop()
+        n = len(types)
+
+        first = bisect_left(range(n), offset, key=self.end_of)
+        while 0 < first < n and self.start_of(first - 1) == self.start_of(first):
+            first -= 1
+        start_of = self.start_of
+        pos = start_of(first) if first < n else 0
+
+        new_types, new_starts, new_ends = array('B'), array('q'), array('q')
+        single = SINGLE_CHAR_CODES
+        space_code, tab_code = TOKEN_CODES[TT_SPACE], TOKEN_CODES[TT_TAB]
+        line_code = TOKEN_CODES[TT_LINE]
+        kind_codes = {
+            'WORD': TOKEN_CODES[TT_WORD],
+            'LINE': line_code,
+            'DIGIT': TOKEN_CODES[TT_DIGIT],
+            'OTHER': TOKEN_CODES[TT_OTHER],
+        }
+        stop = first
+        synced = False
+
+        for match in TOKEN_REGEX.finditer(source, pos):
+            kind = match.lastgroup
+            start, end = match.span()
+            if start >= edit_end:
+                old_start = start - delta
+                while stop < n and start_of(stop) < old_start:
+                    stop += 1
+                if stop < n and start_of(stop) == old_start:
+                    synced = True
+                    break
+
+            if kind == 'BLANK':
+                spaces = source.count(' ', start, end)
+                codes = []
+                if spaces > 0:
+                    codes.append(space_code)
+                if end - start > spaces:
+                    codes.append(tab_code)
+            elif kind == 'SINGLE':
+                codes = (single[source[start]],)
+            else:
+                codes = (kind_codes[kind],)
+
+            for code in codes:
+                new_types.append(code)
+                new_starts.append(start)
+                new_ends.append(end)
+
+        if not synced:
+            stop = n
+        new_stop = first + len(new_types)
+
+        # The new tokens join the segment first is in. Segments that started
+        # inside the replaced tokens end there; from new_stop on, the tokens
+        # kept after the edit continue with their old offsets plus delta.
+        shift_starts, shift_offsets = self.shift_starts, self.shift_offsets
+        base = self.offset_of(first)
+        if base:
+            new_starts = array('q', map((-base).__add__, new_starts))
+            new_ends = array('q', map((-base).__add__, new_ends))
+        if synced:
+            stop_offset = self.offset_of(stop) + delta
+            later = bisect_right(shift_starts, stop)
+            moved_starts = [start + new_stop - stop for start in shift_starts[later:]]
+            moved_offsets = [shift_offset + delta for shift_offset in shift_offsets[later:]]
+        kept = bisect_right(shift_starts, first)
+        del shift_starts[kept:]
+        del shift_offsets[kept:]
+        if synced:
+            if shift_starts[-1] == new_stop:
+                shift_starts.pop()
+                shift_offsets.pop()
+            if not shift_offsets or shift_offsets[-1] != stop_offset:
+                shift_starts.append(new_stop)
+                shift_offsets.append(stop_offset)
+            shift_starts.extend(moved_starts)
+            shift_offsets.extend(moved_offsets)
+
+        types[first:stop] = new_types
+        starts[first:stop] = new_starts
+        ends[first:stop] = new_ends
+        self.source = source
+        if len(shift_starts) > self.max_shifts:
+            self.merge_shortest_shift()
+
+        if types and types[-1] == kind_codes['DIGIT']:
+            last = len(types) - 1
+            digit = int(source[self.end_of(last) - 1])
+            end = len(source)
+            self.append(TT_EVEN if digit % 2 == 0 else TT_ODD, end, end)
+
+        return first, stop, new_stop
+
+def scan_columns(text, types, starts, ends, pos=0, endpos=None):
+    # Appends the type code, start and end of every token of text[pos:endpos]
+    # to the three columns, without the trailing parity token.
+    if isinstance(text, str):
+        regex, single, space = TOKEN_REGEX, SINGLE_CHAR_CODES, ' '
+    else:
+        regex, single, space = TOKEN_BYTES_REGEX, SINGLE_BYTE_CODES, b' '
+    space_code, tab_code = TOKEN_CODES[TT_SPACE], TOKEN_CODES[TT_TAB]
+    kind_codes = {
+        'WORD': TOKEN_CODES[TT_WORD],
+        'LINE': TOKEN_CODES[TT_LINE],
+        'DIGIT': TOKEN_CODES[TT_DIGIT],
+        'OTHER': TOKEN_CODES[TT_OTHER],
+    }
+
+    for match in regex.finditer(text, pos, len(text) if endpos is None else endpos):
+        kind = match.lastgroup
+        start, end = match.span()
+        if kind == 'BLANK':
+            spaces = match.group().count(space)
+            codes = []
+            if spaces > 0:
+                codes.append(space_code)
+            if end - start > spaces:
+                codes.append(tab_code)
+        elif kind == 'SINGLE':
+            codes = (single[text[start]],)
+        else:
+            codes = (kind_codes[kind],)
+
+        for code in codes:
+            types.append(code)
+            starts.append(start)
+            ends.append(end)
+
+class TokenView:
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def type(self):
+        return self.buffer.type_of(self.index)
+
+    @property
+    def value(self):
+        return self.buffer.value_of(self.index)
+
+    @property
+    def pos_start(self):
+        return self.buffer.pos_start_of(self.index)
+
+    @property
+    def pos_end(self):
+        return self.buffer.pos_end_of(self.index)
+
+    def __repr__(self):
+        value = self.value
+        if value: return f'{self.type}:{value}'
+        return f'{self.type}'
+
 #######################################
 # NODES
 #######################################
@@ -134,6 +633,27 @@ class NumberNode:
 	def __repr__(self):
 		return f'{self.tok}'
 
+class VarAccessNode:
+	def __init__(self, var_name_tok):
+		self.var_name_tok = var_name_tok
+
+		self.pos_start = self.var_name_tok.pos_start
+		self.pos_end = self.var_name_tok.pos_end
+
+	def __repr__(self):
+		return f'{self.var_name_tok}'
+
+class VarAssignNode:
+	def __init__(self, var_name_tok, value_node):
+		self.var_name_tok = var_name_tok
+		self.value_node = value_node
+
+		self.pos_start = self.var_name_tok.pos_start
+		self.pos_end = self.value_node.pos_end
+
+	def __repr__(self):
+		return f'(VAR {self.var_name_tok} = {self.value_node})'
+
 class BinOpNode:
 	def __init__(self, left_node, op_tok, right_node):
 		self.left_node = left_node
@@ -156,6 +676,161 @@ class UnaryOpNode:
 
 	def __repr__(self):
 		return f'({self.op_tok}, {self.node})'
+
+class IfNode:
+	def __init__(self, cases, else_case):
+		self.cases = cases
+		self.else_case = else_case
+
+		self.pos_start = self.cases[0][0].pos_start
+		self.pos_end = (self.else_case or self.cases[-1][1]).pos_end
+
+	def __repr__(self):
+		cases = ' '.join(f'({condition} THEN {expr})' for condition, expr in self.cases)
+		return f'(IF {cases} ELSE {self.else_case})'
+
+class ForNode:
+	def __init__(self, var_name_tok, start_value_node, end_value_node, step_value_node, body_node):
+		self.var_name_tok = var_name_tok
+		self.start_value_node = start_value_node
+		self.end_value_node = end_value_node
+		self.step_value_node = step_value_node
+		self.body_node = body_node
+		# Compiled loops, built by the Interpreter on first use.
+		self.compiled = None
+		self.limited = None
+
+		self.pos_start = self.var_name_tok.pos_start
+		self.pos_end = self.body_node.pos_end
+
+	def __getstate__(self):
+		# Closures do not pickle; they are rebuilt on first use.
+		state = self.__dict__.copy()
+		state['compiled'] = None
+		state['limited'] = None
+		return state
+
+	def __repr__(self):
+		step = f' STEP {self.step_value_node}' if self.step_value_node else ''
+		return f'(FOR {self.var_name_tok.value} = {self.start_value_node} TO {self.end_value_node}{step} THEN {self.body_node})'
+
+class WhileNode:
+	def __init__(self, condition_node, body_node):
+		self.condition_node = condition_node
+		self.body_node = body_node
+		self.compiled = None
+		self.limited = None
+
+		self.pos_start = self.condition_node.pos_start
+		self.pos_end = self.body_node.pos_end
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['compiled'] = None
+		state['limited'] = None
+		return state
+
+	def __repr__(self):
+		return f'(WHILE {self.condition_node} THEN {self.body_node})'
+
+class FuncDefNode:
+	def __init__(self, var_name_tok, arg_name_toks, body_node):
+		self.var_name_tok = var_name_tok
+		self.arg_name_toks = arg_name_toks
+		self.body_node = body_node
+		# Set by pure_function the first time the function is called with a
+		# memo cache.
+		self.pure = None
+
+		if self.var_name_tok:
+			self.pos_start = self.var_name_tok.pos_start
+		elif self.arg_name_toks:
+			self.pos_start = self.arg_name_toks[0].pos_start
+		else:
+			self.pos_start = self.body_node.pos_start
+		self.pos_end = self.body_node.pos_end
+
+	def __repr__(self):
+		args = ', '.join(str(tok.value) for tok in self.arg_name_toks)
+		return f'(FUN {self.var_name_tok.value if self.var_name_tok else ""}({args}) -> {self.body_node})'
+
+class CallNode:
+	def __init__(self, node_to_call, arg_nodes):
+		self.node_to_call = node_to_call
+		self.arg_nodes = arg_nodes
+
+		self.pos_start = self.node_to_call.pos_start
+		if self.arg_nodes:
+			self.pos_end = self.arg_nodes[-1].pos_end
+		else:
+			self.pos_end = self.node_to_call.pos_end
+
+	def __repr__(self):
+		return f'({self.node_to_call}({", ".join(map(str, self.arg_nodes))}))'
+
+def node_children(node):
+	if isinstance(node, BinOpNode):
+		return (node.left_node, node.right_node)
+	elif isinstance(node, UnaryOpNode):
+		return (node.node, )
+	elif isinstance(node, VarAssignNode):
+		return (node.value_node, )
+	elif isinstance(node, IfNode):
+		children = [child for case in node.cases for child in case]
+		if node.else_case:
+			children.append(node.else_case)
+		return tuple(children)
+	elif isinstance(node, ForNode):
+		if node.step_value_node:
+			return (node.start_value_node, node.end_value_node, node.step_value_node, node.body_node)
+		return (node.start_value_node, node.end_value_node, node.body_node)
+	elif isinstance(node, WhileNode):
+		return (node.condition_node, node.body_node)
+	elif isinstance(node, FuncDefNode):
+		return (node.body_node, )
+	elif isinstance(node, CallNode):
+		return (node.node_to_call, ) + tuple(node.arg_nodes)
+	return ()
+
+def walk_nodes(node):
+	# Pre-order walk with an explicit stack, so deep trees do not recurse.
+	stack = [node]
+	while stack:
+		node = stack.pop()
+		yield node
+		stack.extend(reversed(node_children(node)))
+
+def tree_depth(node):
+	# Levels in the tree under node, counted without recursing.
+	depth = 0
+	stack = [(node, 1)]
+	while stack:
+		node, level = stack.pop()
+		depth = max(depth, level)
+		stack.extend((child, level + 1) for child in node_children(node))
+	return depth
+
+def pure_function(node):
+	# Whether a FuncDefNode's result depends on nothing but its arguments:
+	# its body assigns nothing (FOR assigns its variable), defines no
+	# functions, reads only its
+	# parameters and calls nothing but itself, by its own name. That name
+	# may be rebound later; memo_key checks it at every call.
+	name = node.var_name_tok.value if node.var_name_tok else None
+	params = {tok.value for tok in node.arg_name_toks}
+
+	for current in walk_nodes(node.body_node):
+		if isinstance(current, (VarAssignNode, ForNode, FuncDefNode)):
+			return False
+		elif isinstance(current, CallNode):
+			callee = current.node_to_call
+			if not isinstance(callee, VarAccessNode) or callee.var_name_tok.value != name or name in params:
+				return False
+		elif isinstance(current, VarAccessNode):
+			if current.var_name_tok.value not in params and current.var_name_tok.value != name:
+				return False
+	return True
+
 #######################################
 # PARSE RESULT
 #######################################
@@ -204,26 +879,24 @@ class Parser:
 		if not res.error and self.current_tok.type != TT_EOF:
 			return res.failure(InvalidSyntaxError(
 				self.current_tok.pos_start, self.current_tok.pos_end,
-				"Expected '+', '-', '*' or '/'"
+				"Expected '+', '-', '*', '/', '^', '==', '<', '>', '<=', '>=', 'AND' or 'OR'"
 			))
 		return res
 
 	###################################
 
-	def factor(self):
+	def atom(self):
 		res = ParseResult()
 		tok = self.current_tok
 
-		if tok.type in (TT_PLUS, TT_MINUS):
-			res.register(self.advance())
-			factor = res.register(self.factor())
-			if res.error: return res
-			return res.success(UnaryOpNode(tok, factor))
-		
-		elif tok.type in (TT_INT, TT_FLOAT):
+		if tok.type in (TT_INT, TT_FLOAT):
 			res.register(self.advance())
 			return res.success(NumberNode(tok))
 
+		elif tok.type == TT_IDENTIFIER:
+			res.register(self.advance())
+			return res.success(VarAccessNode(tok))
+
 		elif tok.type == TT_LPAREN:
 			res.register(self.advance())
 			expr = res.register(self.expr())
@@ -237,211 +910,2487 @@ class Parser:
 					"Expected ')'"
 				))
 
+		elif tok.matches(TT_KEYWORD, 'IF'):
+			return self.if_expr()
+
+		elif tok.matches(TT_KEYWORD, 'FOR'):
+			return self.for_expr()
+
+		elif tok.matches(TT_KEYWORD, 'WHILE'):
+			return self.while_expr()
+
+		elif tok.matches(TT_KEYWORD, 'FUN'):
+			return self.func_def()
+
 		return res.failure(InvalidSyntaxError(
 			tok.pos_start, tok.pos_end,
-			"Expected int or float"
+			"Expected int, float, identifier, '+', '-', '(', 'IF', 'FOR', 'WHILE' or 'FUN'"
 		))
 
-	def term(self):
-		return self.bin_op(self.factor, (TT_MUL, TT_DIV))
-
-	def expr(self):
-		return self.bin_op(self.term, (TT_PLUS, TT_MINUS))
+	def call(self):
+		res = ParseResult()
+		atom = res.register(self.atom())
+		if res.error: return res
 
-	###################################
+		if self.current_tok.type == TT_LPAREN:
+			arg_nodes = res.register(self.call_args())
+			if res.error: return res
+			return res.success(CallNode(atom, arg_nodes))
+		return res.success(atom)
 
-	def bin_op(self, func, ops):
+	def call_args(self):
+		# The parenthesized argument list of a call, as a list of nodes.
 		res = ParseResult()
-		left = res.register(func())
-		if res.error: return res
+		arg_nodes = []
+		res.register(self.advance())
 
-		while self.current_tok.type in ops:
-			op_tok = self.current_tok
+		if self.current_tok.type == TT_RPAREN:
 			res.register(self.advance())
-			right = res.register(func())
+			return res.success(arg_nodes)
+
+		while True:
+			arg_nodes.append(res.register(self.expr()))
 			if res.error: return res
-			left = BinOpNode(left, op_tok, right)
 
-		return res.success(left)
-#######################################
-# RUNTIME RESULT
-#######################################
+			if self.current_tok.type == TT_RPAREN:
+				res.register(self.advance())
+				return res.success(arg_nodes)
+			elif self.current_tok.type != TT_COMMA:
+				return res.failure(InvalidSyntaxError(
+					self.current_tok.pos_start, self.current_tok.pos_end,
+					"Expected ',' or ')'"
+				))
+			res.register(self.advance())
 
-class RTResult:
-	def __init__(self):
-		self.value = None
-		self.error = None
+	def if_expr(self):
+		res = ParseResult()
+		cases = []
+		else_case = None
+		keyword = 'IF'
 
-	def register(self, res):
-		if res.error: self.error = res.error
-		return res.value
+		while True:
+			res.register(self.advance())
+			condition = res.register(self.expr())
+			if res.error: return res
 
-	def success(self, value):
-		self.value = value
-		return self
+			if not self.current_tok.matches(TT_KEYWORD, 'THEN'):
+				return res.failure(InvalidSyntaxError(
+					self.current_tok.pos_start, self.current_tok.pos_end,
+					"Expected 'THEN'"
+				))
 
-	def failure(self, error):
-		self.error = error
-		return self
-#######################################
-# VALUES
-#######################################
+			res.register(self.advance())
+			expr = res.register(self.expr())
+			if res.error: return res
+			cases.append((condition, expr))
 
-class Number:
-	def __init__(self, value):
-		self.value = value
-		self.set_pos()
-		self.set_context()
+			if not self.current_tok.matches(TT_KEYWORD, 'ELIF'):
+				break
 
-	def set_pos(self, pos_start=None, pos_end=None):
-		self.pos_start = pos_start
-		self.pos_end = pos_end
-		return self
+		if self.current_tok.matches(TT_KEYWORD, 'ELSE'):
+			res.register(self.advance())
+			else_case = res.register(self.expr())
+			if res.error: return res
 
-	def set_context(self, context=None):
-		self.context = context
-		return self
+		return res.success(IfNode(cases, else_case))
 
-	def added_to(self, other):
-		if isinstance(other, Number):
-			return Number(self.value + other.value).set_context(self.context), None
+	def for_expr(self):
+		res = ParseResult()
+		res.register(self.advance())
 
-	def subbed_by(self, other):
-		if isinstance(other, Number):
-			return Number(self.value - other.value).set_context(self.context), None
+		if self.current_tok.type != TT_IDENTIFIER:
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected identifier"
+			))
+		var_name_tok = self.current_tok
+		res.register(self.advance())
 
-	def multed_by(self, other):
-		if isinstance(other, Number):
-			return Number(self.value * other.value).set_context(self.context), None
+		if self.current_tok.type != TT_EQ:
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected '='"
+			))
+		res.register(self.advance())
 
-	def dived_by(self, other):
-		if isinstance(other, Number):
-			if other.value == 0:
-				return None, RTError(
-					other.pos_start, other.pos_end,
-					'Division by zero',
-					self.context
-				)
+		start_value = res.register(self.expr())
+		if res.error: return res
 
-			return Number(self.value / other.value).set_context(self.context), None
+		if not self.current_tok.matches(TT_KEYWORD, 'TO'):
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected 'TO'"
+			))
+		res.register(self.advance())
 
-	def __repr__(self):
-		return str(self.value)
+		end_value = res.register(self.expr())
+		if res.error: return res
 
-#######################################
-# CONTEXT
-#######################################
+		step_value = None
+		if self.current_tok.matches(TT_KEYWORD, 'STEP'):
+			res.register(self.advance())
+			step_value = res.register(self.expr())
+			if res.error: return res
 
-class Context:
-	def __init__(self, display_name, parent=None, parent_entry_pos=None):
-		self.display_name = display_name
-		self.parent = parent
-		self.parent_entry_pos = parent_entry_pos
-#######################################
-# SYMBOL TABLE
-#######################################
+		if not self.current_tok.matches(TT_KEYWORD, 'THEN'):
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected 'THEN'"
+			))
+		res.register(self.advance())
 
-class SymbolTable:
-	def __init__(self):
-		self.symbols = {}
-		self.parent = None
+		body = res.register(self.expr())
+		if res.error: return res
+		return res.success(ForNode(var_name_tok, start_value, end_value, step_value, body))
 
-	def get(self, name):
-		value = self.symbols.get(name, None)
-		if value == None and self.parent:
-			return self.parent.get(name)
-		return value
+	def while_expr(self):
+		res = ParseResult()
+		res.register(self.advance())
 
-	def set(self, name, value):
-		self.symbols[name] = value
+		condition = res.register(self.expr())
+		if res.error: return res
 
-	def remove(self, name):
-		del self.symbols[name]
-class Interpreter:
-	def visit(self, node, context):
-		method_name = f'visit_{type(node).__name__}'
-		method = getattr(self, method_name, self.no_visit_method)
-		return method(node, context)
+		if not self.current_tok.matches(TT_KEYWORD, 'THEN'):
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected 'THEN'"
+			))
+		res.register(self.advance())
 
-	def no_visit_method(self, node, context):
-		raise Exception(f'No visit_{type(node).__name__} method defined')
+		body = res.register(self.expr())
+		if res.error: return res
+		return res.success(WhileNode(condition, body))
 
-	###################################
+	def func_def(self):
+		res = ParseResult()
+		res.register(self.advance())
 
-	def visit_NumberNode(self, node, context):
-		return RTResult().success(
-			Number(node.tok.value).set_context(context).set_pos(node.pos_start, node.pos_end)
-		)
+		var_name_tok = None
+		if self.current_tok.type == TT_IDENTIFIER:
+			var_name_tok = self.current_tok
+			res.register(self.advance())
 
-	def visit_VarAccessNode(self, node, context):
-		res = RTResult()
-		var_name = node.var_name_tok.value
-		value = context.symbol_table.get(var_name)
+		if self.current_tok.type != TT_LPAREN:
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected identifier or '('" if var_name_tok is None else "Expected '('"
+			))
+		res.register(self.advance())
 
-		if not value:
+		arg_name_toks = []
+		if self.current_tok.type == TT_IDENTIFIER:
+			arg_name_toks.append(self.current_tok)
+			res.register(self.advance())
+
+			while self.current_tok.type == TT_COMMA:
+				res.register(self.advance())
+				if self.current_tok.type != TT_IDENTIFIER:
+					return res.failure(InvalidSyntaxError(
+						self.current_tok.pos_start, self.current_tok.pos_end,
+						"Expected identifier"
+					))
+				arg_name_toks.append(self.current_tok)
+				res.register(self.advance())
+
+			if self.current_tok.type != TT_RPAREN:
+				return res.failure(InvalidSyntaxError(
+					self.current_tok.pos_start, self.current_tok.pos_end,
+					"Expected ',' or ')'"
+				))
+		elif self.current_tok.type != TT_RPAREN:
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected identifier or ')'"
+			))
+		res.register(self.advance())
+
+		if self.current_tok.type != TT_ARROW:
+			return res.failure(InvalidSyntaxError(
+				self.current_tok.pos_start, self.current_tok.pos_end,
+				"Expected '->'"
+			))
+		res.register(self.advance())
+
+		body_node = res.register(self.expr())
+		if res.error: return res
+		return res.success(FuncDefNode(var_name_tok, arg_name_toks, body_node))
+
+	def power(self):
+		return self.bin_op(self.call, (TT_POW, ), self.factor)
+
+	def factor(self):
+		res = ParseResult()
+		tok = self.current_tok
+
+		if tok.type in (TT_PLUS, TT_MINUS):
+			res.register(self.advance())
+			factor = res.register(self.factor())
+			if res.error: return res
+			return res.success(UnaryOpNode(tok, factor))
+
+		return self.power()
+
+	def term(self):
+		return self.bin_op(self.factor, (TT_MUL, TT_DIV))
+
+	def arith_expr(self):
+		return self.bin_op(self.term, (TT_PLUS, TT_MINUS))
+
+	def comp_expr(self):
+		res = ParseResult()
+
+		if self.current_tok.matches(TT_KEYWORD, 'NOT'):
+			op_tok = self.current_tok
+			res.register(self.advance())
+
+			node = res.register(self.comp_expr())
+			if res.error: return res
+			return res.success(UnaryOpNode(op_tok, node))
+
+		return self.bin_op(self.arith_expr, (TT_EE, TT_LT, TT_GT, TT_LTE, TT_GTE))
+
+	def expr(self):
+		res = ParseResult()
+
+		if self.current_tok.matches(TT_KEYWORD, 'VAR'):
+			res.register(self.advance())
+
+			if self.current_tok.type != TT_IDENTIFIER:
+				return res.failure(InvalidSyntaxError(
+					self.current_tok.pos_start, self.current_tok.pos_end,
+					"Expected identifier"
+				))
+
+			var_name = self.current_tok
+			res.register(self.advance())
+
+			if self.current_tok.type != TT_EQ:
+				return res.failure(InvalidSyntaxError(
+					self.current_tok.pos_start, self.current_tok.pos_end,
+					"Expected '='"
+				))
+
+			res.register(self.advance())
+			expr = res.register(self.expr())
+			if res.error: return res
+			return res.success(VarAssignNode(var_name, expr))
+
+		return self.bin_op(self.comp_expr, ((TT_KEYWORD, 'AND'), (TT_KEYWORD, 'OR')))
+
+	###################################
+
+	def bin_op(self, func_a, ops, func_b=None):
+		if func_b == None:
+			func_b = func_a
+
+		res = ParseResult()
+		left = res.register(func_a())
+		if res.error: return res
+
+		while self.current_tok.type in ops or (self.current_tok.type, self.current_tok.value) in ops:
+			op_tok = self.current_tok
+			res.register(self.advance())
+			right = res.register(func_b())
+			if res.error: return res
+			left = BinOpNode(left, op_tok, right)
+
+		return res.success(left)
+
+#######################################
+# PRECEDENCE PARSER
+#######################################
+
+# Binary operators of grammar.txt and their precedence, loosest first.
+# Keywords are keyed by (TT_KEYWORD, value).
+BINARY_PRECEDENCE = {
+	(TT_KEYWORD, 'AND'): 1,
+	(TT_KEYWORD, 'OR'): 1,
+	TT_EE: 2,
+	TT_LT: 2,
+	TT_GT: 2,
+	TT_LTE: 2,
+	TT_GTE: 2,
+	TT_PLUS: 3,
+	TT_MINUS: 3,
+	TT_MUL: 4,
+	TT_DIV: 4,
+	TT_POW: 5,
+}
+RIGHT_ASSOCIATIVE = (TT_POW, )
+
+LOGIC_PRECEDENCE = 1
+
+# A prefix operator takes everything up to the first binary operator of
+# lower precedence: VAR x = takes the rest of the expression, NOT a
+# comp-expr and unary +/- a power.
+VAR_PRECEDENCE = 1
+NOT_PRECEDENCE = 2
+UNARY_PRECEDENCE = 5
+
+# Operand positions: what may start an operand after the last token.
+LEVEL_EXPR = 0    # VAR, NOT, +/-, atom
+LEVEL_COMP = 1    # NOT, +/-, atom
+LEVEL_ARITH = 2   # +/-, atom
+
+OP_BINARY = 'binary'
+OP_PREFIX = 'prefix'
+OP_VAR = 'var'
+OP_PAREN = 'paren'
+
+class PrecedenceParser(Parser):
+	# Parses the same grammar into the same trees, with the same errors, as
+	# Parser, but without recursion: operands and pending operators live on
+	# two explicit stacks, and an operator is reduced as soon as one that
+	# binds less tightly follows it. Nesting depth of operators and
+	# parentheses is limited only by memory. IF, FOR, WHILE and FUN
+	# expressions and call arguments are parsed with the Parser methods,
+	# which come back here for each expression they contain.
+
+	# The constructors expr builds its tree with; FlatParser swaps them for
+	# FlatAST builders.
+	make_number = NumberNode
+	make_var_access = VarAccessNode
+	make_var_assign = VarAssignNode
+	make_bin_op = BinOpNode
+	make_unary_op = UnaryOpNode
+	make_call = CallNode
+
+	def expr(self):
+		res = ParseResult()
+		nodes = []
+		ops = []
+		level = LEVEL_EXPR
+		open_parens = 0
+
+		while True:
+			tok = self.current_tok
+
+			if tok.matches(TT_KEYWORD, 'VAR') and level == LEVEL_EXPR:
+				self.advance()
+
+				if self.current_tok.type != TT_IDENTIFIER:
+					return res.failure(InvalidSyntaxError(
+						self.current_tok.pos_start, self.current_tok.pos_end,
+						"Expected identifier"
+					))
+
+				var_name = self.current_tok
+				self.advance()
+
+				if self.current_tok.type != TT_EQ:
+					return res.failure(InvalidSyntaxError(
+						self.current_tok.pos_start, self.current_tok.pos_end,
+						"Expected '='"
+					))
+
+				self.advance()
+				ops.append((OP_VAR, var_name, VAR_PRECEDENCE, False))
+				continue
+
+			elif tok.matches(TT_KEYWORD, 'NOT') and level <= LEVEL_COMP:
+				self.advance()
+				ops.append((OP_PREFIX, tok, NOT_PRECEDENCE, False))
+				level = LEVEL_COMP
+				continue
+
+			elif tok.type in (TT_PLUS, TT_MINUS):
+				self.advance()
+				ops.append((OP_PREFIX, tok, UNARY_PRECEDENCE, False))
+				level = LEVEL_ARITH
+				continue
+
+			elif tok.type == TT_LPAREN:
+				self.advance()
+				ops.append((OP_PAREN, tok, 0, False))
+				open_parens += 1
+				level = LEVEL_EXPR
+				continue
+
+			elif tok.type in (TT_INT, TT_FLOAT):
+				nodes.append(self.make_number(tok))
+				self.advance()
+			elif tok.type == TT_IDENTIFIER:
+				nodes.append(self.make_var_access(tok))
+				self.advance()
+			elif tok.type == TT_KEYWORD and tok.value in ('IF', 'FOR', 'WHILE', 'FUN'):
+				# Parser.atom hands these to if_expr, for_expr, while_expr
+				# and func_def.
+				node = res.register(self.atom())
+				if res.error: return res
+				nodes.append(node)
+			else:
+				return res.failure(InvalidSyntaxError(
+					tok.pos_start, tok.pos_end,
+					"Expected int, float, identifier, '+', '-', '(', 'IF', 'FOR', 'WHILE' or 'FUN'"
+				))
+			called = False
+
+			# After an operand: close parentheses and apply a call until the
+			# next binary operator, or finish at the first token that cannot
+			# continue the expression.
+			while True:
+				tok = self.current_tok
+				key = (tok.type, tok.value) if tok.type == TT_KEYWORD else tok.type
+				precedence = BINARY_PRECEDENCE.get(key)
+
+				if tok.type == TT_LPAREN and not called:
+					# A call takes the atom (or parenthesized expression)
+					# just completed.
+					arg_nodes = res.register(self.call_args())
+					if res.error: return res
+					nodes.append(self.make_call(nodes.pop(), arg_nodes))
+					called = True
+
+				elif precedence is not None:
+					self.reduce(nodes, ops, precedence)
+					ops.append((OP_BINARY, tok, precedence, tok.type not in RIGHT_ASSOCIATIVE))
+					self.advance()
+					level = LEVEL_COMP if precedence == LOGIC_PRECEDENCE else LEVEL_ARITH
+					break
+
+				elif tok.type == TT_RPAREN and open_parens:
+					self.reduce(nodes, ops, 0)
+					ops.pop()
+					open_parens -= 1
+					self.advance()
+					called = False
+
+				elif open_parens:
+					return res.failure(InvalidSyntaxError(
+						tok.pos_start, tok.pos_end,
+						"Expected ')'"
+					))
+
+				else:
+					self.reduce(nodes, ops, 0)
+					return res.success(nodes.pop())
+
+	def reduce(self, nodes, ops, precedence):
+		# Pops and builds every pending operator, back to the innermost open
+		# parenthesis, that binds tighter than an operator of the given
+		# precedence (or as tight, when it is left associative).
+		while ops:
+			kind, tok, op_precedence, left_associative = ops[-1]
+			if kind == OP_PAREN: break
+			if op_precedence < precedence or (op_precedence == precedence and not left_associative): break
+			ops.pop()
+
+			if kind == OP_BINARY:
+				right = nodes.pop()
+				nodes.append(self.make_bin_op(nodes.pop(), tok, right))
+			elif kind == OP_PREFIX:
+				nodes.append(self.make_unary_op(tok, nodes.pop()))
+			else:
+				nodes.append(self.make_var_assign(tok, nodes.pop()))
+#######################################
+# RUNTIME RESULT
+#######################################
+
+class RTResult:
+	def __init__(self):
+		self.value = None
+		self.error = None
+
+	def register(self, res):
+		if res.error: self.error = res.error
+		return res.value
+
+	def success(self, value):
+		self.value = value
+		return self
+
+	def failure(self, error):
+		self.error = error
+		return self
+#######################################
+# VALUES
+#######################################
+
+def power(base, exponent):
+	# base ** exponent as (value, error). Python raises for 0 to a negative
+	# power and for floats out of range, and makes a complex number of a
+	# negative base to a fractional power; all evaluators report those as
+	# errors instead.
+	try:
+		value = base ** exponent
+	except ZeroDivisionError:
+		return None, 'Division by zero'
+	except OverflowError:
+		return None, 'Result out of range'
+	if type(value) is complex:
+		return None, 'Result is not a real number'
+	return value, None
+
+def arithmetic(operation, left, right):
+	# operation(left, right) as (value, error). Ints too large for a float
+	# make mixed int/float arithmetic (and int division) raise; that is
+	# reported like a power out of range.
+	try:
+		return operation(left, right), None
+	except OverflowError:
+		return None, 'Result out of range'
+
+def printable_int(value):
+	# Whether str(value) works: CPython refuses ints with more digits than
+	# sys.get_int_max_str_digits() (0 is no limit).
+	limit = sys.get_int_max_str_digits() if hasattr(sys, 'get_int_max_str_digits') else 0
+	return limit == 0 or value.bit_length() * math.log10(2) + 1 <= limit
+
+def format_number(value):
+	# str() of a number value, or hex for an int too long for str().
+	if type(value) is int and not printable_int(value):
+		return hex(value)
+	return str(value)
+
+class Number:
+	# An immutable value. Positions and context are not stored on it (errors
+	# are reported at the node being evaluated), so one Number can be shared
+	# by every expression and variable that holds the same value. Number.of
+	# returns interned instances for small ints, which covers NULL, TRUE,
+	# FALSE and every comparison or logic result. Arithmetic returns
+	# (result, error) where error is the details of a runtime error.
+	__slots__ = ('value', )
+
+	def __init__(self, value):
+		self.value = value
+
+	@staticmethod
+	def of(value):
+		if type(value) is int and SMALL_INT_MIN <= value <= SMALL_INT_MAX:
+			return SMALL_INTS[value - SMALL_INT_MIN]
+		return Number(value)
+
+	def added_to(self, other):
+		if isinstance(other, Number):
+			try:
+				return Number.of(self.value + other.value), None
+			except OverflowError:
+				return None, 'Result out of range'
+
+	def subbed_by(self, other):
+		if isinstance(other, Number):
+			try:
+				return Number.of(self.value - other.value), None
+			except OverflowError:
+				return None, 'Result out of range'
+
+	def multed_by(self, other):
+		if isinstance(other, Number):
+			try:
+				return Number.of(self.value * other.value), None
+			except OverflowError:
+				return None, 'Result out of range'
+
+	def dived_by(self, other):
+		if isinstance(other, Number):
+			if other.value == 0:
+				return None, 'Division by zero'
+
+			try:
+				return Number(self.value / other.value), None
+			except OverflowError:
+				return None, 'Result out of range'
+
+	def powed_by(self, other):
+		if isinstance(other, Number):
+			value, error = power(self.value, other.value)
+			if error: return None, error
+			return Number.of(value), None
+
+	def get_comparison_eq(self, other):
+		if isinstance(other, Number):
+			return TRUTH[self.value == other.value], None
+
+	def get_comparison_lt(self, other):
+		if isinstance(other, Number):
+			return TRUTH[self.value < other.value], None
+
+	def get_comparison_gt(self, other):
+		if isinstance(other, Number):
+			return TRUTH[self.value > other.value], None
+
+	def get_comparison_lte(self, other):
+		if isinstance(other, Number):
+			return TRUTH[self.value <= other.value], None
+
+	def get_comparison_gte(self, other):
+		if isinstance(other, Number):
+			return TRUTH[self.value >= other.value], None
+
+	def anded_by(self, other):
+		if isinstance(other, Number):
+			return TRUTH[bool(self.value) and bool(other.value)], None
+
+	def ored_by(self, other):
+		if isinstance(other, Number):
+			return TRUTH[bool(self.value) or bool(other.value)], None
+
+	def notted(self):
+		return TRUTH[not self.value], None
+
+	def negated(self):
+		return Number.of(-self.value), None
+
+	def __repr__(self):
+		return format_number(self.value)
+
+SMALL_INT_MIN = -5
+SMALL_INT_MAX = 256
+SMALL_INTS = tuple(Number(value) for value in range(SMALL_INT_MIN, SMALL_INT_MAX + 1))
+
+# Number for a Python truth value: TRUTH[True] is 1, TRUTH[False] is 0.
+TRUTH = {False: Number.of(0), True: Number.of(1)}
+
+class Function:
+	# A function value: what a FUN expression evaluates to. Calls run the
+	# body in a new symbol table on top of symbol_table, the table of the
+	# context the function was defined in.
+	__slots__ = ('name', 'arg_names', 'body_node', 'node', 'symbol_table')
+
+	def __init__(self, node, symbol_table):
+		self.name = node.var_name_tok.value if node.var_name_tok else '<anonymous>'
+		self.arg_names = tuple(tok.value for tok in node.arg_name_toks)
+		self.body_node = node.body_node
+		self.node = node
+		self.symbol_table = symbol_table
+
+	def notted(self):
+		return None, 'Illegal operation'
+
+	def negated(self):
+		return None, 'Illegal operation'
+
+	def __repr__(self):
+		return f'<function {self.name}>'
+
+def is_true(value):
+	return not isinstance(value, Number) or value.value != 0
+
+def memo_key(function, args):
+	# None when the function's own name no longer holds a function of the
+	# same node: its recursive calls would run something else, so the
+	# result is not its own. Floats are keyed by their hex form, so 1 and
+	# 1.0 (and 0.0 and -0.0) get separate entries.
+	if function.node.var_name_tok:
+		callee = function.symbol_table.get(function.name)
+		if not isinstance(callee, Function) or callee.node is not function.node:
+			return None
+	key = [function.node]
+	for arg in args:
+		value = arg.value if isinstance(arg, Number) else arg
+		key.append(value.hex() if type(value) is float else value)
+	return tuple(key)
+
+#######################################
+# CONTEXT
+#######################################
+
+class Context:
+	# budget (see Limits) and memo (an LRUCache of pure function results)
+	# are shared with every context of the calls made from this one.
+	def __init__(self, display_name, parent=None, parent_entry_pos=None):
+		self.display_name = display_name
+		self.parent = parent
+		self.parent_entry_pos = parent_entry_pos
+		if parent is None:
+			self.depth = 0
+			self.budget = None
+			self.memo = None
+		else:
+			self.depth = parent.depth + 1
+			self.budget = parent.budget
+			self.memo = parent.memo
+
+#######################################
+# LIMITS
+#######################################
+
+# Steps between two looks at the clock.
+CHECK_INTERVAL = 1024
+
+class Limits:
+	# Execution budget of one run: at most max_steps steps (node visits, or
+	# instructions in the VM), at most timeout seconds of wall time, and no
+	# product or power over max_int_bits bits (for floats: 2 ** max_int_bits
+	# in magnitude). None means unlimited.
+	def __init__(self, max_steps=None, timeout=None, max_int_bits=None, check_interval=CHECK_INTERVAL):
+		self.max_steps = max_steps
+		self.timeout = timeout
+		self.max_int_bits = max_int_bits
+		self.check_interval = check_interval
+
+	def operation_error(self, op_type, left, right):
+		# Powers and products are checked before they are computed, from the
+		# size of their operands; sums grow by at most one bit per step.
+		# Floats are held to the same cap, as a magnitude of 2 ** max_int_bits,
+		# so they fail here instead of overflowing, as do ints converted to
+		# floats.
+		max_bits = self.max_int_bits
+		if max_bits is None or type(left) not in (int, float) or type(right) not in (int, float):
+			return None
+		if any(type(value) is float and not math.isfinite(value) for value in (left, right)):
+			return None
+		if op_type in (TT_PLUS, TT_MINUS, TT_MUL, TT_DIV) and self.float_overflows(op_type, left, right):
+			return 'Result out of range'
+
+		if op_type == TT_POW:
+			# log2 of the result is right * bits; right is compared rather than
+			# multiplied, as it may be an int too large for a float.
+			bits = math.log2(abs(left)) if left else 0
+			if (bits > 0 and right >= max_bits / bits) or (bits < 0 and right <= max_bits / bits):
+				return f'Result of power exceeds {max_bits} bits'
+		elif op_type == TT_MUL:
+			if type(left) is int and type(right) is int:
+				if left.bit_length() + right.bit_length() - 1 > max_bits:
+					return f'Result of multiplication exceeds {max_bits} bits'
+			elif left and right:
+				bits = math.log2(abs(left)) + math.log2(abs(right))
+				if bits > max_bits:
+					return f'Result of multiplication exceeds {max_bits} bits'
+				if bits >= sys.float_info.max_exp:
+					return 'Result out of range'
+		return None
+
+	def float_overflows(self, op_type, left, right):
+		# An int meets a float by being converted to one, and an int quotient
+		# is a float; both overflow past sys.float_info.max_exp bits.
+		max_exp = sys.float_info.max_exp
+		if type(left) is not type(right):
+			value = left if type(left) is int else right
+			return value.bit_length() > max_exp
+		if op_type == TT_DIV and type(left) is int and right:
+			return left.bit_length() - right.bit_length() > max_exp
+		return False
+
+class Budget:
+	# What is left of a Limits during one run. Evaluators bump steps and
+	# only call exceeded() once steps reaches next_check, so the common case
+	# is one comparison per step.
+	def __init__(self, limits):
+		self.limits = limits
+		self.steps = 0
+		self.deadline = time.perf_counter() + limits.timeout if limits.timeout is not None else None
+		self.next_check = 1
+
+	def exceeded(self):
+		limits = self.limits
+		if limits.max_steps is not None and self.steps > limits.max_steps:
+			return f'Step limit of {limits.max_steps} exceeded'
+		if self.deadline is not None and time.perf_counter() > self.deadline:
+			return f'Time limit of {limits.timeout}s exceeded'
+
+		self.next_check = self.steps + limits.check_interval
+		if limits.max_steps is not None:
+			self.next_check = min(self.next_check, limits.max_steps + 1)
+		return None
+#######################################
+# SYMBOL TABLE
+#######################################
+
+# Value of a slot whose name has been removed.
+UNSET = object()
+
+class SymbolTable:
+	# Values live in a list and slots maps each name to its index. A slot is
+	# never reused for another name, so addresses resolved against a table
+	# stay valid until a new name is declared anywhere, which bumps
+	# layout_version.
+	layout_version = 0
+
+	def __init__(self, parent=None):
+		self.slots = {}
+		self.values = []
+		self.parent = parent
+
+	def declare(self, name):
+		slot = self.slots.get(name)
+		if slot is None:
+			slot = self.slots[name] = len(self.values)
+			self.values.append(UNSET)
+			SymbolTable.layout_version += 1
+		return slot
+
+	def get(self, name):
+		table = self
+		while table is not None:
+			slot = table.slots.get(name)
+			if slot is not None and table.values[slot] is not UNSET:
+				return table.values[slot]
+			table = table.parent
+		return None
+
+	def set(self, name, value):
+		self.values[self.declare(name)] = value
+
+	def remove(self, name):
+		self.values[self.slots[name]] = UNSET
+
+	def resolve(self, name):
+		# (depth, slot) of name in the nearest table that declares it, or
+		# None.
+		table = self
+		depth = 0
+		while table is not None:
+			slot = table.slots.get(name)
+			if slot is not None:
+				return depth, slot
+			table = table.parent
+			depth += 1
+		return None
+
+	def frame(self, depth):
+		table = self
+		for _ in range(depth):
+			table = table.parent
+		return table.values
+
+	def bind(self, names, binding=None):
+		# A Binding of names to this table, reusing binding while it is
+		# still valid.
+		if binding is not None and binding.symbol_table is self and binding.version == SymbolTable.layout_version:
+			return binding
+		return Binding(self, names)
+
+class Binding:
+	# The addresses of a compiled program's names (Resolver.names) in one
+	# symbol table chain: the value list and slot each one is read from, or
+	# None for a name no table declares.
+	def __init__(self, symbol_table, names):
+		self.symbol_table = symbol_table
+		self.names = names
+		self.version = SymbolTable.layout_version
+		self.addresses = []
+		for name in names:
+			address = symbol_table.resolve(name)
+			if address is None:
+				self.addresses.append(None)
+			else:
+				depth, slot = address
+				self.addresses.append((symbol_table.frame(depth), slot))
+
+	def load(self):
+		# The plain value of every name, in Resolver order, with None for
+		# undefined names, or None if one of them holds a Function. A removed
+		# value falls back to a full lookup, which finds it in an outer table
+		# if there is one.
+		slots = []
+		for name, address in zip(self.names, self.addresses):
+			if address is None:
+				slots.append(None)
+				continue
+			values, slot = address
+			value = values[slot]
+			if value is UNSET:
+				value = self.symbol_table.get(name)
+			if value is None:
+				slots.append(None)
+			elif isinstance(value, Number):
+				slots.append(value.value)
+			else:
+				# Compiled code only handles numbers; the caller falls back
+				# to the Interpreter.
+				return None
+		return slots
+
+#######################################
+# RESOLVER
+#######################################
+
+class Resolver:
+	# Numbers the variable names of a program at compile time. Compiled
+	# code reads a variable as slots[index]; the slots come from a Binding
+	# of these names to the symbol table the program runs against, which
+	# maps each name to a (depth, slot) address once per table.
+	def __init__(self):
+		self.names = []
+		self.indexes = {}
+
+	def resolve(self, node):
+		for current in walk_nodes(node):
+			if isinstance(current, (VarAccessNode, VarAssignNode, ForNode)):
+				name = current.var_name_tok.value
+				if name not in self.indexes:
+					self.indexes[name] = len(self.names)
+					self.names.append(name)
+		self.names = tuple(self.names)
+		return self
+# Calls nested deeper than this fail with a runtime error instead of
+# growing the interpreter's frame stack without bound.
+MAX_CALL_DEPTH = 100000
+
+class Interpreter:
+	# visit_<Node> methods are generators: they yield (node, context) for
+	# every subexpression they need, are sent its RTResult back, and return
+	# their own RTResult. visit drives them from an explicit stack of frames,
+	# so neither deep trees nor deep recursion of user functions grows the
+	# Python stack. Leaf nodes are plain methods that return an RTResult
+	# straight away.
+	def visit(self, node, context):
+		frames = []
+		outcome = self.enter(node, context)
+
+		while True:
+			if outcome.__class__ is RTResult:
+				if not frames:
+					return outcome
+				frame = frames[-1]
+			else:
+				frame = outcome
+				frames.append(frame)
+				outcome = None
+
+			try:
+				node, context = frame.send(outcome)
+			except StopIteration as stop:
+				frames.pop()
+				outcome = stop.value
+				continue
+			outcome = self.enter(node, context)
+
+	def enter(self, node, context):
+		method_name = f'visit_{type(node).__name__}'
+		method = getattr(self, method_name, self.no_visit_method)
+		return method(node, context)
+
+	def no_visit_method(self, node, context):
+		raise Exception(f'No visit_{type(node).__name__} method defined')
+
+	###################################
+
+	def visit_NumberNode(self, node, context):
+		return RTResult().success(Number.of(node.tok.value))
+
+	def visit_VarAccessNode(self, node, context):
+		res = RTResult()
+		var_name = node.var_name_tok.value
+		value = context.symbol_table.get(var_name)
+
+		if not value:
+			return res.failure(RTError(
+				node.var_name_tok.pos_start, node.var_name_tok.pos_end,
+				f"'{var_name}' is not defined",
+				context
+			))
+
+		return res.success(value)
+
+	def visit_VarAssignNode(self, node, context):
+		res = RTResult()
+		var_name = node.var_name_tok.value
+		value = res.register((yield node.value_node, context))
+		if res.error: return res
+
+		context.symbol_table.set(var_name, value)
+		return res.success(value)
+
+	def visit_BinOpNode(self, node, context):
+		res = RTResult()
+		left = res.register((yield node.left_node, context))
+		if res.error: return res
+		right = res.register((yield node.right_node, context))
+		if res.error: return res
+
+		result, error = self.operate(node.op_tok, left, right)
+		if error:
+			# Division by zero is reported at the divisor.
+			error_node = node.right_node if node.op_tok.type == TT_DIV else node
+			return res.failure(RTError(error_node.pos_start, error_node.pos_end, error, context))
+		else:
+			return res.success(result)
+
+	def operate(self, op_tok, left, right):
+		if not isinstance(left, Number) or not isinstance(right, Number):
+			return None, 'Illegal operation'
+		elif op_tok.type == TT_PLUS:
+			return left.added_to(right)
+		elif op_tok.type == TT_MINUS:
+			return left.subbed_by(right)
+		elif op_tok.type == TT_MUL:
+			return left.multed_by(right)
+		elif op_tok.type == TT_DIV:
+			return left.dived_by(right)
+		elif op_tok.type == TT_POW:
+			return left.powed_by(right)
+		elif op_tok.type == TT_EE:
+			return left.get_comparison_eq(right)
+		elif op_tok.type == TT_LT:
+			return left.get_comparison_lt(right)
+		elif op_tok.type == TT_GT:
+			return left.get_comparison_gt(right)
+		elif op_tok.type == TT_LTE:
+			return left.get_comparison_lte(right)
+		elif op_tok.type == TT_GTE:
+			return left.get_comparison_gte(right)
+		elif op_tok.matches(TT_KEYWORD, 'AND'):
+			return left.anded_by(right)
+		elif op_tok.matches(TT_KEYWORD, 'OR'):
+			return left.ored_by(right)
+
+	def visit_UnaryOpNode(self, node, context):
+		res = RTResult()
+		number = res.register((yield node.node, context))
+		if res.error: return res
+
+		error = None
+
+		if node.op_tok.type == TT_MINUS:
+			number, error = number.negated()
+		elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+			number, error = number.notted()
+
+		if error:
+			return res.failure(RTError(node.pos_start, node.pos_end, error, context))
+		else:
+			return res.success(number)
+
+	def visit_IfNode(self, node, context):
+		res = RTResult()
+
+		for condition_node, expr_node in node.cases:
+			condition = res.register((yield condition_node, context))
+			if res.error: return res
+
+			if is_true(condition):
+				value = res.register((yield expr_node, context))
+				if res.error: return res
+				return res.success(value)
+
+		if node.else_case:
+			value = res.register((yield node.else_case, context))
+			if res.error: return res
+			return res.success(value)
+
+		return res.success(Number.of(0))
+
+	def visit_ForNode(self, node, context):
+		result = self.run_compiled_loop(node, context)
+		if result is not None:
+			return result
+		return self.for_loop(node, context)
+
+	def visit_WhileNode(self, node, context):
+		result = self.run_compiled_loop(node, context)
+		if result is not None:
+			return result
+		return self.while_loop(node, context)
+
+	def run_compiled_loop(self, node, context):
+		# Loops made of COMPILED_NODES only are compiled once, on first use,
+		# and run by the Compiler's closures on native numbers in resolved
+		# slots. None when the loop contains other nodes or reads a variable
+		# bound to a function; for_loop and while_loop run it then.
+		limited = context.budget is not None
+		program = node.limited if limited else node.compiled
+		if program is None:
+			if compilable(node):
+				program = Compiler(limited).compile_program(node)
+			else:
+				program = False
+			if limited:
+				node.limited = program
+			else:
+				node.compiled = program
+
+		if program is False:
+			return None
+		return program.execute(context)
+
+	def for_loop(self, node, context):
+		res = RTResult()
+		values = []
+		for value_node in (node.start_value_node, node.end_value_node, node.step_value_node):
+			if value_node is None:
+				values.append(1)
+				continue
+
+			value = res.register((yield value_node, context))
+			if res.error: return res
+			if not isinstance(value, Number):
+				return res.failure(RTError(value_node.pos_start, value_node.pos_end, 'Illegal operation', context))
+			values.append(value.value)
+
+		start_value, end_value, step_value = values
+		if step_value == 0:
+			step_node = node.step_value_node
+			return res.failure(RTError(step_node.pos_start, step_node.pos_end, 'Loop step is zero', context))
+
+		var_name = node.var_name_tok.value
+		for value in loop_values(start_value, end_value, step_value):
+			context.symbol_table.set(var_name, Number.of(value))
+			res.register((yield node.body_node, context))
+			if res.error: return res
+
+		return res.success(Number.of(0))
+
+	def while_loop(self, node, context):
+		res = RTResult()
+
+		while True:
+			condition = res.register((yield node.condition_node, context))
+			if res.error: return res
+			if not is_true(condition): break
+
+			res.register((yield node.body_node, context))
+			if res.error: return res
+
+		return res.success(Number.of(0))
+
+	def visit_FlatAST(self, node, context):
+		return FlatInterpreter(self).run(node, context)
+
+	def visit_FuncDefNode(self, node, context):
+		function = Function(node, context.symbol_table)
+		if node.var_name_tok:
+			context.symbol_table.set(function.name, function)
+		return RTResult().success(function)
+
+	def visit_CallNode(self, node, context):
+		res = RTResult()
+		function = res.register((yield node.node_to_call, context))
+		if res.error: return res
+
+		args = []
+		for arg_node in node.arg_nodes:
+			args.append(res.register((yield arg_node, context)))
+			if res.error: return res
+
+		if not isinstance(function, Function):
+			return res.failure(RTError(
+				node.node_to_call.pos_start, node.node_to_call.pos_end,
+				f"'{function!r}' is not a function",
+				context
+			))
+
+		if len(args) != len(function.arg_names):
+			count = len(args) - len(function.arg_names)
 			return res.failure(RTError(
 				node.pos_start, node.pos_end,
-				f"'{var_name}' is not defined",
+				f"{abs(count)} too {'many' if count > 0 else 'few'} args passed into '{function.name}'",
+				context
+			))
+
+		if context.depth >= MAX_CALL_DEPTH:
+			return res.failure(RTError(
+				node.pos_start, node.pos_end,
+				'Maximum call depth exceeded',
 				context
 			))
 
-		value = value.copy().set_pos(node.pos_start, node.pos_end)
-		return res.success(value)
+		# Pure functions are memoized on their arguments when the run has a
+		# memo cache; errors are never cached.
+		memo = context.memo
+		key = None
+		if memo is not None:
+			if function.node.pure is None:
+				function.node.pure = pure_function(function.node)
+			if function.node.pure:
+				key = memo_key(function, args)
+				value = memo.get(key) if key is not None else None
+				if value is not None:
+					return res.success(value)
+
+		call_context = Context(function.name, context, node.pos_start)
+		call_context.symbol_table = SymbolTable(function.symbol_table)
+		for arg_name, arg in zip(function.arg_names, args):
+			call_context.symbol_table.set(arg_name, arg)
+
+		value = res.register((yield function.body_node, call_context))
+		if res.error: return res
+
+		if key is not None:
+			memo.put(key, value)
+		return res.success(value)
+
+class LimitedInterpreter(Interpreter):
+	# Interpreter that charges every visit to a Budget and refuses powers
+	# and products over its integer size limit.
+	def __init__(self, budget):
+		self.budget = budget
+
+	def enter(self, node, context):
+		budget = self.budget
+		budget.steps += 1
+		if budget.steps >= budget.next_check:
+			error = budget.exceeded()
+			if error:
+				return RTResult().failure(RTError(node.pos_start, node.pos_end, error, context))
+		return super().enter(node, context)
+
+	def operate(self, op_tok, left, right):
+		if isinstance(left, Number) and isinstance(right, Number):
+			error = self.budget.limits.operation_error(op_tok.type, left.value, right.value)
+			if error: return None, error
+		return super().operate(op_tok, left, right)
+
+#######################################
+# COMPILER
+#######################################
+
+# The node types the Compiler handles, and the smaller set the
+# BytecodeCompiler and the batch evaluators handle. Programs with other
+# nodes (FUN and calls) run on the Interpreter.
+ARITHMETIC_NODES = (NumberNode, VarAccessNode, VarAssignNode, BinOpNode, UnaryOpNode)
+COMPILED_NODES = ARITHMETIC_NODES + (IfNode, ForNode, WhileNode)
+
+def compilable(node):
+	# Whether the Compiler takes node: only COMPILED_NODES, and shallow
+	# enough for its closures, which recurse once per level both when built
+	# and when run, to stay clear of the recursion limit.
+	node_types = {type(current) for current in walk_nodes(node)}
+	return node_types.issubset(COMPILED_NODES) and tree_depth(node) <= sys.getrecursionlimit() // 4
+
+def loop_values(start, end, step):
+	# The values a FOR loop variable takes: from start up to (or, with a
+	# negative step, down to) end, not including end. step is not 0.
+	if type(start) is int and type(end) is int and type(step) is int:
+		return range(start, end, step)
+	return float_loop_values(start, end, step)
+
+def float_loop_values(start, end, step):
+	value = start
+	if step > 0:
+		while value < end:
+			yield value
+			value += step
+	else:
+		while value > end:
+			yield value
+			value += step
+
+class RTErrorSignal(Exception):
+	# Carries an RTError out of compiled code, which has no RTResult to
+	# fail through.
+	def __init__(self, error):
+		super().__init__(error.details)
+		self.error = error
+
+class CompiledProgram:
+	def __init__(self, node, code, names):
+		self.node = node
+		self.code = code
+		self.names = names
+		self.binding = None
+
+	def execute(self, context):
+		res = RTResult()
+		self.binding = binding = context.symbol_table.bind(self.names, self.binding)
+		slots = binding.load()
+		if slots is None: return None
+		try:
+			value = self.code(context, slots)
+		except RTErrorSignal as signal:
+			return res.failure(signal.error)
+
+		return res.success(Number.of(value))
+
+class Compiler:
+	# Turns an AST into nested closures once, so evaluating it again skips
+	# the visit dispatch and works on plain Python numbers. Each closure
+	# takes the Context and the program's variable slots (see Resolver) and
+	# returns the value; runtime errors are raised as RTErrorSignal with the
+	# same RTError the Interpreter would return. A limited program charges
+	# every node to context.budget, like the LimitedInterpreter.
+	def __init__(self, limited=False):
+		self.limited = limited
+		self.in_loop = False
+
+	def compile_program(self, node):
+		self.resolver = Resolver().resolve(node)
+		return CompiledProgram(node, self.compile(node), self.resolver.names)
+
+	def compile(self, node):
+		method_name = f'compile_{type(node).__name__}'
+		method = getattr(self, method_name, self.no_compile_method)
+		code = method(node)
+		if self.limited:
+			code = self.charge(node, code)
+		return code
+
+	def charge(self, node, code):
+		def charged(context, slots):
+			budget = context.budget
+			budget.steps += 1
+			if budget.steps >= budget.next_check:
+				error = budget.exceeded()
+				if error:
+					raise RTErrorSignal(RTError(node.pos_start, node.pos_end, error, context))
+			return code(context, slots)
+
+		return charged
+
+	def checked(self, node, operation, left, right):
+		# Power or product of a limited program, refused before it is
+		# computed when the result would be too large.
+		op_type = node.op_tok.type
+
+		def checked_operation(context, slots):
+			left_value = left(context, slots)
+			right_value = right(context, slots)
+			error = context.budget.limits.operation_error(op_type, left_value, right_value)
+			if error:
+				raise RTErrorSignal(RTError(node.pos_start, node.pos_end, error, context))
+			return operation(context, left_value, right_value)
+
+		return checked_operation
+
+	def out_of_range(self, node, context):
+		return RTErrorSignal(RTError(node.pos_start, node.pos_end, 'Result out of range', context))
+
+	def power_operation(self, node):
+		def power_operation(context, base, exponent):
+			value, error = power(base, exponent)
+			if error:
+				raise RTErrorSignal(RTError(node.pos_start, node.pos_end, error, context))
+			return value
+
+		return power_operation
+
+	def no_compile_method(self, node):
+		raise Exception(f'No compile_{type(node).__name__} method defined')
+
+	###################################
+
+	def compile_NumberNode(self, node):
+		value = node.tok.value
+		return lambda context, slots: value
+
+	def compile_VarAccessNode(self, node):
+		var_name_tok = node.var_name_tok
+		var_name = var_name_tok.value
+		index = self.resolver.indexes[var_name]
+
+		def var_access(context, slots):
+			value = slots[index]
+			if value is None:
+				raise RTErrorSignal(RTError(
+					var_name_tok.pos_start, var_name_tok.pos_end,
+					f"'{var_name}' is not defined",
+					context
+				))
+			return value
+
+		return var_access
+
+	def compile_VarAssignNode(self, node):
+		var_name = node.var_name_tok.value
+		value_node = node.value_node
+		value_code = self.compile(value_node)
+		index = self.resolver.indexes[var_name]
+
+		if self.in_loop:
+			# Written to the symbol table when the loop ends (see
+			# compile_loop).
+			def loop_var_assign(context, slots):
+				value = slots[index] = value_code(context, slots)
+				return value
+
+			return loop_var_assign
+
+		def var_assign(context, slots):
+			value = value_code(context, slots)
+			slots[index] = value
+			context.symbol_table.set(var_name, Number.of(value))
+			return value
+
+		return var_assign
+
+	def compile_BinOpNode(self, node):
+		left = self.compile(node.left_node)
+		right = self.compile(node.right_node)
+		op_type = node.op_tok.type
+
+		# Ints too large for a float raise OverflowError in mixed int/float
+		# arithmetic; the try blocks cost nothing until that happens.
+		if self.limited and op_type in (TT_MUL, TT_POW):
+			if op_type == TT_MUL:
+				def mul_operation(context, left_value, right_value):
+					try:
+						return left_value * right_value
+					except OverflowError:
+						raise self.out_of_range(node, context)
+
+				return self.checked(node, mul_operation, left, right)
+			return self.checked(node, self.power_operation(node), left, right)
+		elif op_type == TT_PLUS:
+			def add(context, slots):
+				try:
+					return left(context, slots) + right(context, slots)
+				except OverflowError:
+					raise self.out_of_range(node, context)
+
+			return add
+		elif op_type == TT_MINUS:
+			def sub(context, slots):
+				try:
+					return left(context, slots) - right(context, slots)
+				except OverflowError:
+					raise self.out_of_range(node, context)
+
+			return sub
+		elif op_type == TT_MUL:
+			def mul(context, slots):
+				try:
+					return left(context, slots) * right(context, slots)
+				except OverflowError:
+					raise self.out_of_range(node, context)
+
+			return mul
+		elif op_type == TT_POW:
+			operation = self.power_operation(node)
+			return lambda context, slots: operation(context, left(context, slots), right(context, slots))
+		elif op_type in COMPARISON_OPERATORS:
+			compare = COMPARISON_OPERATORS[op_type]
+			return lambda context, slots: int(compare(left(context, slots), right(context, slots)))
+		elif node.op_tok.matches(TT_KEYWORD, 'AND'):
+			# Both sides are always evaluated, like in the Interpreter.
+			return lambda context, slots: int(bool(left(context, slots)) & bool(right(context, slots)))
+		elif node.op_tok.matches(TT_KEYWORD, 'OR'):
+			return lambda context, slots: int(bool(left(context, slots)) | bool(right(context, slots)))
+		elif op_type == TT_DIV:
+			right_node = node.right_node
+
+			def div(context, slots):
+				dividend = left(context, slots)
+				divisor = right(context, slots)
+				if divisor == 0:
+					raise RTErrorSignal(RTError(
+						right_node.pos_start, right_node.pos_end,
+						'Division by zero',
+						context
+					))
+				try:
+					return dividend / divisor
+				except OverflowError:
+					raise self.out_of_range(right_node, context)
+
+			return div
+
+		raise Exception(f'No compiled form for operator {op_type}')
+
+	def compile_UnaryOpNode(self, node):
+		operand = self.compile(node.node)
+
+		if node.op_tok.type == TT_MINUS:
+			return lambda context, slots: -operand(context, slots)
+		elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+			return lambda context, slots: int(not operand(context, slots))
+		return operand
+
+	def compile_IfNode(self, node):
+		cases = [(self.compile(condition), self.compile(expr)) for condition, expr in node.cases]
+		else_code = self.compile(node.else_case) if node.else_case else None
+
+		def if_expr(context, slots):
+			for condition, expr in cases:
+				if condition(context, slots):
+					return expr(context, slots)
+			if else_code is not None:
+				return else_code(context, slots)
+			return 0
+
+		return if_expr
+
+	def compile_ForNode(self, node):
+		return self.compile_loop(node, self.for_loop)
+
+	def compile_WhileNode(self, node):
+		return self.compile_loop(node, self.while_loop)
+
+	def compile_loop(self, node, make_loop):
+		# Inside loops, assignments (and the loop variable) only go to the
+		# slots. The outermost loop writes every variable that changed to
+		# the symbol table once, when it ends or fails, instead of a Number
+		# and a set per iteration. Loops evaluate to 0 (NULL): the values
+		# of their bodies are dropped.
+		if self.in_loop:
+			return make_loop(node)
+
+		self.in_loop = True
+		try:
+			loop = make_loop(node)
+		finally:
+			self.in_loop = False
+
+		assigned = {
+			current.var_name_tok.value
+			for current in walk_nodes(node)
+			if isinstance(current, (VarAssignNode, ForNode))
+		}
+		indexes = tuple((name, self.resolver.indexes[name]) for name in sorted(assigned))
+
+		def outer_loop(context, slots):
+			before = [slots[index] for _, index in indexes]
+			try:
+				return loop(context, slots)
+			finally:
+				symbol_table = context.symbol_table
+				for (name, index), value in zip(indexes, before):
+					if slots[index] is not value:
+						symbol_table.set(name, Number.of(slots[index]))
+
+		return outer_loop
+
+	def for_loop(self, node):
+		start = self.compile(node.start_value_node)
+		end = self.compile(node.end_value_node)
+		step = self.compile(node.step_value_node) if node.step_value_node else None
+		body = self.compile(node.body_node)
+		index = self.resolver.indexes[node.var_name_tok.value]
+		step_node = node.step_value_node
+
+		def for_loop(context, slots):
+			start_value = start(context, slots)
+			end_value = end(context, slots)
+			step_value = 1
+			if step is not None:
+				step_value = step(context, slots)
+				if step_value == 0:
+					raise RTErrorSignal(RTError(
+						step_node.pos_start, step_node.pos_end,
+						'Loop step is zero',
+						context
+					))
+
+			for value in loop_values(start_value, end_value, step_value):
+				slots[index] = value
+				body(context, slots)
+			return 0
+
+		return for_loop
+
+	def while_loop(self, node):
+		condition = self.compile(node.condition_node)
+		body = self.compile(node.body_node)
+
+		def while_loop(context, slots):
+			while condition(context, slots):
+				body(context, slots)
+			return 0
+
+		return while_loop
+
+#######################################
+# BYTECODE
+#######################################
+
+# Every instruction is two entries of BytecodeProgram.code: the opcode and
+# its argument (a constant or name index, 0 when unused).
+OP_LOAD_CONST = 0
+OP_LOAD_VAR = 1
+OP_STORE_VAR = 2
+OP_ADD = 3
+OP_SUB = 4
+OP_MUL = 5
+OP_DIV = 6
+OP_POW = 7
+OP_NEG = 8
+OP_EE = 9
+OP_LT = 10
+OP_GT = 11
+OP_LTE = 12
+OP_GTE = 13
+OP_AND = 14
+OP_OR = 15
+OP_NOT = 16
+
+BINARY_OPCODES = {
+	TT_PLUS: OP_ADD,
+	TT_MINUS: OP_SUB,
+	TT_MUL: OP_MUL,
+	TT_DIV: OP_DIV,
+	TT_POW: OP_POW,
+	TT_EE: OP_EE,
+	TT_LT: OP_LT,
+	TT_GT: OP_GT,
+	TT_LTE: OP_LTE,
+	TT_GTE: OP_GTE,
+	(TT_KEYWORD, 'AND'): OP_AND,
+	(TT_KEYWORD, 'OR'): OP_OR,
+}
+
+BYTECODE_MAGIC = b'BVM\x02'
+
+class BytecodeProgram:
+	# Flat postfix code for a stack machine. constants holds the literal
+	# values, names the variable names, and positions the start and end
+	# offset of the source span an error at each instruction is reported
+	# at. fn and text are kept so those errors can point into the source
+	# after a load from disk.
+	def __init__(self, fn, text, code, constants, names, positions, span):
+		self.fn = fn
+		self.text = text
+		self.code = code
+		self.constants = constants
+		self.names = names
+		self.positions = positions
+		self.span = span
+		self.binding = None
+
+	def position(self, idx):
+		return Position(idx, None, None, self.fn, self.text)
+
+	def span_of(self, pc):
+		return self.position(self.positions[pc]), self.position(self.positions[pc + 1])
+
+	def fail(self, pc, details, context):
+		pos_start, pos_end = self.span_of(pc)
+		return RTResult().failure(RTError(pos_start, pos_end, details, context))
+
+	def execute(self, context):
+		code = self.code
+		constants = self.constants
+		names = self.names
+		symbol_table = context.symbol_table
+		self.binding = binding = symbol_table.bind(names, self.binding)
+		slots = binding.load()
+		if slots is None: return None
+
+		# Without a budget next_check stays at -1 and steps never reach it.
+		budget = context.budget
+		limits = budget.limits if budget is not None else None
+		steps = budget.steps if budget is not None else 0
+		next_check = budget.next_check if budget is not None else -1
+
+		stack = []
+		push = stack.append
+		pop = stack.pop
+		pc = 0
+		end = len(code)
+
+		while pc < end:
+			op = code[pc]
+			steps += 1
+			if steps == next_check:
+				budget.steps = steps
+				error = budget.exceeded()
+				if error:
+					return self.fail(pc, error, context)
+				next_check = budget.next_check
+
+			if op == OP_LOAD_CONST:
+				push(constants[code[pc + 1]])
+			elif op == OP_LOAD_VAR:
+				value = slots[code[pc + 1]]
+				if value is None:
+					return self.fail(pc, f"'{names[code[pc + 1]]}' is not defined", context)
+				push(value)
+			elif op == OP_ADD:
+				right = pop()
+				try:
+					stack[-1] += right
+				except OverflowError:
+					return self.fail(pc, 'Result out of range', context)
+			elif op == OP_SUB:
+				right = pop()
+				try:
+					stack[-1] -= right
+				except OverflowError:
+					return self.fail(pc, 'Result out of range', context)
+			elif op == OP_MUL:
+				right = pop()
+				if limits is not None:
+					error = limits.operation_error(TT_MUL, stack[-1], right)
+					if error:
+						return self.fail(pc, error, context)
+				try:
+					stack[-1] *= right
+				except OverflowError:
+					return self.fail(pc, 'Result out of range', context)
+			elif op == OP_DIV:
+				right = pop()
+				if right == 0:
+					return self.fail(pc, 'Division by zero', context)
+				try:
+					stack[-1] /= right
+				except OverflowError:
+					return self.fail(pc, 'Result out of range', context)
+			elif op == OP_POW:
+				right = pop()
+				if limits is not None:
+					error = limits.operation_error(TT_POW, stack[-1], right)
+					if error:
+						return self.fail(pc, error, context)
+				value, error = power(stack[-1], right)
+				if error:
+					return self.fail(pc, error, context)
+				stack[-1] = value
+			elif op == OP_NEG:
+				stack[-1] = -stack[-1]
+			elif op == OP_STORE_VAR:
+				value = stack[-1]
+				slots[code[pc + 1]] = value
+				symbol_table.set(names[code[pc + 1]], Number.of(value))
+			elif op == OP_NOT:
+				stack[-1] = int(not stack[-1])
+			elif op == OP_AND:
+				right = pop()
+				stack[-1] = int(bool(stack[-1]) and bool(right))
+			elif op == OP_OR:
+				right = pop()
+				stack[-1] = int(bool(stack[-1]) or bool(right))
+			else:
+				right = pop()
+				stack[-1] = int(COMPARISON_OPERATORS[OPCODE_COMPARISONS[op]](stack[-1], right))
+			pc += 2
+
+		if budget is not None:
+			budget.steps = steps
+		return RTResult().success(Number.of(stack[-1]))
+
+	def __getstate__(self):
+		# The binding refers to whatever symbol table ran the program last.
+		state = self.__dict__.copy()
+		state['binding'] = None
+		return state
+
+	###################################
+
+	def dumps(self):
+		pos_start, pos_end = self.span
+		return BYTECODE_MAGIC + marshal.dumps((
+			self.fn, self.text,
+			self.code.typecode, self.code.tobytes(),
+			self.constants, self.names,
+			self.positions.tobytes(),
+			(pos_start.idx, pos_end.idx),
+		))
+
+	@classmethod
+	def loads(cls, data):
+		if data[:len(BYTECODE_MAGIC)] != BYTECODE_MAGIC:
+			raise ValueError('Not a bytecode file')
+		fn, text, typecode, code_bytes, constants, names, position_bytes, span = marshal.loads(data[len(BYTECODE_MAGIC):])
+
+		code = array(typecode)
+		code.frombytes(code_bytes)
+		positions = array('q')
+		positions.frombytes(position_bytes)
+		program = cls(fn, text, code, constants, names, positions, None)
+		program.span = (program.position(span[0]), program.position(span[1]))
+		return program
+
+	def dump(self, path):
+		with open(path, 'wb') as f:
+			f.write(self.dumps())
+
+	@classmethod
+	def load(cls, path):
+		with open(path, 'rb') as f:
+			return cls.loads(f.read())
+
+OPCODE_COMPARISONS = {
+	OP_EE: TT_EE,
+	OP_LT: TT_LT,
+	OP_GT: TT_GT,
+	OP_LTE: TT_LTE,
+	OP_GTE: TT_GTE,
+}
+
+def constant_key(value):
+	# 1 and 1.0 compare equal, and so do 0.0 and -0.0, so the key includes the
+	# type and floats are keyed by their hex form. Ints are keyed by value, as
+	# repr refuses ints of more than sys.get_int_max_str_digits() digits.
+	return (type(value), value.hex() if type(value) is float else value)
+
+class BytecodeCompiler:
+	# Emits the AST in postfix order. The walk uses an explicit stack, so any
+	# tree the PrecedenceParser builds compiles and runs without recursion.
+	def compile_program(self, node):
+		self.code = array('i')
+		self.constants = []
+		self.constant_indexes = {}
+		self.resolver = Resolver().resolve(node)
+		self.positions = array('q')
+
+		stack = [(node, False)]
+		while stack:
+			current, emit = stack.pop()
+			if emit:
+				method_name = f'emit_{type(current).__name__}'
+				method = getattr(self, method_name, self.no_emit_method)
+				method(current)
+			else:
+				stack.append((current, True))
+				for child in reversed(node_children(current)):
+					stack.append((child, False))
+
+		return BytecodeProgram(
+			node.pos_start.fn, node.pos_start.ftxt,
+			self.code, tuple(self.constants), self.resolver.names, self.positions,
+			(node.pos_start, node.pos_end)
+		)
+
+	def no_emit_method(self, node):
+		raise Exception(f'No emit_{type(node).__name__} method defined')
+
+	def emit(self, op, arg, pos_start, pos_end):
+		self.code.append(op)
+		self.code.append(arg)
+		self.positions.append(pos_start.idx)
+		self.positions.append(pos_end.idx)
+
+	def constant(self, value):
+		key = constant_key(value)
+		if key not in self.constant_indexes:
+			self.constant_indexes[key] = len(self.constants)
+			self.constants.append(value)
+		return self.constant_indexes[key]
+
+	###################################
+
+	def emit_NumberNode(self, node):
+		self.emit(OP_LOAD_CONST, self.constant(node.tok.value), node.pos_start, node.pos_end)
+
+	def emit_VarAccessNode(self, node):
+		tok = node.var_name_tok
+		self.emit(OP_LOAD_VAR, self.resolver.indexes[tok.value], tok.pos_start, tok.pos_end)
+
+	def emit_VarAssignNode(self, node):
+		value_node = node.value_node
+		self.emit(OP_STORE_VAR, self.resolver.indexes[node.var_name_tok.value], value_node.pos_start, value_node.pos_end)
+
+	def emit_BinOpNode(self, node):
+		op_tok = node.op_tok
+		key = (op_tok.type, op_tok.value) if op_tok.type == TT_KEYWORD else op_tok.type
+		if key not in BINARY_OPCODES:
+			raise Exception(f'No bytecode for operator {op_tok.type}')
+
+		# Division by zero is reported at the divisor.
+		span_node = node.right_node if key == TT_DIV else node
+		self.emit(BINARY_OPCODES[key], 0, span_node.pos_start, span_node.pos_end)
+
+	def emit_UnaryOpNode(self, node):
+		if node.op_tok.type == TT_MINUS:
+			self.emit(OP_NEG, 0, node.pos_start, node.pos_end)
+		elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+			self.emit(OP_NOT, 0, node.pos_start, node.pos_end)
+
+#######################################
+# OPTIMIZER
+#######################################
+
+# Largest product or power, in bits, the Optimizer computes at compile time.
+FOLD_MAX_BITS = 4096
+
+def fold_bits(limits):
+	# Bit bound for folding under limits: FOLD_MAX_BITS, or the run's
+	# max_int_bits when that is lower.
+	if limits is not None and limits.max_int_bits is not None:
+		return min(FOLD_MAX_BITS, limits.max_int_bits)
+	return FOLD_MAX_BITS
+
+class Optimizer:
+	# Runs between Parser.parse and evaluation. Folds constant subtrees and
+	# drops identity operations (x+0, 0+x, x-0, x*1, 1*x, x^1, --x, +x)
+	# where x is a number-valued expression (see is_numeric).
+	# Input nodes are never mutated. A rewritten or folded subtree keeps the
+	# pos_start/pos_end of the node it replaces, and the operand left by a
+	# dropped identity keeps its own, so errors point at the same source.
+	# Anything that would fail at runtime (1/0, 0^-1) is not folded;
+	# the evaluators report it as an RTError at that node. Neither is a
+	# product or power over fold_bits(limits) bits: no budget applies while
+	# folding, so those are left to the evaluators and their limits.
+	# The tree is walked in post-order with an explicit stack, so deep trees
+	# do not recurse: optimize_<Type>(node, children) gets the already
+	# optimized children, in node_children order.
+	def __init__(self, limits=None):
+		self.limits = Limits(max_int_bits=fold_bits(limits))
+
+	def optimize(self, node):
+		results = []
+		stack = [(node, False)]
+		while stack:
+			current, expanded = stack.pop()
+			if not expanded:
+				stack.append((current, True))
+				for child in reversed(node_children(current)):
+					stack.append((child, False))
+				continue
+
+			count = len(node_children(current))
+			children = results[len(results) - count:]
+			del results[len(results) - count:]
+			method_name = f'optimize_{type(current).__name__}'
+			method = getattr(self, method_name, self.no_optimize_method)
+			results.append(method(current, children))
+
+		return results.pop()
+
+	def no_optimize_method(self, node, children):
+		return node
+
+	###################################
+
+	def optimize_NumberNode(self, node, children):
+		return node
+
+	def optimize_VarAccessNode(self, node, children):
+		return node
+
+	def optimize_VarAssignNode(self, node, children):
+		value_node, = children
+		if value_node is node.value_node:
+			return node
+		return self.relocate(VarAssignNode(node.var_name_tok, value_node), node)
+
+	def optimize_BinOpNode(self, node, children):
+		left, right = children
+		op_type = node.op_tok.type
+		if op_type == TT_DIV and isinstance(right, NumberNode):
+			# Division by zero is reported at the whole divisor, and a number
+			# has no errors of its own to point at.
+			right = self.relocate(right, node.right_node)
+
+		if isinstance(left, NumberNode) and isinstance(right, NumberNode):
+			value = self.fold(node.op_tok, left.tok.value, right.tok.value)
+			if value is not None:
+				return self.number_node(value, node)
+
+		# Only int literals count as identities: x*1.0 would turn an int into
+		# a float. x+0 and 0+x do turn -0.0 into 0.0.
+		if op_type in (TT_PLUS, TT_MINUS) and self.is_int_literal(right, 0) and self.is_numeric(left):
+			return left
+		if op_type == TT_PLUS and self.is_int_literal(left, 0) and self.is_numeric(right):
+			return right
+		if op_type in (TT_MUL, TT_POW) and self.is_int_literal(right, 1) and self.is_numeric(left):
+			return left
+		if op_type == TT_MUL and self.is_int_literal(left, 1) and self.is_numeric(right):
+			return right
+
+		if left is node.left_node and right is node.right_node:
+			return node
+		return self.relocate(BinOpNode(left, node.op_tok, right), node)
+
+	def optimize_UnaryOpNode(self, node, children):
+		operand, = children
+
+		if node.op_tok.type == TT_PLUS and self.is_numeric(operand):
+			return operand
+		if isinstance(operand, NumberNode):
+			if node.op_tok.type == TT_MINUS:
+				return self.number_node(-operand.tok.value, node)
+			return self.number_node(int(not operand.tok.value), node)
+		if node.op_tok.type == TT_MINUS and isinstance(operand, UnaryOpNode) and operand.op_tok.type == TT_MINUS and self.is_numeric(operand.node):
+			return operand.node
+
+		if operand is node.node:
+			return node
+		return self.relocate(UnaryOpNode(node.op_tok, operand), node)
+
+	def optimize_IfNode(self, node, children):
+		else_case = children.pop() if node.else_case else None
+		cases = list(zip(children[0::2], children[1::2]))
+
+		if else_case is node.else_case and all(
+			new[0] is old[0] and new[1] is old[1] for new, old in zip(cases, node.cases)
+		):
+			return node
+		return self.relocate(IfNode(cases, else_case), node)
+
+	def optimize_ForNode(self, node, children):
+		if not node.step_value_node:
+			children.insert(2, None)
+		old_children = (node.start_value_node, node.end_value_node, node.step_value_node, node.body_node)
+
+		if all(new is old for new, old in zip(children, old_children)):
+			return node
+		return self.relocate(ForNode(node.var_name_tok, *children), node)
+
+	def optimize_WhileNode(self, node, children):
+		condition_node, body_node = children
+
+		if condition_node is node.condition_node and body_node is node.body_node:
+			return node
+		return self.relocate(WhileNode(condition_node, body_node), node)
+
+	def optimize_FuncDefNode(self, node, children):
+		body_node, = children
+		if body_node is node.body_node:
+			return node
+		return self.relocate(FuncDefNode(node.var_name_tok, node.arg_name_toks, body_node), node)
+
+	def optimize_CallNode(self, node, children):
+		node_to_call, *arg_nodes = children
+
+		if node_to_call is node.node_to_call and all(new is old for new, old in zip(arg_nodes, node.arg_nodes)):
+			return node
+		return self.relocate(CallNode(node_to_call, arg_nodes), node)
+
+	###################################
+
+	def fold(self, op_tok, left, right):
+		op_type = op_tok.type
+		if self.limits.operation_error(op_type, left, right):
+			return None
+		try:
+			if op_type == TT_PLUS:
+				value = left + right
+			elif op_type == TT_MINUS:
+				value = left - right
+			elif op_type == TT_MUL:
+				value = left * right
+			elif op_type == TT_DIV:
+				if right == 0: return None
+				value = left / right
+			elif op_type == TT_POW:
+				value, error = power(left, right)
+				if error: return None
+			elif op_type in COMPARISON_OPERATORS:
+				value = int(COMPARISON_OPERATORS[op_type](left, right))
+			elif op_tok.matches(TT_KEYWORD, 'AND'):
+				value = int(bool(left) and bool(right))
+			elif op_tok.matches(TT_KEYWORD, 'OR'):
+				value = int(bool(left) or bool(right))
+			else:
+				return None
+		except (ArithmeticError, ValueError):
+			return None
+
+		if type(value) not in (int, float):
+			return None
+		return value
+
+	def is_numeric(self, node):
+		# Whether node can only evaluate to a Number. Identities are only
+		# dropped around those: x+0 must still fail when x is a function.
+		# Variables and calls may hold functions; VarAssignNode is
+		# whatever it assigns.
+		while isinstance(node, VarAssignNode):
+			node = node.value_node
+		return isinstance(node, (NumberNode, BinOpNode, UnaryOpNode))
+
+	def is_int_literal(self, node, value):
+		return isinstance(node, NumberNode) and type(node.tok.value) is int and node.tok.value == value
+
+	def number_node(self, value, node):
+		tok_type = TT_INT if isinstance(value, int) else TT_FLOAT
+		return NumberNode(Token(tok_type, value, node.pos_start, node.pos_end))
+
+	def relocate(self, new_node, node):
+		if new_node.pos_start is node.pos_start and new_node.pos_end is node.pos_end:
+			return new_node
+		new_node = copy.copy(new_node)
+		new_node.pos_start = node.pos_start
+		new_node.pos_end = node.pos_end
+		return new_node
+
+#######################################
+# FLAT AST
+#######################################
+
+# Entry kinds of a FlatAST. A FLAT_TREE entry holds any other node (IF,
+# loops, FUN and calls) as an ordinary node object.
+FLAT_NUMBER = 0
+FLAT_VAR_ACCESS = 1
+FLAT_VAR_ASSIGN = 2
+FLAT_BIN_OP = 3
+FLAT_UNARY_OP = 4
+FLAT_TREE = 5
+
+# The node class each kind stands for; FlatVisitor calls visit_<name>.
+FLAT_KIND_NAMES = ('NumberNode', 'VarAccessNode', 'VarAssignNode', 'BinOpNode', 'UnaryOpNode', 'Tree')
+FLAT_ARITY = (0, 0, 1, 2, 1, 0)
+
+# Opcodes of the unary operators; unary plus is OP_ADD. Binary operators
+# use BINARY_OPCODES.
+UNARY_OPCODES = {
+	TT_PLUS: OP_ADD,
+	TT_MINUS: OP_NEG,
+	(TT_KEYWORD, 'NOT'): OP_NOT,
+}
+BINARY_OPERATORS = {opcode: key for key, opcode in BINARY_OPCODES.items()}
+UNARY_OPERATORS = {opcode: key for key, opcode in UNARY_OPCODES.items()}
+
+def operator_key(tok):
+	return (tok.type, tok.value) if tok.type == TT_KEYWORD else tok.type
+
+def operator_token(key, pos_start=None, pos_end=None):
+	if isinstance(key, tuple):
+		return Token(key[0], key[1], pos_start, pos_end)
+	return Token(key, None, pos_start, pos_end)
+
+class FlatAST:
+	# An AST kept in parallel arrays, one entry per node, instead of one
+	# object per node and token. Children always come before their parent.
+	# For entry i: kinds[i] is its FLAT_* kind and ops[i] the opcode of its
+	# operator. lefts[i] and rights[i] are its children, or -1; the operand
+	# of a unary operator and the value of an assignment are in lefts.
+	# values[i] is the index of its number in constants, of its variable in
+	# names, or of its node in trees. starts[i] and ends[i] are the offsets
+	# of its source span in text, and tok_starts[i] and tok_ends[i] those of
+	# its number, name or operator token. root is the entry of the whole
+	# tree.
+	def __init__(self, fn, text):
+		self.fn = fn
+		self.text = text
+		self.kinds = array('B')
+		self.ops = array('B')
+		self.lefts = array('q')
+		self.rights = array('q')
+		self.values = array('q')
+		self.starts = array('q')
+		self.ends = array('q')
+		self.tok_starts = array('q')
+		self.tok_ends = array('q')
+		self.constants = []
+		self.constant_indexes = {}
+		self.names = []
+		self.name_indexes = {}
+		self.trees = []
+		self.root = -1
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def __repr__(self):
+		return repr(self.to_node())
+
+	def position(self, idx):
+		return Position(idx, None, None, self.fn, self.text)
+
+	def add(self, kind, op, left, right, value, start, end, tok_start, tok_end):
+		self.kinds.append(kind)
+		self.ops.append(op)
+		self.lefts.append(left)
+		self.rights.append(right)
+		self.values.append(value)
+		self.starts.append(start)
+		self.ends.append(end)
+		self.tok_starts.append(tok_start)
+		self.tok_ends.append(tok_end)
+		return len(self.kinds) - 1
+
+	def constant(self, value):
+		key = constant_key(value)
+		if key not in self.constant_indexes:
+			self.constant_indexes[key] = len(self.constants)
+			self.constants.append(value)
+		return self.constant_indexes[key]
+
+	def name(self, name):
+		if name not in self.name_indexes:
+			self.name_indexes[name] = len(self.names)
+			self.names.append(name)
+		return self.name_indexes[name]
+
+	###################################
+
+	# Builders, with the arguments of the node constructors and entries in
+	# place of child nodes. Each returns the new entry.
+
+	def number(self, tok):
+		start, end = tok.pos_start.idx, tok.pos_end.idx
+		return self.add(FLAT_NUMBER, 0, -1, -1, self.constant(tok.value), start, end, start, end)
+
+	def var_access(self, var_name_tok):
+		start, end = var_name_tok.pos_start.idx, var_name_tok.pos_end.idx
+		return self.add(FLAT_VAR_ACCESS, 0, -1, -1, self.name(var_name_tok.value), start, end, start, end)
+
+	def var_assign(self, var_name_tok, value):
+		return self.add(
+			FLAT_VAR_ASSIGN, 0, value, -1, self.name(var_name_tok.value),
+			var_name_tok.pos_start.idx, self.ends[value],
+			var_name_tok.pos_start.idx, var_name_tok.pos_end.idx,
+		)
+
+	def bin_op(self, left, op_tok, right):
+		return self.add(
+			FLAT_BIN_OP, BINARY_OPCODES[operator_key(op_tok)], left, right, 0,
+			self.starts[left], self.ends[right],
+			op_tok.pos_start.idx, op_tok.pos_end.idx,
+		)
+
+	def unary_op(self, op_tok, operand):
+		return self.add(
+			FLAT_UNARY_OP, UNARY_OPCODES[operator_key(op_tok)], operand, -1, 0,
+			op_tok.pos_start.idx, self.ends[operand],
+			op_tok.pos_start.idx, op_tok.pos_end.idx,
+		)
+
+	def tree(self, node):
+		self.trees.append(node)
+		start, end = node.pos_start.idx, node.pos_end.idx
+		return self.add(FLAT_TREE, 0, -1, -1, len(self.trees) - 1, start, end, start, end)
+
+	###################################
+
+	def children(self, index):
+		arity = FLAT_ARITY[self.kinds[index]]
+		if arity == 2:
+			return (self.lefts[index], self.rights[index])
+		elif arity == 1:
+			return (self.lefts[index], )
+		return ()
 
-	def visit_VarAssignNode(self, node, context):
-		res = RTResult()
-		var_name = node.var_name_tok.value
-		value = res.register(self.visit(node.value_node, context))
-		if res.error: return res
+	def postorder(self, index=None):
+		# Entries of the tree under index (default: root), children first,
+		# with an explicit stack.
+		stack = [(self.root if index is None else index, False)]
+		while stack:
+			current, expanded = stack.pop()
+			if expanded:
+				yield current
+			else:
+				stack.append((current, True))
+				for child in reversed(self.children(current)):
+					stack.append((child, False))
 
-		context.symbol_table.set(var_name, value)
-		return res.success(value)
+	def to_node(self, index=None):
+		# The tree under index as node objects, with the same spans.
+		position = self.position
+		built = []
+		for current in self.postorder(index):
+			kind = self.kinds[current]
+			tok_start = position(self.tok_starts[current])
+			tok_end = position(self.tok_ends[current])
 
-	def visit_BinOpNode(self, node, context):
-		res = RTResult()
-		left = res.register(self.visit(node.left_node, context))
-		if res.error: return res
-		right = res.register(self.visit(node.right_node, context))
-		if res.error: return res
+			if kind == FLAT_NUMBER:
+				value = self.constants[self.values[current]]
+				tok_type = TT_INT if isinstance(value, int) else TT_FLOAT
+				node = NumberNode(Token(tok_type, value, tok_start, tok_end))
+			elif kind == FLAT_VAR_ACCESS:
+				node = VarAccessNode(Token(TT_IDENTIFIER, self.names[self.values[current]], tok_start, tok_end))
+			elif kind == FLAT_VAR_ASSIGN:
+				var_name_tok = Token(TT_IDENTIFIER, self.names[self.values[current]], tok_start, tok_end)
+				node = VarAssignNode(var_name_tok, built.pop())
+			elif kind == FLAT_BIN_OP:
+				op_tok = operator_token(BINARY_OPERATORS[self.ops[current]], tok_start, tok_end)
+				right = built.pop()
+				node = BinOpNode(built.pop(), op_tok, right)
+			elif kind == FLAT_UNARY_OP:
+				op_tok = operator_token(UNARY_OPERATORS[self.ops[current]], tok_start, tok_end)
+				node = UnaryOpNode(op_tok, built.pop())
+			else:
+				built.append(self.trees[self.values[current]])
+				continue
 
-		if node.op_tok.type == TT_PLUS:
-			result, error = left.added_to(right)
-		elif node.op_tok.type == TT_MINUS:
-			result, error = left.subbed_by(right)
-		elif node.op_tok.type == TT_MUL:
-			result, error = left.multed_by(right)
-		elif node.op_tok.type == TT_DIV:
-			result, error = left.dived_by(right)
-		elif node.op_tok.type == TT_POW:
-			result, error = left.powed_by(right)
+			# Spans of optimized trees need not follow from the children.
+			node.pos_start = position(self.starts[current])
+			node.pos_end = position(self.ends[current])
+			built.append(node)
+		return built.pop()
 
-		if error:
-			return res.failure(error)
+def flatten(node):
+	# The FlatAST of a node tree. Nodes other than ARITHMETIC_NODES become
+	# FLAT_TREE entries.
+	flat = FlatAST(node.pos_start.fn, node.pos_start.ftxt)
+	entries = []
+	stack = [(node, False)]
+
+	while stack:
+		current, expanded = stack.pop()
+		if not isinstance(current, ARITHMETIC_NODES):
+			entries.append(flat.tree(current))
+			continue
+		elif not expanded:
+			stack.append((current, True))
+			for child in reversed(node_children(current)):
+				stack.append((child, False))
+			continue
+
+		if isinstance(current, NumberNode):
+			index = flat.number(current.tok)
+		elif isinstance(current, VarAccessNode):
+			index = flat.var_access(current.var_name_tok)
+		elif isinstance(current, VarAssignNode):
+			index = flat.var_assign(current.var_name_tok, entries.pop())
+		elif isinstance(current, BinOpNode):
+			right = entries.pop()
+			index = flat.bin_op(entries.pop(), current.op_tok, right)
 		else:
-			return res.success(result.set_pos(node.pos_start, node.pos_end))
+			index = flat.unary_op(current.op_tok, entries.pop())
+
+		flat.starts[index] = current.pos_start.idx
+		flat.ends[index] = current.pos_end.idx
+		entries.append(index)
+
+	flat.root = entries.pop()
+	return flat
+
+class FlatParser(PrecedenceParser):
+	# A PrecedenceParser whose parse().node is a FlatAST, built without a
+	# node object per number, name or operator. IF, loop and FUN expressions
+	# and calls are parsed into nodes and kept as FLAT_TREE entries; the
+	# entries of a call's operands stay in the arrays, unused.
+	def __init__(self, tokens):
+		super().__init__(tokens)
+		pos_start = tokens[0].pos_start
+		self.flat = flat = FlatAST(pos_start.fn, pos_start.ftxt)
+		self.make_number = flat.number
+		self.make_var_access = flat.var_access
+		self.make_var_assign = flat.var_assign
+		self.make_bin_op = flat.bin_op
+		self.make_unary_op = flat.unary_op
+
+	def make_call(self, node_to_call, arg_nodes):
+		flat = self.flat
+		return flat.tree(CallNode(flat.to_node(node_to_call), [flat.to_node(arg) for arg in arg_nodes]))
+
+	def atom(self):
+		# PrecedenceParser.expr only comes here for IF, FOR, WHILE and FUN.
+		parser = PrecedenceParser(self.tokens)
+		parser.tok_idx = self.tok_idx
+		parser.current_tok = self.current_tok
+		res = parser.atom()
+		self.tok_idx = parser.tok_idx
+		self.current_tok = parser.current_tok
 
-	def visit_UnaryOpNode(self, node, context):
-		res = RTResult()
-		number = res.register(self.visit(node.node, context))
 		if res.error: return res
+		return res.success(self.flat.tree(res.node))
 
-		error = None
+	def parse(self):
+		res = super().parse()
+		if res.error: return res
+		self.flat.root = res.node
+		return res.success(self.flat)
 
-		if node.op_tok.type == TT_MINUS:
-			number, error = number.multed_by(Number(-1))
+def parse_flat(fn, text):
+	lexer = Lexer(fn, text, ENGINE_REGEX)
+	tokens, error = lexer.make_grammar_tokens()
+	if error: return None, error
+
+	ast = FlatParser(tokens).parse()
+	if ast.error: return None, ast.error
+	return ast.node, None
 
+class FlatVisitor:
+	# Walks a FlatAST bottom-up without recursion: visit_<kind>(flat, index,
+	# *children) is called for every entry with the results of its
+	# children, and visit returns the result of the root. Kinds are named
+	# after the node classes (FLAT_KIND_NAMES); FLAT_TREE entries go to
+	# visit_Tree.
+	def visit(self, flat, index=None):
+		methods = self.visit_methods()
+		kinds = flat.kinds
+		results = []
+
+		for current in flat.postorder(index):
+			kind = kinds[current]
+			arity = FLAT_ARITY[kind]
+			if arity:
+				children = results[-arity:]
+				del results[-arity:]
+				results.append(methods[kind](flat, current, *children))
+			else:
+				results.append(methods[kind](flat, current))
+
+		return results.pop()
+
+	def visit_methods(self):
+		return [getattr(self, f'visit_{name}', self.no_visit_method) for name in FLAT_KIND_NAMES]
+
+	def no_visit_method(self, flat, index, *children):
+		raise Exception(f'No visit_{FLAT_KIND_NAMES[flat.kinds[index]]} method defined')
+
+class FlatInterpreter(FlatVisitor):
+	# Evaluates a FlatAST to the same value or RTError as the Interpreter
+	# evaluates the tree it stands for. Operators go through
+	# interpreter.operate and FLAT_TREE entries through interpreter.visit,
+	# so a LimitedInterpreter limits flat evaluation too; with a budget,
+	# every entry is charged like a node.
+	def __init__(self, interpreter=None):
+		self.interpreter = interpreter if interpreter is not None else Interpreter()
+		self.operator_tokens = {opcode: operator_token(key) for opcode, key in BINARY_OPERATORS.items()}
+
+	def run(self, flat, context):
+		self.context = context
+		try:
+			value = self.visit(flat)
+		except RTErrorSignal as signal:
+			return RTResult().failure(signal.error)
+		return RTResult().success(value)
+
+	def visit_methods(self):
+		methods = super().visit_methods()
+		if self.context.budget is not None:
+			# The interpreter charges FLAT_TREE nodes itself.
+			methods = [self.charge(method) for method in methods[:FLAT_TREE]] + methods[FLAT_TREE:]
+		return methods
+
+	def charge(self, method):
+		# The root is not charged: its step is the one taken for the
+		# FlatAST, like for the root node of a tree.
+		def charged(flat, index, *children):
+			if index == flat.root:
+				return method(flat, index, *children)
+			budget = self.context.budget
+			budget.steps += 1
+			if budget.steps >= budget.next_check:
+				error = budget.exceeded()
+				if error:
+					self.fail(flat, flat.starts[index], flat.ends[index], error)
+			return method(flat, index, *children)
+
+		return charged
+
+	def fail(self, flat, start, end, details):
+		raise RTErrorSignal(RTError(flat.position(start), flat.position(end), details, self.context))
+
+	###################################
+
+	def visit_NumberNode(self, flat, index):
+		return Number.of(flat.constants[flat.values[index]])
+
+	def visit_VarAccessNode(self, flat, index):
+		var_name = flat.names[flat.values[index]]
+		value = self.context.symbol_table.get(var_name)
+		if not value:
+			self.fail(flat, flat.tok_starts[index], flat.tok_ends[index], f"'{var_name}' is not defined")
+		return value
+
+	def visit_VarAssignNode(self, flat, index, value):
+		self.context.symbol_table.set(flat.names[flat.values[index]], value)
+		return value
+
+	def visit_BinOpNode(self, flat, index, left, right):
+		op = flat.ops[index]
+		result, error = self.interpreter.operate(self.operator_tokens[op], left, right)
 		if error:
-			return res.failure(error)
-		else:
-			return res.success(number.set_pos(node.pos_start, node.pos_end))
+			# Division by zero is reported at the divisor.
+			span = flat.rights[index] if op == OP_DIV else index
+			self.fail(flat, flat.starts[span], flat.ends[span], error)
+		return result
+
+	def visit_UnaryOpNode(self, flat, index, operand):
+		op = flat.ops[index]
+		error = None
+		if op == OP_NEG:
+			operand, error = operand.negated()
+		elif op == OP_NOT:
+			operand, error = operand.notted()
+
+		if error:
+			self.fail(flat, flat.starts[index], flat.ends[index], error)
+		return operand
+
+	def visit_Tree(self, flat, index):
+		budget = self.context.budget
+		if index == flat.root and budget is not None:
+			# The root node's step was taken for the FlatAST.
+			budget.steps -= 1
+		result = self.interpreter.visit(flat.trees[flat.values[index]], self.context)
+		if result.error:
+			raise RTErrorSignal(result.error)
+		return result.value
+
 #######################################
 # LEXER
 #######################################
 
 class Lexer:
-    def __init__(self, fn, text):
+    def __init__(self, fn, text, engine=ENGINE_CHAR):
+        if engine not in (ENGINE_CHAR, ENGINE_REGEX):
+            raise ValueError(f"Unknown lexer engine '{engine}'")
+        # text may be a str or one of BYTES_TYPES. The regex engine scans
+        # bytes as they are; the char engine walks characters, so it decodes
+        # them up front.
+        if isinstance(text, memoryview):
+            text = text.cast('B')
+        if engine == ENGINE_CHAR and isinstance(text, BYTES_TYPES):
+            text = decode_text(text)
         self.fn = fn
         self.text = text
+        self.engine = engine
         self.pos = Position(-1, 0, -1, fn, text)
         self.current_char = None
         self.tokens = []  # List to store tokens
@@ -451,20 +3400,23 @@ class Lexer:
         self.pos.advance(self.current_char)
         self.current_char = self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
     def make_word(self):
-        word_str = ''
+        start = self.pos.idx
 
         while self.current_char is not None and WORD_REGEX.match(self.current_char):
-            word_str += self.current_char
             self.advance()
 
-        return Token(TT_WORD, word_str)
+        return Token(TT_WORD, self.text[start:self.pos.idx])
     def make_tokens(self):
+        if self.engine == ENGINE_REGEX:
+            return self.make_tokens_regex()
         tokens = []
 
         while self.current_char is not None:
+            token_start = self.pos.copy()
+            first = len(tokens)
             if self.current_char in ' \t':
                 spaces, tabs = 0, 0
-                while self.current_char in ' \t':
+                while self.current_char is not None and self.current_char in ' \t':
                     if self.current_char == ' ':
                         spaces += 1
                     elif self.current_char == '\t':
@@ -579,60 +3531,1088 @@ class Lexer:
                 pos_start = self.pos.copy()
                 char = self.current_char
                 self.advance()
-                tokens.append(Token('OTHER', char))
+                tokens.append(Token(TT_OTHER, char))
+            token_end = self.pos.copy()
+            for token in tokens[first:]:
+                token.pos_start, token.pos_end = token_start, token_end
         self.tokens=tokens 
+        self.add_parity_token(tokens)
+        return self.tokens, None       
+
+    def make_tokens_regex(self):
+        if isinstance(self.text, BYTES_TYPES):
+            # Bytes go through a TokenBuffer, whose tokens only decode their
+            # value when it is read.
+            buffer, error = self.make_token_buffer()
+            self.tokens = list(buffer)
+            return self.tokens, None
+        self.tokens = list(self.iter_tokens())
+        return self.tokens, None
+
+    def iter_tokens(self):
+        return scan_chunks(self.fn, (self.text,), self.text)
+
+    def make_token_buffer(self):
+        # Same token stream as make_tokens, stored in a TokenBuffer instead of
+        # a list of Token objects. Bytes are scanned without decoding them.
+        text = self.text
+        buffer = TokenBuffer(self.fn, text)
+        types = buffer.types
+        scan_columns(text, types, buffer.starts, buffer.ends)
+
+        if types and types[-1] == TOKEN_CODES[TT_DIGIT]:
+            digit = int(buffer.value_of(len(types) - 1)[-1])
+            end = len(text)
+            buffer.append(TT_EVEN if digit % 2 == 0 else TT_ODD, end, end)
+
+        self.tokens = buffer
+        return self.tokens, None
+
+    def make_grammar_tokens(self):
+        # The token stream the Parser expects: blanks, newlines and the
+        # even/odd marker are dropped, DIGIT becomes INT (or FLOAT when
+        # written as DIGIT '.' DIGIT), words become IDENTIFIER or KEYWORD,
+        # '^' becomes POW, '=' EQ, '==' EE, '<' LT, '>' GT, '<=' LTE,
+        # '>=' GTE and '->' ARROW, and an EOF token is added.
+        tokens, error = self.make_tokens()
+        if error: return [], error
+
+        grammar_tokens = []
+        skipped = (TT_SPACE, TT_TAB, TT_LINE, TT_EVEN, TT_ODD)
+        index = 0
+        count = len(tokens)
+
+        while index < count:
+            tok = tokens[index]
+            index += 1
+
+            if tok.type in skipped:
+                continue
+            elif tok.type == TT_DIGIT:
+                if (index + 1 < count and tokens[index].type == TT_OTHER
+                        and tokens[index].value == '.' and tokens[index + 1].type == TT_DIGIT):
+                    fraction = tokens[index + 1]
+                    grammar_tokens.append(Token(
+                        TT_FLOAT, float(f'{tok.value}.{fraction.value}'), tok.pos_start, fraction.pos_end
+                    ))
+                    index += 2
+                else:
+                    try:
+                        value = int(tok.value)
+                    except ValueError:
+                        # More digits than sys.get_int_max_str_digits() allows.
+                        return [], InvalidSyntaxError(tok.pos_start, tok.pos_end, 'Integer literal too long')
+                    grammar_tokens.append(Token(TT_INT, value, tok.pos_start, tok.pos_end))
+            elif tok.type == TT_WORD:
+                tok_type = TT_KEYWORD if tok.value in KEYWORDS else TT_IDENTIFIER
+                grammar_tokens.append(Token(tok_type, tok.value, tok.pos_start, tok.pos_end))
+            elif tok.type == TT_BIT_XOR:
+                grammar_tokens.append(Token(TT_POW, None, tok.pos_start, tok.pos_end))
+            elif (tok.type == TT_MINUS and index < count and tokens[index].type == TT_GE
+                    and tokens[index].pos_start.idx == tok.pos_end.idx):
+                grammar_tokens.append(Token(TT_ARROW, None, tok.pos_start, tokens[index].pos_end))
+                index += 1
+            elif tok.type in (TT_SM, TT_GE):
+                if index < count and tokens[index].type == TT_OTHER and tokens[index].value == '=':
+                    tok_type = TT_LTE if tok.type == TT_SM else TT_GTE
+                    grammar_tokens.append(Token(tok_type, None, tok.pos_start, tokens[index].pos_end))
+                    index += 1
+                else:
+                    tok_type = TT_LT if tok.type == TT_SM else TT_GT
+                    grammar_tokens.append(Token(tok_type, None, tok.pos_start, tok.pos_end))
+            elif tok.type == TT_OTHER:
+                if tok.value != '=':
+                    return [], IllegalCharError(tok.pos_start, tok.pos_end, "'" + tok.value + "'")
+                if index < count and tokens[index].type == TT_OTHER and tokens[index].value == '=':
+                    grammar_tokens.append(Token(TT_EE, None, tok.pos_start, tokens[index].pos_end))
+                    index += 1
+                else:
+                    grammar_tokens.append(Token(TT_EQ, None, tok.pos_start, tok.pos_end))
+            else:
+                grammar_tokens.append(Token(tok.type, tok.value, tok.pos_start, tok.pos_end))
+
+        if count:
+            pos_end = tokens[-1].pos_end
+        else:
+            pos_end = Position(0, 0, 0, self.fn, self.text)
+        grammar_tokens.append(Token(TT_EOF, None, pos_end, pos_end))
+        return grammar_tokens, None
+
+    def relex(self, offset, deleted, inserted):
+        # Edit the text of a lexer whose tokens came from make_token_buffer,
+        # re-lexing only around the edit (see TokenBuffer.apply_edit).
+        changed = self.tokens.apply_edit(offset, deleted, inserted)
+        self.text = self.tokens.source
+        return changed
+
+    def add_parity_token(self, tokens):
         # Add the logic to check if the last token is a number and if it's even or odd   
-        if tokens and tokens[-1].type == TT_INT:
-            number = int(tokens[-1].value)
-            if number % 2 == 0:
-                tokens.append(Token(TT_EVEN))
+        if tokens and tokens[-1].type == TT_DIGIT:
+            # Only the last digit decides, and int() refuses very long runs.
+            digit = int(tokens[-1].value[-1])
+            if digit % 2 == 0:
+                tokens.append(Token(TT_EVEN, None, self.pos.copy(), self.pos.copy()))
             else:
-                tokens.append(Token(TT_ODD))    
-        return self.tokens, None       
+                tokens.append(Token(TT_ODD, None, self.pos.copy(), self.pos.copy()))
 
 #######################################
-# RUN
+# STREAMING
 #######################################
 
-def run(fn, text):
-    lexer = Lexer(fn, text)
-    tokens, error = lexer.make_tokens()
+CHUNK_SIZE = 1 << 16
+
+# Runs that may continue past the end of a chunk, and the pattern that
+# extends them at the start of the next one.
+RUN_CONTINUATIONS = {
+    'BLANK': re.compile(r'[ \t]*'),
+    'LINE': re.compile(r'\n*'),
+    'DIGIT': re.compile(r'[0-9]*'),
+    'WORD': re.compile(r'[a-zA-Z0-9]*'),
+}
+
+def read_chunks(source, chunk_size=CHUNK_SIZE):
+    if isinstance(source, str):
+        yield source
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from source
+
+def iter_tokens(fn, source, chunk_size=CHUNK_SIZE):
+    # source is a str, a text file object or an iterable of strings.
+    return scan_chunks(fn, read_chunks(source, chunk_size))
+
+def scan_chunks(fn, chunks, ftxt=None):
+    # Yields the same tokens as Lexer.make_tokens for the concatenation of
+    # chunks. A blank, newline, digit or word run that touches the end of a
+    # chunk is held back (as counts, or as the pieces of its value) until the
+    # next chunk shows where it stops, so memory stays bounded by the chunk
+    # size and the longest word or number. Neighbouring tokens share the
+    # Position where one ends and the next starts.
+    single = SINGLE_CHAR_TOKENS
+    continuations = RUN_CONTINUATIONS
+    ln = 0
+    line_start = 0
+    offset = 0
+    pos = Position(0, 0, 0, fn, ftxt)
+    run_kind = None
+    run_value = None
+    last = None
 
-    return tokens, error
+    for chunk in chunks:
+        size = len(chunk)
+        start = 0
+
+        if run_kind is not None:
+            start = continuations[run_kind].match(chunk).end()
+            if start > 0:
+                piece = run_value_of(run_kind, chunk[:start])
+                if run_kind == 'BLANK':
+                    run_value = (run_value[0] + piece[0], run_value[1] + piece[1])
+                else:
+                    run_value += piece
+            if start == size:
+                offset += size
+                continue
+            end = offset + start
+            if run_kind == 'LINE':
+                ln += run_value
+                line_start = end
+            pos_end = Position(end, ln, end - line_start, fn, ftxt)
+            tokens = run_tokens(run_kind, run_value, pos, pos_end)
+            yield from tokens
+            last = tokens[-1]
+            pos = pos_end
+            run_kind = None
+
+        for match in TOKEN_REGEX.finditer(chunk, start):
+            kind = match.lastgroup
+            end = match.end()
+            if end == size and kind in continuations:
+                run_kind = kind
+                run_value = run_value_of(kind, match.group())
+                break
+            end += offset
+            if kind == 'LINE':
+                lines = match.end() - match.start()
+                ln += lines
+                line_start = end
+            pos_end = Position(end, ln, end - line_start, fn, ftxt)
+
+            if kind == 'WORD':
+                last = Token(TT_WORD, match.group(), pos, pos_end)
+                yield last
+            elif kind == 'BLANK':
+                lexeme = match.group()
+                spaces = lexeme.count(' ')
+                tabs = len(lexeme) - spaces
+                if spaces > 0:
+                    last = Token(TT_SPACE, spaces, pos, pos_end)
+                    yield last
+                if tabs > 0:
+                    last = Token(TT_TAB, tabs, pos, pos_end)
+                    yield last
+            elif kind == 'LINE':
+                last = Token(TT_LINE, lines, pos, pos_end)
+                yield last
+            elif kind == 'DIGIT':
+                last = Token(TT_DIGIT, match.group(), pos, pos_end)
+                yield last
+            elif kind == 'SINGLE':
+                last = Token(single[match.group()], None, pos, pos_end)
+                yield last
+            else:
+                last = Token(TT_OTHER, match.group(), pos, pos_end)
+                yield last
+            pos = pos_end
+
+        offset += size
+
+    if run_kind is not None:
+        if run_kind == 'LINE':
+            ln += run_value
+            line_start = offset
+        pos_end = Position(offset, ln, offset - line_start, fn, ftxt)
+        tokens = run_tokens(run_kind, run_value, pos, pos_end)
+        yield from tokens
+        last = tokens[-1]
+        pos = pos_end
+
+    if last is not None and last.type == TT_DIGIT:
+        if int(last.value[-1]) % 2 == 0:
+            yield Token(TT_EVEN, None, pos, pos)
+        else:
+            yield Token(TT_ODD, None, pos, pos)
+
+def run_value_of(kind, lexeme):
+    # What scan_chunks keeps of a run while it waits for the next chunk.
+    if kind == 'BLANK':
+        spaces = lexeme.count(' ')
+        return (spaces, len(lexeme) - spaces)
+    elif kind == 'LINE':
+        return len(lexeme)
+    return [lexeme]
+
+def run_tokens(kind, value, pos_start, pos_end):
+    if kind == 'BLANK':
+        spaces, tabs = value
+        tokens = []
+        if spaces > 0:
+            tokens.append(Token(TT_SPACE, spaces, pos_start, pos_end))
+        if tabs > 0:
+            tokens.append(Token(TT_TAB, tabs, pos_start, pos_end))
+        return tokens
+    elif kind == 'LINE':
+        return [Token(TT_LINE, value, pos_start, pos_end)]
+    elif kind == 'DIGIT':
+        return [Token(TT_DIGIT, ''.join(value), pos_start, pos_end)]
+    return [Token(TT_WORD, ''.join(value), pos_start, pos_end)]
+
+#######################################
+# RUN
+#######################################
 
 global_symbol_table = SymbolTable()
-global_symbol_table.set("NULL", Number(0))
-global_symbol_table.set("FALSE", Number(0))
-global_symbol_table.set("TRUE", Number(1))
+global_symbol_table.set("NULL", Number.of(0))
+global_symbol_table.set("FALSE", Number.of(0))
+global_symbol_table.set("TRUE", Number.of(1))
+
+BACKEND_INTERPRETER = 'interpreter'
+BACKEND_CLOSURE = 'closure'
+BACKEND_VM = 'vm'
+
+# Both parsers build the same trees; the precedence parser does not recurse,
+# so it also takes inputs nested deeper than the recursion limit.
+PARSER_RECURSIVE = 'recursive'
+PARSER_PRECEDENCE = 'precedence'
+PARSERS = {
+	PARSER_RECURSIVE: Parser,
+	PARSER_PRECEDENCE: PrecedenceParser,
+}
+
+class Program:
+	# A lexed and parsed source text, plus its compiled form once built.
+	def __init__(self, fn, text, tokens, node):
+		self.fn = fn
+		self.text = text
+		self.tokens = tokens
+		self.node = node
+		self.compilable = compilable(node)
+		self.arithmetic = all(isinstance(current, ARITHMETIC_NODES) for current in walk_nodes(node))
+		self.compiled = None
+		self.limited = None
+		self.bytecode = None
+
+	def compiled_program(self, limited=False):
+		# The limited closures are a separate program, so unlimited runs do
+		# not pay for the budget checks.
+		if limited:
+			if self.limited is None:
+				self.limited = Compiler(limited=True).compile_program(self.node)
+			return self.limited
+		if self.compiled is None:
+			self.compiled = Compiler().compile_program(self.node)
+		return self.compiled
+
+	def bytecode_program(self):
+		if self.bytecode is None:
+			self.bytecode = BytecodeCompiler().compile_program(self.node)
+		return self.bytecode
+
+	def __getstate__(self):
+		# Closures do not pickle; they are rebuilt on first use.
+		state = self.__dict__.copy()
+		state['compiled'] = None
+		state['limited'] = None
+		return state
+
+def make_program(fn, text, optimize=False, stats=None, parser=PARSER_RECURSIVE, limits=None):
+	stage = stats.stage if stats is not None else no_stage
 
-def run(fn, text):
 	# Generate tokens
-	lexer = Lexer(fn, text)
-	tokens, error = lexer.make_tokens()
+	with stage('lex'):
+		lexer = Lexer(fn, text, ENGINE_REGEX)
+		tokens, error = lexer.make_grammar_tokens()
 	if error: return None, error
-	
+
 	# Generate AST
-	parser = Parser(tokens)
-	ast = parser.parse()
+	with stage('parse'):
+		ast = PARSERS[parser](tokens).parse()
 	if ast.error: return None, ast.error
 
-	# Run program
-	interpreter = Interpreter()
+	node = ast.node
+	if optimize:
+		with stage('optimize'):
+			node = Optimizer(limits).optimize(node)
+	return Program(fn, text, tokens, node), None
+
+def parse_text(fn, text, parser=PARSER_RECURSIVE):
+	program, error = make_program(fn, text, parser=parser)
+	if error: return None, error
+	return program.node, None
+
+def compile_text(fn, text, optimize=False, cache=None):
+	if cache is not None:
+		program, error = cache.get(fn, text, optimize)
+	else:
+		program, error = make_program(fn, text, optimize)
+	if error: return None, error
+	if not program.compilable:
+		return None, unsupported_error(program, COMPILED_NODES, 'closure compiler')
+	return program.compiled_program(), None
+
+def compile_bytecode(fn, text, optimize=False, cache=None):
+	if cache is not None:
+		program, error = cache.get(fn, text, optimize)
+	else:
+		program, error = make_program(fn, text, optimize)
+	if error: return None, error
+	if not program.arithmetic:
+		return None, unsupported_error(program, ARITHMETIC_NODES, 'bytecode compiler')
+	return program.bytecode_program(), None
+
+def unsupported_error(program, node_types, compiler):
+	# Points at the first node compiler has no code for; run() gives such
+	# programs to the Interpreter instead.
+	for node in walk_nodes(program.node):
+		if not isinstance(node, node_types):
+			details = f'Not supported by the {compiler}'
+			break
+	else:
+		node = program.node
+		details = f'Nested too deeply for the {compiler}'
+	return RTError(node.pos_start, node.pos_end, details, Context('<program>'))
+
+def run(fn, text, backend=BACKEND_INTERPRETER, optimize=False, cache=None, symbol_table=None, stats=None, parser=PARSER_RECURSIVE, limits=None, memo=None):
+	# memo is an optional LRUCache that keeps the results of calls to pure
+	# functions (see pure_function) across calls and runs.
+	if stats is not None:
+		return run_instrumented(fn, text, backend, optimize, cache, symbol_table, stats, parser, limits, memo)
+
+	program, error = load_program(fn, text, optimize, cache, parser, limits)
+	if error: return None, error
+
+	result = execute_program(program, backend, symbol_table, limits, memo)
+	return result.value, result.error
+
+def load_program(fn, text, optimize, cache, parser, limits, stats=None):
+	# stats, when given, gets the stage times and whether the cache had the
+	# program.
+	if cache is None:
+		return make_program(fn, text, optimize, stats, parser, limits)
+	if stats is None:
+		return cache.get(fn, text, optimize, parser, limits)
+
+	hits = cache.memory.hits + cache.disk_hits
+	with stats.stage('load'):
+		program, error = cache.get(fn, text, optimize, parser, limits)
+	stats.cached = cache.memory.hits + cache.disk_hits > hits
+	return program, error
+
+def execute_program(program, backend, symbol_table, limits, memo, stats=None):
+	# stats, when given, gets the backend that ran the program, the stage
+	# times and the Interpreter's visits.
+	stage = stats.stage if stats is not None else no_stage
 	context = Context('<program>')
-	context.symbol_table = global_symbol_table
-	result = interpreter.visit(ast.node, context)
+	context.symbol_table = symbol_table if symbol_table is not None else global_symbol_table
+	if limits is not None:
+		context.budget = Budget(limits)
+	context.memo = memo
+
+	# The compiled backends return None for programs they cannot run. The
+	# VM also takes arithmetic nested too deeply for the closures.
+	result = None
+	if program.compilable and backend == BACKEND_CLOSURE:
+		with stage('compile'):
+			compiled = program.compiled_program(limits is not None)
+		with stage('eval'):
+			result = compiled.execute(context)
+	elif program.arithmetic and backend in (BACKEND_CLOSURE, BACKEND_VM):
+		backend = BACKEND_VM
+		with stage('compile'):
+			bytecode = program.bytecode_program()
+		with stage('eval'):
+			result = bytecode.execute(context)
+	if result is None:
+		backend = BACKEND_INTERPRETER
+		if stats is not None and limits is not None:
+			interpreter = InstrumentedLimitedInterpreter(stats.visits, context.budget)
+		elif stats is not None:
+			interpreter = InstrumentedInterpreter(stats.visits)
+		elif limits is not None:
+			interpreter = LimitedInterpreter(context.budget)
+		else:
+			interpreter = Interpreter()
+		with stage('eval'):
+			result = interpreter.visit(program.node, context)
+
+	if stats is not None:
+		stats.backend = backend
+	return result
+
+#######################################
+# INSTRUMENTATION
+#######################################
+
+def no_stage(name):
+	return nullcontext()
+
+class RunStats:
+	# Opt-in measurements for one run() call: wall time per stage, token and
+	# node counts, Number allocations and interpreter visits per node type.
+	# callback(stats) is called once the run has finished.
+	def __init__(self, callback=None):
+		self.callback = callback
+		self.stages = {}
+		self.tokens = 0
+		self.nodes = 0
+		self.numbers = 0
+		self.visits = Counter()
+		self.backend = None
+		self.cached = False
+		self.error = None
+
+	@contextmanager
+	def stage(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+	@property
+	def total(self):
+		return sum(self.stages.values())
+
+	def finish(self, error):
+		self.error = error.as_string() if error else None
+		if self.callback: self.callback(self)
+
+	def as_dict(self):
+		return {
+			'backend': self.backend,
+			'cached': self.cached,
+			'stages': dict(self.stages),
+			'total': self.total,
+			'tokens': self.tokens,
+			'nodes': self.nodes,
+			'numbers': self.numbers,
+			'visits': dict(self.visits),
+			'error': self.error,
+		}
+
+	def to_json(self, **kwargs):
+		return json.dumps(self.as_dict(), **kwargs)
+
+class NumberAllocations:
+	# Counts Number instances created while at least one counter is active by
+	# wrapping Number.__init__. The wrapper is process wide, so runs on other
+	# threads are counted too while a counter is active.
+	lock = threading.Lock()
+	active = []
+	original_init = None
+
+	def __init__(self):
+		self.count = 0
+
+	def __enter__(self):
+		cls = NumberAllocations
+		with cls.lock:
+			if not cls.active:
+				cls.original_init = original_init = Number.__init__
+				def counting_init(number, *args, **kwargs):
+					for counter in cls.active:
+						counter.count += 1
+					original_init(number, *args, **kwargs)
+				Number.__init__ = counting_init
+			cls.active.append(self)
+		return self
+
+	def __exit__(self, *exc_info):
+		cls = NumberAllocations
+		with cls.lock:
+			cls.active.remove(self)
+			if not cls.active:
+				Number.__init__ = cls.original_init
+				cls.original_init = None
+
+class InstrumentedInterpreter(Interpreter):
+	def __init__(self, visits):
+		self.visits = visits
 
+	def enter(self, node, context):
+		self.visits[type(node).__name__] += 1
+		return super().enter(node, context)
+
+class InstrumentedLimitedInterpreter(InstrumentedInterpreter, LimitedInterpreter):
+	def __init__(self, visits, budget):
+		self.visits = visits
+		self.budget = budget
+
+def run_instrumented(fn, text, backend, optimize, cache, symbol_table, stats, parser, limits, memo):
+	# Same as run(), recording into stats as it goes.
+	stats.backend = backend
+	with NumberAllocations() as allocations:
+		program, error = load_program(fn, text, optimize, cache, parser, limits, stats)
+		if error:
+			stats.numbers = allocations.count
+			stats.finish(error)
+			return None, error
+
+		stats.tokens = len(program.tokens)
+		stats.nodes = sum(1 for _ in walk_nodes(program.node))
+		result = execute_program(program, backend, symbol_table, limits, memo, stats)
+
+	stats.numbers = allocations.count
+	stats.finish(result.error)
 	return result.value, result.error
 
+#######################################
+# PROGRAM CACHE
+#######################################
+
+class LRUCache:
+	# Bounded mapping that evicts the least recently used entry once it holds
+	# more than maxsize entries. on_evict(key, value) is called for every
+	# evicted entry.
+	def __init__(self, maxsize=1024, on_evict=None):
+		self.maxsize = maxsize
+		self.on_evict = on_evict
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key, default=None):
+		with self.lock:
+			if key in self.entries:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return self.entries[key]
+			self.misses += 1
+			return default
+
+	def put(self, key, value):
+		evicted = []
+		with self.lock:
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.maxsize:
+				evicted.append(self.entries.popitem(last=False))
+				self.evictions += 1
+
+		if self.on_evict:
+			for evicted_key, evicted_value in evicted:
+				self.on_evict(evicted_key, evicted_value)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+	def stats(self):
+		return {
+			'size': len(self.entries),
+			'maxsize': self.maxsize,
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+		}
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, key):
+		return key in self.entries
+
+# Part of every cache key. Bump it whenever the grammar or the Program
+# layout changes, so pickles of older programs are not loaded.
+PROGRAM_FORMAT = 3
+
+class ProgramCache:
+	# Programs (tokens, AST and compiled closures) keyed by a SHA-256 of the
+	# file name, the optimize flag (with the bit bound of folding) and the
+	# source text. The file name is
+	# part of the key because it ends up in error messages. With a path, the
+	# cache also pickles programs into that directory and looks there on a
+	# memory miss, so compiled programs survive restarts (closures are
+	# rebuilt on first use).
+	def __init__(self, maxsize=1024, path=None, on_evict=None):
+		self.memory = LRUCache(maxsize, on_evict)
+		self.path = path
+		self.disk_hits = 0
+		self.disk_misses = 0
+		if path is not None:
+			os.makedirs(path, exist_ok=True)
+
+	def key(self, fn, text, optimize=False, limits=None):
+		digest = hashlib.sha256()
+		folding = fold_bits(limits) if optimize else 0
+		digest.update(f'{PROGRAM_FORMAT}\0{fn}\0{int(bool(optimize))}\0{folding}\0'.encode('utf-8'))
+		digest.update(text.encode('utf-8', 'surrogatepass'))
+		return digest.hexdigest()
+
+	def get(self, fn, text, optimize=False, parser=PARSER_RECURSIVE, limits=None):
+		# parser only matters on a miss: both parsers build the same tree.
+		# limits only matter with optimize, for fold_bits.
+		key = self.key(fn, text, optimize, limits)
+		program = self.memory.get(key)
+		if program is not None:
+			return program, None
+
+		if self.path is not None:
+			program = self.load(key)
+			if program is not None and program.fn == fn and program.text == text:
+				self.disk_hits += 1
+				self.memory.put(key, program)
+				return program, None
+			self.disk_misses += 1
+
+		program, error = make_program(fn, text, optimize, parser=parser, limits=limits)
+		if error: return None, error
+
+		self.memory.put(key, program)
+		if self.path is not None:
+			self.store(key, program)
+		return program, None
+
+	def file_for(self, key):
+		return os.path.join(self.path, key + '.pickle')
+
+	def load(self, key):
+		try:
+			with open(self.file_for(key), 'rb') as f:
+				return pickle.load(f)
+		except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+			return None
+
+	def store(self, key, program):
+		# A program that cannot be written (too deep to pickle, disk full) is
+		# only kept in memory.
+		filename = self.file_for(key)
+		temp_filename = f'{filename}.{os.getpid()}.tmp'
+		try:
+			with open(temp_filename, 'wb') as f:
+				pickle.dump(program, f, pickle.HIGHEST_PROTOCOL)
+			os.replace(temp_filename, filename)
+		except (OSError, pickle.PicklingError, RecursionError):
+			try:
+				os.remove(temp_filename)
+			except OSError:
+				pass
+
+	def clear(self):
+		self.memory.clear()
+
+	def stats(self):
+		stats = self.memory.stats()
+		stats['disk_hits'] = self.disk_hits
+		stats['disk_misses'] = self.disk_misses
+		return stats
+
+#######################################
+# BATCH EVALUATION
+#######################################
+
+class BatchResult:
+	# values[i] is the result for row i, or None when errors[i] holds the
+	# RTError that row ran into.
+	def __init__(self, values, errors):
+		self.values = values
+		self.errors = errors
+
+	def __len__(self):
+		return len(self.values)
+
+	def __iter__(self):
+		return zip(self.values, self.errors)
+
+BATCH_OPERATIONS = {
+	TT_PLUS: operator.add,
+	TT_MINUS: operator.sub,
+	TT_MUL: operator.mul,
+}
+
+class BatchEvaluator:
+	# Evaluates an AST once for a whole batch of rows: every visit returns a
+	# column with one value per row. A row whose evaluation fails holds None
+	# from then on, and errors keeps the first RTError of each row, the one
+	# the Interpreter would have stopped at.
+	def __init__(self, columns, rows, context):
+		self.columns = dict(columns)
+		self.rows = rows
+		self.context = context
+		self.errors = [None] * rows
+
+	def evaluate(self, node):
+		return BatchResult(self.visit(node), self.errors)
+
+	def visit(self, node):
+		method_name = f'visit_{type(node).__name__}'
+		method = getattr(self, method_name, self.no_visit_method)
+		return method(node)
+
+	def no_visit_method(self, node):
+		raise Exception(f'No visit_{type(node).__name__} method defined')
+
+	def fail(self, row, node, details):
+		if self.errors[row] is None:
+			self.errors[row] = RTError(node.pos_start, node.pos_end, details, self.context)
+
+	###################################
+
+	def column(self, values):
+		return list(values)
+
+	def constant(self, value):
+		return [value] * self.rows
+
+	def visit_NumberNode(self, node):
+		return self.constant(node.tok.value)
+
+	def visit_VarAccessNode(self, node):
+		var_name = node.var_name_tok.value
+		if var_name in self.columns:
+			return self.columns[var_name]
+
+		value = self.context.symbol_table.get(var_name)
+		if not value:
+			return self.undefined(node.var_name_tok, f"'{var_name}' is not defined")
+		return self.constant(value.value)
+
+	def visit_VarAssignNode(self, node):
+		column = self.visit(node.value_node)
+		self.columns[node.var_name_tok.value] = column
+		return column
+
+	def undefined(self, tok, details):
+		for row in range(self.rows):
+			self.fail(row, tok, details)
+		return [None] * self.rows
+
+	def visit_BinOpNode(self, node):
+		left = self.visit(node.left_node)
+		right = self.visit(node.right_node)
+		op_type = node.op_tok.type
+
+		if op_type in (TT_PLUS, TT_MINUS, TT_MUL):
+			operation = BATCH_OPERATIONS[op_type]
+			try:
+				return [None if a is None or b is None else operation(a, b) for a, b in zip(left, right)]
+			except OverflowError:
+				# Again row by row, so only the rows that overflow fail.
+				return self.rows_operation(node, lambda a, b: arithmetic(operation, a, b), left, right)
+		elif op_type in COMPARISON_OPERATORS:
+			compare = COMPARISON_OPERATORS[op_type]
+			return [None if a is None or b is None else int(compare(a, b)) for a, b in zip(left, right)]
+		elif node.op_tok.matches(TT_KEYWORD, 'AND'):
+			return [None if a is None or b is None else int(bool(a) and bool(b)) for a, b in zip(left, right)]
+		elif node.op_tok.matches(TT_KEYWORD, 'OR'):
+			return [None if a is None or b is None else int(bool(a) or bool(b)) for a, b in zip(left, right)]
+
+		result = []
+		for row, (a, b) in enumerate(zip(left, right)):
+			if a is None or b is None:
+				result.append(None)
+			elif op_type == TT_DIV:
+				if b == 0:
+					self.fail(row, node.right_node, 'Division by zero')
+					result.append(None)
+				else:
+					value, error = arithmetic(operator.truediv, a, b)
+					if error:
+						self.fail(row, node.right_node, error)
+					result.append(value)
+			else:
+				value, error = power(a, b)
+				if error:
+					self.fail(row, node, error)
+				result.append(value)
+		return result
+
+	def rows_operation(self, node, checked, left, right):
+		# checked(a, b) gives (value, error) for each row.
+		result = []
+		for row, (a, b) in enumerate(zip(left, right)):
+			value = None
+			if a is not None and b is not None:
+				value, error = checked(a, b)
+				if error:
+					self.fail(row, node, error)
+			result.append(value)
+		return result
+
+	def visit_UnaryOpNode(self, node):
+		operand = self.visit(node.node)
+		if node.op_tok.type == TT_MINUS:
+			return [None if a is None else -a for a in operand]
+		elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+			return [None if a is None else int(not a) for a in operand]
+		return operand
+
+class NumpyBatchEvaluator(BatchEvaluator):
+	# Same evaluation with NumPy arrays as columns, giving the same values
+	# and errors as BatchEvaluator. Failed rows are tracked in a mask instead
+	# of None values. Int columns are int64 only while an operation cannot
+	# overflow or round differently from Python (see exact); otherwise
+	# they become object columns of Python ints, as does a binding that
+	# mixes ints and floats, so every row keeps the type Python would give.
+	def __init__(self, columns, rows, context):
+		super().__init__({name: self.column(values) for name, values in columns.items()}, rows, context)
+		self.failed = numpy.zeros(rows, dtype=bool)
+
+	def evaluate(self, node):
+		with numpy.errstate(all='ignore'):
+			values = self.visit(node).tolist()
+		for row in numpy.flatnonzero(self.failed):
+			values[row] = None
+		return BatchResult(values, self.errors)
+
+	def fail_rows(self, mask, node, details):
+		mask = mask & ~self.failed
+		for row in numpy.flatnonzero(mask):
+			self.fail(row, node, details)
+		self.failed |= mask
+
+	def column(self, values):
+		array = numpy.asarray(values)
+		kind = array.dtype.kind
+		if kind == 'f' and not isinstance(values, numpy.ndarray) and any(type(value) is int for value in values):
+			return numpy.array(values, dtype=object)
+		if kind == 'f':
+			return array.astype(numpy.float64, copy=False)
+		if kind in 'iu' and self.magnitude(array) < 2 ** 63:
+			return array.astype(numpy.int64, copy=False)
+		if kind == 'O':
+			return array
+		return array.astype(object)
+
+	def constant(self, value):
+		return self.column(numpy.full(self.rows, value, dtype=numpy.asarray(value).dtype))
+
+	def undefined(self, tok, details):
+		self.fail_rows(numpy.ones(self.rows, dtype=bool), tok, details)
+		return numpy.zeros(self.rows)
+
+	def magnitude(self, column):
+		# Largest absolute value in an int column, as a Python int.
+		if not len(column):
+			return 0
+		return max(abs(int(column.min())), abs(int(column.max())))
+
+	def exact(self, op_type, left, right):
+		# Whether NumPy computes op_type on these columns as Python would:
+		# int64 results must not overflow, and ints meeting floats (or
+		# divided) must convert to float64 without rounding.
+		left_kind, right_kind = left.dtype.kind, right.dtype.kind
+		if left_kind == 'O' or right_kind == 'O':
+			return False
+		if left_kind == 'f' and right_kind == 'f':
+			return True
+		if left_kind == 'f' or right_kind == 'f':
+			return self.magnitude(right if left_kind == 'f' else left) <= 2 ** 53
+		left_magnitude, right_magnitude = self.magnitude(left), self.magnitude(right)
+		if op_type in (TT_PLUS, TT_MINUS):
+			return left_magnitude + right_magnitude < 2 ** 63
+		elif op_type == TT_MUL:
+			return left_magnitude * right_magnitude < 2 ** 63
+		elif op_type == TT_DIV:
+			return max(left_magnitude, right_magnitude) <= 2 ** 53
+		elif op_type == TT_POW:
+			# Negative exponents give floats, so they must all be negative.
+			if (right < 0).any():
+				return (right < 0).all() and left_magnitude <= 2 ** 53
+			return left_magnitude.bit_length() * right_magnitude < 63
+		return True
+
+	def visit_BinOpNode(self, node):
+		left = self.visit(node.left_node)
+		right = self.visit(node.right_node)
+		op_type = node.op_tok.type
+
+		if not self.exact(op_type, left, right):
+			left = left.astype(object)
+			right = right.astype(object)
+
+		if op_type in (TT_PLUS, TT_MINUS, TT_MUL):
+			operation = BATCH_OPERATIONS[op_type]
+			try:
+				return operation(left, right)
+			except OverflowError:
+				# Only object columns raise; redo them row by row.
+				return self.object_operation(node, lambda a, b: arithmetic(operation, a, b), left, right)
+		elif op_type in COMPARISON_OPERATORS:
+			return COMPARISON_OPERATORS[op_type](left, right).astype(numpy.int64)
+		elif node.op_tok.matches(TT_KEYWORD, 'AND'):
+			return numpy.logical_and(left.astype(bool), right.astype(bool)).astype(numpy.int64)
+		elif node.op_tok.matches(TT_KEYWORD, 'OR'):
+			return numpy.logical_or(left.astype(bool), right.astype(bool)).astype(numpy.int64)
+		elif op_type == TT_DIV:
+			zero = right == 0
+			self.fail_rows(zero, node.right_node, 'Division by zero')
+			right = numpy.where(zero, 1, right)
+			try:
+				return numpy.true_divide(left, right)
+			except OverflowError:
+				return self.object_operation(node.right_node, lambda a, b: arithmetic(operator.truediv, a, b), left, right)
+
+		if left.dtype.kind == 'O':
+			return self.object_operation(node, power, left, right)
+
+		self.fail_rows((left == 0) & (right < 0), node, 'Division by zero')
+		if left.dtype.kind == 'i' and right.dtype.kind == 'i' and len(right) and right[0] < 0:
+			left = left.astype(numpy.float64)
+		result = numpy.power(left, right)
+		if result.dtype.kind == 'f':
+			# Where Python raises instead of giving inf or nan.
+			finite = numpy.isfinite(left) & numpy.isfinite(right)
+			self.fail_rows(finite & numpy.isinf(result), node, 'Result out of range')
+			self.fail_rows(finite & numpy.isnan(result) & (left < 0), node, 'Result is not a real number')
+		return result
+
+	def object_operation(self, node, checked, left, right):
+		# checked(a, b), which gives (value, error), for every row that has
+		# not failed yet.
+		result = numpy.zeros(self.rows, dtype=object)
+		for row in range(self.rows):
+			if self.failed[row]:
+				continue
+			value, error = checked(left[row], right[row])
+			if error:
+				self.fail(row, node, error)
+				self.failed[row] = True
+			else:
+				result[row] = value
+		return result
+
+	def visit_UnaryOpNode(self, node):
+		operand = self.visit(node.node)
+		if node.op_tok.type == TT_MINUS:
+			return -operand
+		elif node.op_tok.matches(TT_KEYWORD, 'NOT'):
+			return (operand == 0).astype(numpy.int64)
+		return operand
+
+def run_batch(text, bindings, fn='<batch>', optimize=False, cache=None):
+	# Parses text once and evaluates it for every row of bindings, a mapping
+	# of variable name to a list or array of values (all the same length).
+	# Names not in bindings are looked up in global_symbol_table. Assignments
+	# only affect the batch. Uses NumPy when it is installed.
+	if cache is not None:
+		program, error = cache.get(fn, text, optimize)
+	else:
+		program, error = make_program(fn, text, optimize)
+	if error: return None, error
+
+	lengths = {len(values) for values in bindings.values()}
+	if len(lengths) > 1:
+		raise ValueError('All binding columns must have the same length')
+	rows = lengths.pop() if lengths else 1
+
+	context = Context('<batch>')
+	context.symbol_table = global_symbol_table
+	if not batch_compatible(program, bindings):
+		return run_rows(program.node, bindings, rows), None
+	evaluator_class = NumpyBatchEvaluator if numpy is not None else BatchEvaluator
+	evaluator = evaluator_class(bindings, rows, context)
+	return evaluator.evaluate(program.node), None
+
+def batch_compatible(program, bindings):
+	# Whether the column evaluators can run program: it uses no IF, loops,
+	# FUN or calls, and every global it reads is a number.
+	if not program.arithmetic:
+		return False
+	for node in walk_nodes(program.node):
+		if isinstance(node, VarAccessNode) and node.var_name_tok.value not in bindings:
+			value = global_symbol_table.get(node.var_name_tok.value)
+			if value is not None and not isinstance(value, Number):
+				return False
+	return True
+
+def run_rows(node, bindings, rows):
+	# Row by row fallback for run_batch: runs the Interpreter once per row,
+	# each in its own symbol table on top of global_symbol_table.
+	columns = {
+		name: values.tolist() if hasattr(values, 'tolist') else list(values)
+		for name, values in bindings.items()
+	}
+	interpreter = Interpreter()
+	values = []
+	errors = []
+	for row in range(rows):
+		context = Context('<batch>')
+		context.symbol_table = SymbolTable(global_symbol_table)
+		for name, column in columns.items():
+			context.symbol_table.set(name, Number.of(column[row]))
+
+		result = interpreter.visit(node, context)
+		if result.error:
+			values.append(None)
+		elif isinstance(result.value, Number):
+			values.append(result.value.value)
+		else:
+			values.append(result.value)
+		errors.append(result.error)
+	return BatchResult(values, errors)
+
 ###################### 
 #######  Lex program to count the number of lines, spaces and tabs #####
 
 def count_lines_spaces_tabs(text):
-    lexer = Lexer("input.txt", text)
-    tokens, error = lexer.make_tokens()
+    # text may also be a file object or an iterable of strings; those are
+    # streamed through iter_tokens instead of being read into memory.
+    if isinstance(text, str):
+        lexer = Lexer("input.txt", text)
+        tokens, error = lexer.make_tokens()
 
-    if error:
-        return str(error)
+        if error:
+            return str(error)
+    else:
+        tokens = iter_tokens("input.txt", text)
 
     line_count, space_count, tab_count = 0, 0, 0
 
@@ -644,8 +4624,159 @@ def count_lines_spaces_tabs(text):
         elif token.type == TT_TAB:
             tab_count += token.value
 
+    return format_counts(line_count, space_count, tab_count)
+
+def format_counts(line_count, space_count, tab_count):
     return f"Total lines: {line_count}, Total spaces: {space_count}, Total tabs: {tab_count}"
 
+COUNT_WINDOW = 1 << 22
+PARALLEL_COUNT_MIN_SIZE = 1 << 26
+
+def count_lines_spaces_tabs_file(path, workers=None):
+    return format_counts(*whitespace_counts(path, workers))
+
+def whitespace_counts(path, workers=None):
+    # Counts newline, space and tab bytes of a file without lexing it. Every
+    # one of those characters ends up in a LINE, SPACE or TAB token, so the
+    # totals match count_lines_spaces_tabs for the decoded text (any
+    # ASCII-compatible encoding; '\r' is not translated to '\n' here).
+    # Files of PARALLEL_COUNT_MIN_SIZE bytes or more are split into one byte
+    # range per worker process.
+    size = os.path.getsize(path)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or size < PARALLEL_COUNT_MIN_SIZE:
+        return count_byte_range(path, 0, size)
+
+    step = -(-size // workers)
+    ranges = [(start, min(start + step, size)) for start in range(0, size, step)]
+    line_count, space_count, tab_count = 0, 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(count_byte_range, path, start, stop) for start, stop in ranges]
+        for future in futures:
+            lines, spaces, tabs = future.result()
+            line_count += lines
+            space_count += spaces
+            tab_count += tabs
+    return line_count, space_count, tab_count
+
+def count_byte_range(path, start, stop):
+    line_count, space_count, tab_count = 0, 0, 0
+    if stop <= start:
+        return line_count, space_count, tab_count
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for window_start in range(start, stop, COUNT_WINDOW):
+            window = mapped[window_start:min(window_start + COUNT_WINDOW, stop)]
+            line_count += window.count(b'\n')
+            space_count += window.count(b' ')
+            tab_count += window.count(b'\t')
+    return line_count, space_count, tab_count
+
+#######################################
+# PARALLEL LEXING
+#######################################
+
+PARALLEL_LEX_MIN_SIZE = 1 << 24
+PIECES_PER_WORKER = 4
+BLANK_BYTE = re.compile(rb'[ \t]')
+
+def lex_file_parallel(path, workers=None, fn=None):
+    # Same TokenBuffer as Lexer(fn, <file bytes>, ENGINE_REGEX).make_token_buffer
+    # for a file of PARALLEL_LEX_MIN_SIZE bytes or more, lexed in pieces by
+    # worker processes. The buffer's source is a read-only mmap of the file.
+    #
+    # Pieces are cut right after a newline, so no word, number or UTF-8
+    # sequence is split, only (maybe) a newline run. A stretch without
+    # newlines is cut after a space or tab instead, which can only split a
+    # blank run. stitch_piece joins the runs split at a cut back together.
+    fn = path if fn is None else fn
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return Lexer(fn, b'', ENGINE_REGEX).make_token_buffer()
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or size < PARALLEL_LEX_MIN_SIZE:
+        return Lexer(fn, mapped, ENGINE_REGEX).make_token_buffer()
+
+    cuts = piece_cuts(mapped, workers * PIECES_PER_WORKER)
+    buffer = TokenBuffer(fn, mapped)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(lex_byte_range, path, start, stop) for start, stop in zip(cuts, cuts[1:])]
+        for future in futures:
+            stitch_piece(buffer, *future.result())
+
+    types = buffer.types
+    if types and types[-1] == TOKEN_CODES[TT_DIGIT]:
+        digit = int(buffer.value_of(len(types) - 1)[-1])
+        buffer.append(TT_EVEN if digit % 2 == 0 else TT_ODD, size, size)
+    return buffer, None
+
+def piece_cuts(data, pieces):
+    # Offsets at which data is cut into about `pieces` pieces of equal size,
+    # each one right after a newline (or a blank when a stretch has none).
+    size = len(data)
+    step = max(1, -(-size // pieces))
+    cuts = [0]
+    for target in range(step, size, step):
+        if target <= cuts[-1]:
+            continue
+        limit = min(target + step, size)
+        cut = data.find(b'\n', target, limit)
+        if cut < 0:
+            match = BLANK_BYTE.search(data, target, limit)
+            cut = match.start() if match else -1
+        if cut >= 0 and cut + 1 < size:
+            cuts.append(cut + 1)
+    cuts.append(size)
+    return cuts
+
+def lex_byte_range(path, start, stop):
+    # Token columns of the file's bytes [start, stop), with offsets into the
+    # whole file and without the parity token.
+    types, starts, ends = array('B'), array('q'), array('q')
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        scan_columns(mapped, types, starts, ends, start, stop)
+    return types, starts, ends
+
+def stitch_piece(buffer, types, starts, ends):
+    # Appends the columns of the next piece to buffer. A newline run, or a
+    # blank run, that was split at the cut becomes one token (two for a
+    # blank run with both spaces and tabs) spanning both halves.
+    line_code = TOKEN_CODES[TT_LINE]
+    blank_codes = (TOKEN_CODES[TT_SPACE], TOKEN_CODES[TT_TAB])
+    out_types, out_starts, out_ends = buffer.types, buffer.starts, buffer.ends
+    first = 0
+
+    if out_types and types and out_ends[-1] == starts[0]:
+        if out_types[-1] == line_code and types[0] == line_code:
+            out_ends[-1] = ends[0]
+            first = 1
+        elif out_types[-1] in blank_codes and types[0] in blank_codes:
+            cut = starts[0]
+            run_start = out_starts[-1]
+            present = set()
+            while out_types and out_types[-1] in blank_codes and out_ends[-1] == cut:
+                present.add(out_types.pop())
+                out_starts.pop()
+                out_ends.pop()
+            while first < len(types) and types[first] in blank_codes and starts[first] == cut:
+                present.add(types[first])
+                first += 1
+            run_end = ends[0]
+            for code in blank_codes:
+                if code in present:
+                    out_types.append(code)
+                    out_starts.append(run_start)
+                    out_ends.append(run_end)
+
+    if first:
+        types, starts, ends = types[first:], starts[first:], ends[first:]
+    out_types.extend(types)
+    out_starts.extend(starts)
+    out_ends.extend(ends)
+
 ###################  
 def count_tokens(self):
         return len(self.tokens)
@@ -655,13 +4786,14 @@ Lexer.count_tokens = count_tokens
 
 ######################
 def make_number(self):
-    num_str = ''
+    start = self.pos.idx
     
     while self.current_char is not None and self.current_char in DIGITS:
-        num_str += self.current_char
         self.advance()
     
-    return Token(TT_DIGIT, num_str)
+    return Token(TT_DIGIT, self.text[start:self.pos.idx])
+
+Lexer.make_number = make_number
 
 ############ MAIN FUNCTION ##########
 
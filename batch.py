@@ -0,0 +1,153 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import B1_500091612 as basic
+
+MODES = ('lex', 'count', 'run')
+
+def expand_globs(patterns):
+    seen = set()
+    for pattern in patterns:
+        for path in glob.iglob(pattern, recursive=True):
+            if path not in seen and os.path.isfile(path):
+                seen.add(path)
+                yield path
+
+def process_file(path, modes):
+    result = {'file': path}
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        result['error'] = str(e)
+        return result
+
+    if 'lex' in modes:
+        lexer = basic.Lexer(path, text, basic.ENGINE_REGEX)
+        lexer.make_token_buffer()
+        result['tokens'] = lexer.count_tokens()
+
+    if 'count' in modes:
+        lines, spaces, tabs = basic.whitespace_counts(path, workers=1)
+        result['lines'] = lines
+        result['spaces'] = spaces
+        result['tabs'] = tabs
+
+    if 'run' in modes:
+        # A failing run keeps the tokens and counts found above.
+        try:
+            run_file(path, text, result)
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+
+    return result
+
+def run_file(path, text, result):
+    # Each file gets its own variables on top of NULL/TRUE/FALSE. The
+    # precedence parser takes files of any nesting depth.
+    symbol_table = basic.SymbolTable(basic.global_symbol_table)
+    value, error = basic.run(
+        path, text, basic.BACKEND_CLOSURE, symbol_table=symbol_table, parser=basic.PARSER_PRECEDENCE,
+    )
+    if error:
+        result['error'] = error.as_string()
+    # Functions are written as '<function name>', and ints too long for str()
+    # as hex.
+    elif not isinstance(value, basic.Number):
+        result['result'] = repr(value)
+    elif isinstance(value.value, int) and not basic.printable_int(value.value):
+        result['result'] = hex(value.value)
+    else:
+        result['result'] = value.value
+
+def error_result(path, e):
+    return {'file': path, 'error': f'{type(e).__name__}: {e}'}
+
+def process_files(paths, modes):
+    # One file failing does not cost the rest of the batch its results.
+    results = []
+    for path in paths:
+        try:
+            results.append(process_file(path, modes))
+        except Exception as e:
+            results.append(error_result(path, e))
+    return results
+
+def batches(paths, size):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def run_driver(patterns, modes, jobs=None, max_inflight=None, batch_size=1, out=sys.stdout):
+    # Streams one JSON line per file, in completion order. At most
+    # max_inflight batches are submitted to the pool at any time, so the
+    # file list is consumed lazily and memory stays flat.
+    jobs = jobs or os.cpu_count() or 1
+    max_inflight = max_inflight or 2 * jobs
+    summary = {'files': 0, 'errors': 0, 'tokens': 0}
+    pending = set()
+    paths = {}
+    work = batches(expand_globs(patterns), batch_size)
+
+    def write(results):
+        for result in results:
+            summary['files'] += 1
+            summary['errors'] += 'error' in result
+            summary['tokens'] += result.get('tokens', 0)
+            out.write(json.dumps(result) + '\n')
+        out.flush()
+
+    def finish(future):
+        # A batch whose worker died (or whose results could not be sent
+        # back) is reported file by file.
+        batch = paths.pop(future)
+        try:
+            results = future.result()
+        except Exception as e:
+            results = [error_result(path, e) for path in batch]
+        write(results)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for batch in work:
+            if len(pending) >= max_inflight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+            future = pool.submit(process_files, batch, modes)
+            paths[future] = batch
+            pending.add(future)
+
+        for future in pending:
+            finish(future)
+
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Lex, count and run source files in parallel, writing JSON lines.')
+    parser.add_argument('patterns', nargs='+', help="file globs, e.g. 'src/**/*.txt'")
+    parser.add_argument('-m', '--mode', action='append', choices=MODES,
+                        help='what to do with each file (repeatable, default: all)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--max-inflight', type=int, default=None,
+                        help='batches submitted but not finished (default: 2 x jobs)')
+    parser.add_argument('--batch-size', type=int, default=16, help='files per worker task')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    summary = run_driver(args.patterns, tuple(args.mode or MODES), args.jobs, args.max_inflight, args.batch_size)
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
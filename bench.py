@@ -0,0 +1,256 @@
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+import B1_500091612 as basic
+
+#######################################
+# INPUTS
+#######################################
+
+def whitespace_text(size, rng):
+    # Long runs of spaces, tabs and newlines between short words.
+    parts = []
+    length = 0
+    while length < size:
+        part = rng.choice(['word', 'x1', '42']) + ' ' * rng.randint(1, 40) + '\t' * rng.randint(0, 6)
+        if rng.random() < 0.3:
+            part += '\n' * rng.randint(1, 5)
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+def word_number_text(size, rng):
+    words = ['alpha', 'beta', 'gamma7', 'delta', 'x', 'lorem', 'ipsum']
+    parts = []
+    length = 0
+    while length < size:
+        part = rng.choice(words) if rng.random() < 0.6 else str(rng.randint(0, 10 ** 6))
+        parts.append(part)
+        length += len(part) + 1
+    return ' '.join(parts)
+
+def nested_expression(size, depth, rng):
+    # Parenthesized arithmetic nested `depth` levels deep, repeated and joined
+    # with '+' until the text reaches about `size` characters.
+    def nested(level):
+        # Built from the inside out, drawing from rng in the order of
+        # ((1 op n) op n): the operators outermost first, then the numbers.
+        ops = [rng.choice(['+', '-', '*']) for _ in range(level)]
+        expression = str(rng.randint(1, 9))
+        for op in reversed(ops):
+            expression = f'({expression} {op} {rng.randint(1, 9)})'
+        return expression
+
+    parts = []
+    length = 0
+    while length < size:
+        part = nested(depth)
+        parts.append(part)
+        length += len(part) + 3
+    return ' + '.join(parts)
+
+#######################################
+# MEASUREMENT
+#######################################
+
+def best_time(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def skip(name, reason):
+    print(f'skipping {name}: {reason}', file=sys.stderr)
+
+def parses(parser_class, tokens):
+    # The recursive parser runs out of stack on deeply nested input.
+    try:
+        return parser_class(tokens).parse().error is None
+    except RecursionError:
+        return False
+
+def measure(name, func, count_of, unit, repeat):
+    seconds, result = best_time(func, repeat)
+    count = count_of(result)
+    return name, {
+        'unit': unit,
+        'count': count,
+        'seconds': round(seconds, 6),
+        'rate': round(count / seconds, 1) if seconds else None,
+        'peak_kib': round(peak_memory(func) / 1024, 1),
+    }
+
+#######################################
+# BENCHMARKS
+#######################################
+
+def run_benchmarks(size, depth, evals, repeat, seed):
+    rng = random.Random(seed)
+    inputs = {
+        'whitespace': whitespace_text(size, rng),
+        'words': word_number_text(size, rng),
+        'nested': nested_expression(size // 10, depth, rng),
+    }
+    results = {}
+
+    def add(entry):
+        results[entry[0]] = entry[1]
+
+    for input_name in ('whitespace', 'words'):
+        text = inputs[input_name]
+        for engine in (basic.ENGINE_CHAR, basic.ENGINE_REGEX):
+            add(measure(
+                f'lex.{input_name}.{engine}',
+                lambda: basic.Lexer('<bench>', text, engine).make_tokens()[0],
+                len, 'tokens/s', repeat,
+            ))
+        add(measure(
+            f'lex.{input_name}.buffer',
+            lambda: basic.Lexer('<bench>', text).make_token_buffer()[0],
+            len, 'tokens/s', repeat,
+        ))
+        data = text.encode('utf-8')
+        add(measure(
+            f'lex.{input_name}.bytes',
+            lambda: basic.Lexer('<bench>', data, basic.ENGINE_REGEX).make_token_buffer()[0],
+            len, 'tokens/s', repeat,
+        ))
+        add(measure(
+            f'lex.{input_name}.count',
+            lambda: basic.count_lines_spaces_tabs(text),
+            lambda result: len(text), 'chars/s', repeat,
+        ))
+
+    text = inputs['nested']
+    tokens, error = basic.Lexer('<bench>', text, basic.ENGINE_REGEX).make_grammar_tokens()
+    if error:
+        raise Exception(error.as_string())
+    for parser_name, parser_class in basic.PARSERS.items():
+        if not parses(parser_class, tokens):
+            skip(f'parse.nested.{parser_name}', 'input nested too deeply')
+            continue
+        add(measure(
+            f'parse.nested.{parser_name}',
+            lambda: parser_class(tokens).parse().node,
+            lambda node: sum(1 for _ in basic.walk_nodes(node)), 'nodes/s', repeat,
+        ))
+    add(measure(
+        'parse.nested.flat',
+        lambda: basic.FlatParser(tokens).parse().node,
+        len, 'nodes/s', repeat,
+    ))
+
+    node = basic.PARSERS[basic.PARSER_PRECEDENCE](tokens).parse().node
+    context = basic.Context('<bench>')
+    context.symbol_table = basic.global_symbol_table
+    interpreter = basic.Interpreter()
+
+    def evaluate(execute):
+        for _ in range(evals):
+            execute()
+        return evals
+
+    add(measure(
+        'eval.nested.interpreter',
+        lambda: evaluate(lambda: interpreter.visit(node, context)),
+        lambda count: count, 'evals/s', repeat,
+    ))
+    if basic.compilable(node):
+        program = basic.Compiler().compile_program(node)
+        add(measure(
+            'eval.nested.closure',
+            lambda: evaluate(lambda: program.execute(context)),
+            lambda count: count, 'evals/s', repeat,
+        ))
+    else:
+        skip('eval.nested.closure', 'input nested too deeply')
+    flat = basic.flatten(node)
+    flat_interpreter = basic.FlatInterpreter(interpreter)
+    add(measure(
+        'eval.nested.flat',
+        lambda: evaluate(lambda: flat_interpreter.run(flat, context)),
+        lambda count: count, 'evals/s', repeat,
+    ))
+    bytecode = basic.BytecodeCompiler().compile_program(node)
+    add(measure(
+        'eval.nested.vm',
+        lambda: evaluate(lambda: bytecode.execute(context)),
+        lambda count: count, 'evals/s', repeat,
+    ))
+    return results
+
+#######################################
+# BASELINES
+#######################################
+
+def compare(results, baseline, tolerance):
+    # A benchmark regresses when its rate drops, or its peak memory grows, by
+    # more than `tolerance` (a fraction) against the baseline.
+    regressions = []
+    for name, old in baseline['results'].items():
+        new = results.get(name)
+        if new is None:
+            continue
+        if old['rate'] and new['rate'] and new['rate'] < old['rate'] * (1 - tolerance):
+            regressions.append(f"{name}: {new['rate']:.1f} {new['unit']} vs {old['rate']:.1f} baseline")
+        if old['peak_kib'] and new['peak_kib'] > old['peak_kib'] * (1 + tolerance):
+            regressions.append(f"{name}: peak {new['peak_kib']:.1f} KiB vs {old['peak_kib']:.1f} KiB baseline")
+    return regressions
+
+def report(results, out=sys.stdout):
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        out.write(f"{name:<{width}}  {result['rate']:>14,.1f} {result['unit']:<9}  peak {result['peak_kib']:>10,.1f} KiB\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the lexer, parser and evaluators.')
+    parser.add_argument('--size', type=int, default=200000, help='approximate characters per lexer input')
+    parser.add_argument('--depth', type=int, default=30, help='parenthesis nesting depth of the parser input')
+    parser.add_argument('--evals', type=int, default=20, help='evaluations per eval measurement')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark (best time is kept)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='FILE', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='flag regressions against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown or memory growth (fraction)')
+    args = parser.parse_args(argv)
+
+    params = {'size': args.size, 'depth': args.depth, 'evals': args.evals, 'seed': args.seed}
+    results = run_benchmarks(args.size, args.depth, args.evals, args.repeat, args.seed)
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'params': params, 'python': platform.python_version(), 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"warning: baseline was run with {baseline.get('params')}", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import B1_500091612 as basic
+
+OPS = ('run', 'lex')
+
+# Seconds a batch may run past the timeout of its last request before its
+# workers are killed.
+WORKER_GRACE = 1.0
+
+#######################################
+# WORKERS
+#######################################
+
+# Compiled-program cache of a worker process, shared by every request the
+# worker handles.
+worker_cache = None
+
+def init_worker(cache_size, cache_dir):
+    global worker_cache
+    worker_cache = basic.ProgramCache(cache_size, cache_dir)
+
+def plain_value(value):
+    # Ints too long for str(), which json.dumps needs, are sent as hex.
+    if isinstance(value, basic.Number):
+        value = value.value
+    if isinstance(value, int) and not basic.printable_int(value):
+        return hex(value)
+    if isinstance(value, (int, float)):
+        return value
+    return str(value)
+
+def request_id(line):
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return None
+    return request.get('id') if isinstance(request, dict) else None
+
+def process_request(request):
+    op = request.get('op', 'run')
+    fn = request.get('fn', '<request>')
+    text = request['text']
+
+    if op == 'lex':
+        lexer = basic.Lexer(fn, text, basic.ENGINE_REGEX)
+        lexer.make_token_buffer()
+        return {'tokens': lexer.count_tokens()}
+
+    # Each request gets its own variables on top of NULL/TRUE/FALSE.
+    symbol_table = basic.SymbolTable(basic.global_symbol_table)
+    for name, value in request.get('vars', {}).items():
+        symbol_table.set(name, basic.Number.of(value))
+
+    # limits is (max_steps, timeout, max_int_bits), filled in by the server.
+    limits = basic.Limits(*request['limits']) if 'limits' in request else None
+    value, error = basic.run(
+        fn, text, request.get('backend', basic.BACKEND_CLOSURE),
+        optimize=request.get('optimize', False),
+        cache=worker_cache, symbol_table=symbol_table, limits=limits,
+    )
+    if error:
+        return {'error': error.as_string()}
+    return {'result': plain_value(value)}
+
+def process_batch(requests):
+    results = []
+    for request in requests:
+        try:
+            results.append(process_request(request))
+        except Exception as e:
+            results.append({'error': f'{type(e).__name__}: {e}'})
+    return os.getpid(), worker_cache.stats(), results
+
+#######################################
+# SERVER
+#######################################
+
+class ServerStats:
+    # Counters plus the latencies of the most recent requests.
+    def __init__(self, window=1000):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.invalid = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+        self.caches = {}
+
+    def record(self, latency, error):
+        self.completed += 1
+        self.errors += error
+        self.latencies.append(latency)
+
+    def percentile(self, latencies, fraction):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3)
+
+    def as_dict(self, queued):
+        uptime = time.perf_counter() - self.started
+        latencies = sorted(self.latencies)
+        cache = {}
+        for stats in self.caches.values():
+            for key, value in stats.items():
+                if key != 'maxsize':
+                    cache[key] = cache.get(key, 0) + value
+        return {
+            'uptime': round(uptime, 3),
+            'received': self.received,
+            'completed': self.completed,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'invalid': self.invalid,
+            'queued': queued,
+            'batches': self.batches,
+            'throughput': round(self.completed / uptime, 1) if uptime else 0.0,
+            'latency_ms': {
+                'p50': self.percentile(latencies, 0.50),
+                'p95': self.percentile(latencies, 0.95),
+                'p99': self.percentile(latencies, 0.99),
+                'max': self.percentile(latencies, 1.0),
+            },
+            'cache': cache,
+        }
+
+class Pending:
+    __slots__ = ('request', 'future', 'received', 'deadline')
+
+    def __init__(self, request, future, deadline):
+        self.request = request
+        self.future = future
+        self.received = time.perf_counter()
+        # Event loop time at which the request times out, or None.
+        self.deadline = deadline
+
+class EvaluationServer:
+    # Requests are newline-delimited JSON objects:
+    #   {"id": 1, "op": "run", "text": "VAR a = x * 2", "vars": {"x": 3}}
+    #   {"id": 2, "op": "lex", "text": "some words 12"}
+    #   {"id": 3, "op": "stats"}
+    # and every one gets a single JSON line back with the same id, in
+    # completion order. Requests wait in a bounded queue; a full queue, or a
+    # connection with max_pending requests in flight, stops the server from
+    # reading that connection, so clients are slowed down instead of
+    # buffered. The batcher takes up to batch_size requests (waiting at most
+    # batch_delay for more) and runs them in a process pool, with at most
+    # two batches per worker in the pool at once. Evaluation stops with a
+    # runtime error once a request has used max_steps steps or its timeout,
+    # or would compute an integer over max_int_bits bits. A batch still
+    # running WORKER_GRACE seconds after all its requests timed out has its
+    # pool killed and replaced, so it cannot hold a batch slot forever.
+    def __init__(self, workers=None, batch_size=32, batch_delay=0.002, queue_size=1024,
+                 max_pending=256, timeout=5.0, cache_size=1024, cache_dir=None,
+                 max_steps=None, max_int_bits=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue_size = queue_size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.max_steps = max_steps
+        self.max_int_bits = max_int_bits
+        self.stats = ServerStats()
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.batch_slots = asyncio.Semaphore(2 * self.workers)
+        self.pool = self.make_pool()
+        self.batcher = asyncio.create_task(self.run_batches())
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    def make_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_worker,
+            initargs=(self.cache_size, self.cache_dir),
+        )
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.pool.shutdown(cancel_futures=True)
+
+    ###################################
+
+    async def handle_client(self, reader, writer):
+        write_lock = asyncio.Lock()
+        in_flight = asyncio.Semaphore(self.max_pending)
+        tasks = set()
+
+        async def respond(response):
+            async with write_lock:
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        async def serve(line):
+            try:
+                await respond(await self.handle_line(line))
+            except ConnectionError:
+                pass
+            except Exception as e:
+                # Every request gets its line, even when handling it or
+                # encoding the response failed.
+                try:
+                    await respond({'id': request_id(line), 'error': f'{type(e).__name__}: {e}'})
+                except ConnectionError:
+                    pass
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await in_flight.acquire()
+                task = asyncio.create_task(serve(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled when the server shuts down; the connection just ends.
+            pass
+        finally:
+            writer.close()
+
+    async def handle_line(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request must be a JSON object')
+        except ValueError as e:
+            self.stats.invalid += 1
+            return {'id': None, 'error': f'invalid request: {e}'}
+
+        response = {'id': request.get('id')}
+        op = request.get('op', 'run')
+        if op == 'stats':
+            response['stats'] = self.stats.as_dict(self.queue.qsize())
+            return response
+        if op not in OPS or not isinstance(request.get('text'), str):
+            self.stats.invalid += 1
+            response['error'] = f"invalid request: expected op in {OPS} and a 'text' string"
+            return response
+
+        timeout = request.get('timeout', self.timeout)
+        if 'timeout' in request:
+            # A request may shorten the server's timeout, never lift it.
+            if type(timeout) not in (int, float) or not timeout > 0:
+                self.stats.invalid += 1
+                response['error'] = "invalid request: 'timeout' must be a positive number of seconds"
+                return response
+            if self.timeout is not None:
+                timeout = min(timeout, self.timeout)
+
+        self.stats.received += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        pending = Pending(request, loop.create_future(), deadline)
+        request['limits'] = (self.max_steps, timeout, self.max_int_bits)
+        try:
+            # Waiting for room in the queue counts against the timeout too.
+            result = await asyncio.wait_for(self.submit(pending), timeout)
+        except asyncio.TimeoutError:
+            # The worker's limits only cover evaluation, not lexing, parsing
+            # or the requests before this one in its batch, so it may well
+            # still be busy; expire_batch stops it if it runs on for long.
+            # Its result is dropped.
+            self.stats.timeouts += 1
+            response['error'] = 'timeout'
+            return response
+
+        self.stats.record(time.perf_counter() - pending.received, 'error' in result)
+        response.update(result)
+        return response
+
+    async def submit(self, pending):
+        await self.queue.put(pending)
+        return await pending.future
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests that timed out while queued are not run.
+            batch = [pending for pending in batch if not pending.future.done()]
+            if batch:
+                await self.batch_slots.acquire()
+                self.stats.batches += 1
+                try:
+                    task = loop.run_in_executor(self.pool, process_batch, [pending.request for pending in batch])
+                except Exception as e:
+                    # Raised right away once a dead worker broke the pool; the
+                    # batcher has to keep running for the requests after it.
+                    task = loop.create_future()
+                    task.set_exception(e)
+                task = asyncio.ensure_future(task)
+                task.add_done_callback(
+                    lambda task, batch=batch, pool=self.pool: self.finish_batch(task, batch, pool)
+                )
+                deadlines = [pending.deadline for pending in batch]
+                if None not in deadlines:
+                    loop.call_at(max(deadlines) + WORKER_GRACE, self.expire_batch, task, self.pool)
+
+    def expire_batch(self, task, pool):
+        # Every request of the batch has timed out and a worker is still on
+        # it. There is no way to stop one task of a ProcessPoolExecutor, so
+        # the pool's workers are killed; the batches they had fail with
+        # BrokenProcessPool and give up their slots in finish_batch.
+        if task.done():
+            return
+        if pool is self.pool:
+            self.pool = self.make_pool()
+        for process in list(pool._processes.values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def finish_batch(self, task, batch, pool):
+        self.batch_slots.release()
+        try:
+            pid, cache_stats, results = task.result()
+        except Exception as e:
+            results = [{'error': f'{type(e).__name__}: {e}'}] * len(batch)
+            if isinstance(e, BrokenProcessPool) and pool is self.pool:
+                # Replace the pool so later batches get live workers.
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = self.make_pool()
+        else:
+            self.stats.caches[pid] = cache_stats
+
+        for pending, result in zip(batch, results):
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+#######################################
+# MAIN
+#######################################
+
+async def serve(args):
+    server = EvaluationServer(
+        args.workers, args.batch_size, args.batch_delay, args.queue_size,
+        args.max_pending, args.timeout, args.cache_size, args.cache_dir,
+        args.max_steps, args.max_int_bits,
+    )
+    host, port = await server.start(args.host, args.port)
+    print(f'listening on {host}:{port}', file=sys.stderr)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve run/lex requests as newline-delimited JSON over TCP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=32, help='most requests sent to a worker at once')
+    parser.add_argument('--batch-delay', type=float, default=0.002, help='seconds to wait for a batch to fill')
+    parser.add_argument('--queue-size', type=int, default=1024, help='requests waiting for a worker before reads stop')
+    parser.add_argument('--max-pending', type=int, default=256, help='requests in flight per connection')
+    parser.add_argument('--timeout', type=float, default=5.0, help='default per-request timeout in seconds')
+    parser.add_argument('--cache-size', type=int, default=1024, help='compiled programs cached per worker')
+    parser.add_argument('--cache-dir', default=None, help='also keep compiled programs on disk here')
+    parser.add_argument('--max-steps', type=int, default=None, help='evaluation steps allowed per request')
+    parser.add_argument('--max-int-bits', type=int, default=None, help='largest integer result, in bits')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-import basic
+import B1_500091612 as basic
 
 while True:
     text = input('basic > ') ## condition
@@ -1,26 +1,190 @@
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque, OrderedDict
+
+class LineIndex:
+    # Offset at which each line of a text starts, so an offset is turned
+    # into a line and column with one binary search. For bytes-like texts
+    # offsets and columns are in bytes.
+    #
+    # edited() derives the index of an edited text without rescanning it,
+    # leaving the offset shift of the lines after the edit pending like
+    # TokenBuffer does: starts of the lines from shift_lines[i] up to the
+    # next segment are stored without shift_offsets[i], and shift_firsts[i]
+    # is where the first of those lines starts.
+    max_shifts = 256
+
+    def __init__(self, text):
+        self.length = len(text)
+        self.starts = starts = array('q', [0])
+        self.shift_lines = [0]
+        self.shift_offsets = [0]
+        self.shift_firsts = [0]
+        if isinstance(text, memoryview):
+            starts.extend(match.end() for match in NEWLINE_BYTES.finditer(text))
+            return
+        newline = '\n' if isinstance(text, str) else b'\n'
+        find = text.find
+        idx = find(newline)
+        while idx >= 0:
+            starts.append(idx + 1)
+            idx = find(newline, idx + 1)
+
+    def offset_of(self, ln):
+        shift_lines = self.shift_lines
+        if len(shift_lines) == 1:
+            return self.shift_offsets[0]
+        return self.shift_offsets[bisect_right(shift_lines, ln) - 1]
+
+    def line_start(self, ln):
+        return self.starts[ln] + self.offset_of(ln)
+
+    def line_col(self, idx):
+        shift_lines = self.shift_lines
+        if len(shift_lines) == 1:
+            low, high, offset = 0, len(self.starts), self.shift_offsets[0]
+        else:
+            segment = max(bisect_right(self.shift_firsts, idx) - 1, 0)
+            low = shift_lines[segment]
+            high = shift_lines[segment + 1] if segment + 1 < len(shift_lines) else len(self.starts)
+            offset = self.shift_offsets[segment]
+        ln = bisect_right(self.starts, idx - offset, low, high) - 1
+        if ln < 0: ln = 0
+        return ln, idx - self.starts[ln] - offset
+
+    def line_end(self, ln):
+        # Offset of the newline that ends line ln, or the end of the text.
+        if ln + 1 < len(self.starts):
+            return self.line_start(ln + 1) - 1
+        return self.length
+
+    def edited(self, offset, deleted, inserted):
+        # Index of this text with `deleted` characters at offset replaced by
+        # inserted. Only the lines starting inside the edit are rescanned;
+        # this index is left as it is.
+        delta = len(inserted) - deleted
+        shift_lines, shift_offsets = self.shift_lines, self.shift_offsets
+        n = len(self.starts)
+        # Lines [first, stop) started inside the deleted text.
+        first = self.line_col(offset)[0] + 1
+        stop = self.line_col(offset + deleted)[0] + 1
+
+        base = self.offset_of(first - 1)
+        added = array('q')
+        newline = '\n' if isinstance(inserted, str) else b'\n'
+        find = inserted.find
+        idx = find(newline)
+        while idx >= 0:
+            added.append(offset + idx + 1 - base)
+            idx = find(newline, idx + 1)
+        new_stop = first + len(added)
+
+        index = LineIndex.__new__(LineIndex)
+        index.length = self.length + delta
+        index.starts = starts = array('q', self.starts)
+        starts[first:stop] = added
+        # The added lines join the segment of the line before them, and the
+        # lines after the edit continue with their old offsets plus delta.
+        kept = bisect_left(shift_lines, first)
+        index.shift_lines = lines = shift_lines[:kept]
+        index.shift_offsets = offsets = shift_offsets[:kept]
+        if stop < n:
+            stop_offset = self.offset_of(stop) + delta
+            if offsets[-1] != stop_offset:
+                lines.append(new_stop)
+                offsets.append(stop_offset)
+            later = bisect_right(shift_lines, stop)
+            lines.extend(ln + new_stop - stop for ln in shift_lines[later:])
+            offsets.extend(shift_offset + delta for shift_offset in shift_offsets[later:])
+        if len(lines) > self.max_shifts:
+            index.merge_shortest_shift()
+        index.shift_firsts = [starts[ln] + shift_offset for ln, shift_offset in zip(lines, offsets)]
+        return index
+
+    def merge_shortest_shift(self):
+        # Fold the segment with the fewest lines into the one before it.
+        lines, offsets, starts = self.shift_lines, self.shift_offsets, self.starts
+        highs = lines[2:] + [len(starts)]
+        lengths = [high - low for low, high in zip(lines[1:], highs)]
+        segment = lengths.index(min(lengths)) + 1
+        low, high = lines[segment], lines[segment] + lengths[segment - 1]
+        shift = offsets[segment] - offsets[segment - 1]
+        starts[low:high] = array('q', map(shift.__add__, starts[low:high]))
+        del lines[segment]
+        del offsets[segment]
+
+NEWLINE_BYTES = re.compile(b'\n')
+
+# str and bytes texts are looked up by value, the last few in
+# hashed_line_indexes.
+hashed_line_indexes = OrderedDict()
+hashed_line_indexes_lock = threading.Lock()
+HASHED_LINE_INDEXES = 8
+
+def remember_line_index(text, index):
+    with hashed_line_indexes_lock:
+        hashed_line_indexes[text] = index
+        hashed_line_indexes.move_to_end(text)
+        while len(hashed_line_indexes) > HASHED_LINE_INDEXES:
+            hashed_line_indexes.popitem(last=False)
+
+def hashed_line_index(text):
+    index = hashed_line_indexes.get(text)
+    if index is None:
+        index = LineIndex(text)
+        remember_line_index(text, index)
+    return index
+
+def edited_line_index(text, new_text, offset, deleted, inserted):
+    # new_text is text with `deleted` characters at offset replaced by
+    # inserted. When text has been indexed, new_text's index is derived from
+    # it instead of being built from scratch on first use.
+    index = hashed_line_indexes.get(text)
+    if index is not None:
+        remember_line_index(new_text, index.edited(offset, deleted, inserted))
+
+# bytearray, memoryview and mmap texts cannot be hashed, so the last few are
+# looked up by identity. They must not change once they have been lexed.
+buffer_line_indexes = deque(maxlen=8)
+
+def line_index(text):
+    if isinstance(text, (str, bytes)):
+        return hashed_line_index(text)
+    for buffer, index in buffer_line_indexes:
+        if buffer is text:
+            return index
+    index = LineIndex(text)
+    buffer_line_indexes.append((text, index))
+    return index
+
+def decoded_columns(text, line_start, *cols):
+    # Byte columns of a line of a bytes-like text as character columns.
+    return [len(bytes(text[line_start:line_start + col]).decode('utf-8', 'replace')) for col in cols]
+
 def string_with_arrows(text, pos_start, pos_end):
     result = ''
+    index = line_index(text)
 
-    # Calculate indices
-    idx_start = max(text.rfind('\n', 0, pos_start.idx), 0)
-    idx_end = text.find('\n', idx_start + 1)
-    if idx_end < 0: idx_end = len(text)
-    
     # Generate each line
     line_count = pos_end.ln - pos_start.ln + 1
     for i in range(line_count):
+        # Calculate indices: a line runs from the newline before it
+        ln = pos_start.ln + i
+        idx_start = index.line_start(ln) - 1 if ln > 0 else 0
+        idx_end = index.line_end(ln)
+
         # Calculate line columns
         line = text[idx_start:idx_end]
         col_start = pos_start.col if i == 0 else 0
         col_end = pos_end.col if i == line_count - 1 else len(line) - 1
+        if not isinstance(line, str):
+            col_start, col_end = decoded_columns(text, index.line_start(ln), col_start, col_end)
+            line = bytes(line).decode('utf-8', 'replace')
 
         # Append to result
         result += line + '\n'
         result += ' ' * col_start + '^' * (col_end - col_start)
 
-        # Re-calculate indices
-        idx_start = idx_end
-        idx_end = text.find('\n', idx_start + 1)
-        if idx_end < 0: idx_end = len(text)
-
-    return result.replace('\t', '')
\ No newline at end of file
+    return result.replace('\t', '')
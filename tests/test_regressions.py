@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import random
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import B1_500091612 as basic
+import strings_with_arrows
+import batch
+import bench
+import server
+
+BACKENDS = (basic.BACKEND_INTERPRETER, basic.BACKEND_CLOSURE, basic.BACKEND_VM)
+
+def symbols(**values):
+    symbol_table = basic.SymbolTable(basic.global_symbol_table)
+    for name, value in values.items():
+        symbol_table.set(name, basic.Number.of(value))
+    return symbol_table
+
+class OverflowTest(unittest.TestCase):
+    def test_int_to_float_overflow(self):
+        for text in ('10^400/3', '10^400+0.5', '0.5-10^400', '10^400*0.5'):
+            for backend in BACKENDS:
+                for limits in (None, basic.Limits(max_int_bits=5000)):
+                    for optimize in (False, True):
+                        value, error = basic.run('<test>', text, backend, optimize=optimize, limits=limits)
+                        self.assertIsNone(value)
+                        self.assertEqual(error.details, 'Result out of range', (text, backend, limits, optimize))
+
+    def test_division_overflow_points_at_divisor(self):
+        for backend in BACKENDS:
+            value, error = basic.run('<test>', '10^400/3', backend)
+            self.assertEqual((error.pos_start.idx, error.pos_end.idx), (7, 8))
+
+    def test_batch_rows(self):
+        evaluators = [basic.BatchEvaluator]
+        if basic.numpy is not None:
+            evaluators.append(basic.NumpyBatchEvaluator)
+        program, error = basic.make_program('<batch>', 'x/3 + x*0.5')
+        for evaluator_class in evaluators:
+            context = basic.Context('<batch>')
+            context.symbol_table = basic.global_symbol_table
+            result = evaluator_class({'x': [10 ** 400, 6]}, 2, context).evaluate(program.node)
+            self.assertEqual(result.values, [None, 5.0])
+            self.assertEqual(result.errors[0].details, 'Result out of range')
+
+class OptimizerTest(unittest.TestCase):
+    def test_fold_is_bounded(self):
+        limits = basic.Limits(max_steps=10000, timeout=1.0, max_int_bits=4096)
+        for backend in BACKENDS:
+            value, error = basic.run('<test>', '9^9^9', backend, optimize=True, limits=limits)
+            self.assertEqual(error.details, 'Result of power exceeds 4096 bits')
+            value, error = basic.run('<test>', '2^100000', backend, optimize=True, limits=limits)
+            self.assertEqual(error.details, 'Result of power exceeds 4096 bits')
+
+    def test_fold_bound_is_part_of_cache_key(self):
+        cache = basic.ProgramCache()
+        value, error = basic.run('<test>', '2^5000', optimize=True, cache=cache)
+        self.assertEqual(value.value, 2 ** 5000)
+        value, error = basic.run('<test>', '2^5000', optimize=True, cache=cache, limits=basic.Limits(max_int_bits=100))
+        self.assertEqual(error.details, 'Result of power exceeds 100 bits')
+
+    def test_dropped_identity_keeps_operand_span(self):
+        for optimize in (False, True):
+            value, error = basic.run('<test>', 'y > +0.0 ^ -x', optimize=optimize, symbol_table=symbols(x=1, y=1))
+            self.assertEqual((error.pos_start.idx, error.pos_end.idx), (5, 13))
+            value, error = basic.run('<test>', '1 / +0.0', optimize=optimize)
+            self.assertEqual((error.pos_start.idx, error.pos_end.idx), (4, 8))
+
+    def test_huge_constants(self):
+        value, error = basic.run('<test>', '2^20000', basic.BACKEND_VM, optimize=True)
+        self.assertTrue(value.value == 2 ** 20000)
+        # Folding stops well short of repr's digit limit, so the constant
+        # is put into the tree by hand.
+        program, error = basic.make_program('<test>', '1 + 1')
+        program.node.left_node.tok.value = 2 ** 20000
+        constants = [2 ** 20000, 1]
+        self.assertTrue(list(basic.BytecodeCompiler().compile_program(program.node).constants) == constants)
+        self.assertTrue(list(basic.flatten(program.node).constants) == constants)
+
+class DeepNestingTest(unittest.TestCase):
+    text = '(x+' * 3000 + '1' + ')' * 3000
+
+    def test_program_cache_on_disk(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = basic.ProgramCache(path=path)
+            for _ in range(2):
+                value, error = basic.run(
+                    '<test>', self.text, basic.BACKEND_VM, cache=cache,
+                    symbol_table=symbols(x=1), parser=basic.PARSER_PRECEDENCE,
+                )
+                self.assertEqual(value.value, 3001)
+            self.assertEqual(os.listdir(path), [])
+            self.assertEqual(cache.memory.hits, 1)
+
+    def test_bench(self):
+        results = bench.run_benchmarks(2000, 400, 1, 1, 0)
+        self.assertIn('eval.nested.vm', results)
+        self.assertIn('parse.nested.precedence', results)
+        self.assertNotIn('eval.nested.closure', results)
+
+    def test_batch_file(self):
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, 'deep.txt')
+            with open(filename, 'w') as f:
+                f.write('(' * 5000 + '1' + ')' * 5000)
+            result = batch.process_file(filename, batch.MODES)
+        self.assertEqual(result['result'], 1)
+        self.assertEqual(result['tokens'], 10001)
+
+class RelexTest(unittest.TestCase):
+    pieces = ['ab', 'Z', '09', '1', ' ', '\t', '\n', '+', '-', '(', '7', 'x y', '  ', '\n\n']
+
+    def random_text(self, rng, count):
+        return ''.join(rng.choice(self.pieces) for _ in range(count))
+
+    def columns(self, buffer):
+        return [(buffer.type_of(i), buffer.start_of(i), buffer.end_of(i)) for i in range(len(buffer))]
+
+    def test_apply_edit_matches_full_lex(self):
+        rng = random.Random(3)
+        for _ in range(100):
+            text = self.random_text(rng, rng.randint(0, 60))
+            buffer, error = basic.Lexer('<test>', text, basic.ENGINE_REGEX).make_token_buffer()
+            buffer.max_shifts = rng.choice([1, 2, 3, 256])
+            for _ in range(20):
+                offset = rng.randint(0, len(text))
+                deleted = rng.randint(0, min(4, len(text) - offset))
+                inserted = self.random_text(rng, rng.randint(0, 3))
+                buffer.apply_edit(offset, deleted, inserted)
+                text = text[:offset] + inserted + text[offset + deleted:]
+                fresh, error = basic.Lexer('<test>', text, basic.ENGINE_REGEX).make_token_buffer()
+                self.assertEqual(self.columns(buffer), self.columns(fresh))
+                self.assertEqual([token.value for token in buffer], [token.value for token in fresh])
+
+    def test_edited_line_index_matches_fresh(self):
+        rng = random.Random(7)
+        pieces = ['a', 'bc', '\n', '\n\n', ' ', 'xyz\n']
+        for _ in range(100):
+            text = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+            index = strings_with_arrows.LineIndex(text)
+            index.max_shifts = rng.choice([1, 2, 4, 256])
+            for _ in range(20):
+                offset = rng.randint(0, len(text))
+                deleted = rng.randint(0, min(6, len(text) - offset))
+                inserted = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 3)))
+                edited = index.edited(offset, deleted, inserted)
+                text = text[:offset] + inserted + text[offset + deleted:]
+                fresh = strings_with_arrows.LineIndex(text)
+                positions = range(len(text) + 1)
+                self.assertEqual([edited.line_col(i) for i in positions], [fresh.line_col(i) for i in positions])
+                edited.max_shifts = index.max_shifts
+                index = edited
+
+class MemoTest(unittest.TestCase):
+    def test_rebound_name_is_not_memoized(self):
+        symbol_table = symbols()
+        memo = basic.LRUCache()
+
+        def run(text):
+            value, error = basic.run('<test>', text, symbol_table=symbol_table, memo=memo)
+            self.assertIsNone(error)
+            return value
+
+        run('FUN f(n) -> IF n <= 0 THEN 0 ELSE f(n - 1) + 1')
+        run('VAR g = f')
+        self.assertEqual(run('g(3)').value, 3)
+        self.assertEqual(run('g(3)').value, 3)
+        run('FUN f(n) -> 100')
+        self.assertEqual(run('g(3)').value, 101)
+
+class ServerTest(unittest.TestCase):
+    def test_stuck_worker_is_replaced(self):
+        async def main():
+            evaluation_server = server.EvaluationServer(workers=1, timeout=0.5)
+            host, port = await evaluation_server.start('127.0.0.1', 0)
+            reader, writer = await asyncio.open_connection(host, port)
+
+            async def ask(request):
+                writer.write(json.dumps(request).encode('utf-8') + b'\n')
+                await writer.drain()
+                return json.loads(await reader.readline())
+
+            try:
+                self.assertEqual(await ask({'id': 1, 'text': '10^10^9'}), {'id': 1, 'error': 'timeout'})
+                response = await ask({'id': 2, 'text': '1', 'timeout': -1})
+                self.assertTrue(response['error'].startswith('invalid request'))
+                for _ in range(20):
+                    response = await ask({'id': 3, 'text': '1+1'})
+                    if 'result' in response:
+                        break
+                    await asyncio.sleep(0.25)
+                self.assertEqual(response, {'id': 3, 'result': 2})
+            finally:
+                writer.close()
+                await evaluation_server.close()
+
+        asyncio.run(main())
+
+if __name__ == '__main__':
+    unittest.main()
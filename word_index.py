@@ -0,0 +1,301 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import B1_500091612 as basic
+from batch import expand_globs
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    word TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (word, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+'''
+
+#######################################
+# POSTINGS
+#######################################
+
+# A posting list holds every (offset, line) of one word in one file, in
+# order, as the differences to the previous pair written as varints
+# (7 bits per byte, high bit set on all but the last byte). Offsets are
+# byte offsets and lines count from 0, like Position.
+
+def encode_postings(offsets, lines):
+    data = bytearray()
+    previous_offset = previous_line = 0
+    for offset, line in zip(offsets, lines):
+        for value in (offset - previous_offset, line - previous_line):
+            while value >= 0x80:
+                data.append(value & 0x7f | 0x80)
+                value >>= 7
+            data.append(value)
+        previous_offset, previous_line = offset, line
+    return bytes(data)
+
+def decode_postings(data):
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+
+    offset = line = 0
+    for index in range(0, len(values), 2):
+        offset += values[index]
+        line += values[index + 1]
+        yield offset, line
+
+def index_file(path):
+    # Lexes one file (as bytes, without decoding it) and returns its
+    # postings per word.
+    result = {'path': path}
+    try:
+        stat = os.stat(path)
+        buffer, _ = basic.lex_file_parallel(path, workers=1)
+    except (OSError, ValueError) as e:
+        result['error'] = str(e)
+        return result
+
+    word_code = basic.TOKEN_CODES[basic.TT_WORD]
+    line_code = basic.TOKEN_CODES[basic.TT_LINE]
+    source = buffer.source
+    words = {}
+    line = 0
+    for code, start, end in zip(buffer.types, buffer.starts, buffer.ends):
+        if code == word_code:
+            # Words are ASCII letters and digits.
+            word = source[start:end].decode('ascii')
+            if word not in words:
+                words[word] = ([], [])
+            offsets, lines = words[word]
+            offsets.append(start)
+            lines.append(line)
+        elif code == line_code:
+            line += end - start
+
+    result['mtime_ns'] = stat.st_mtime_ns
+    result['size'] = stat.st_size
+    result['postings'] = [
+        (word, len(offsets), encode_postings(offsets, lines))
+        for word, (offsets, lines) in words.items()
+    ]
+    return result
+
+#######################################
+# INDEX
+#######################################
+
+class WordIndex:
+    # On-disk inverted index from TT_WORD values to the files, offsets and
+    # lines they occur at, kept in SQLite. update() only re-lexes files whose
+    # modification time or size changed; lookups read posting lists and never
+    # lex anything.
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ###################################
+
+    def update(self, patterns, workers=None, prune=True):
+        # Indexes the files matching patterns. With prune, files in the index
+        # that no longer exist are dropped.
+        connection = self.connection
+        known = {
+            path: (file_id, mtime_ns, size)
+            for file_id, path, mtime_ns, size in connection.execute('SELECT id, path, mtime_ns, size FROM files')
+        }
+        summary = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'errors': 0, 'postings': 0}
+
+        stale = []
+        for path in expand_globs(patterns):
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path, (None, None, None))[1:] == (stat.st_mtime_ns, stat.st_size):
+                summary['unchanged'] += 1
+            else:
+                stale.append(path)
+
+        with connection:
+            if prune:
+                for path, (file_id, _, _) in known.items():
+                    if not os.path.exists(path):
+                        self.remove_file(file_id)
+                        summary['removed'] += 1
+
+            workers = workers or os.cpu_count() or 1
+            if workers == 1 or len(stale) < 2:
+                results = map(index_file, stale)
+                self.store_results(results, known, summary)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    results = pool.map(index_file, stale, chunksize=4)
+                    self.store_results(results, known, summary)
+
+        return summary
+
+    def store_results(self, results, known, summary):
+        connection = self.connection
+        for result in results:
+            if 'error' in result:
+                summary['errors'] += 1
+                continue
+
+            path = result['path']
+            if path in known:
+                file_id = known[path][0]
+                self.remove_postings(file_id)
+                connection.execute(
+                    'UPDATE files SET mtime_ns = ?, size = ? WHERE id = ?',
+                    (result['mtime_ns'], result['size'], file_id),
+                )
+            else:
+                file_id = connection.execute(
+                    'INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)',
+                    (path, result['mtime_ns'], result['size']),
+                ).lastrowid
+
+            connection.executemany(
+                'INSERT INTO postings (word, file_id, count, data) VALUES (?, ?, ?, ?)',
+                ((word, file_id, count, data) for word, count, data in result['postings']),
+            )
+            summary['indexed'] += 1
+            summary['postings'] += len(result['postings'])
+
+    def remove_postings(self, file_id):
+        self.connection.execute('DELETE FROM postings WHERE file_id = ?', (file_id, ))
+
+    def remove_file(self, file_id):
+        self.remove_postings(file_id)
+        self.connection.execute('DELETE FROM files WHERE id = ?', (file_id, ))
+
+    ###################################
+
+    def files(self, word):
+        # (path, occurrences) of every file that contains word.
+        return self.connection.execute(
+            'SELECT f.path, p.count FROM postings p JOIN files f ON f.id = p.file_id '
+            'WHERE p.word = ? ORDER BY f.path',
+            (word, ),
+        ).fetchall()
+
+    def lookup(self, word, limit=None):
+        # (path, offset, line) of every occurrence of word, by file and offset.
+        hits = []
+        rows = self.connection.execute(
+            'SELECT f.path, p.data FROM postings p JOIN files f ON f.id = p.file_id '
+            'WHERE p.word = ? ORDER BY f.path',
+            (word, ),
+        )
+        for path, data in rows:
+            for offset, line in decode_postings(data):
+                if limit is not None and len(hits) >= limit:
+                    return hits
+                hits.append((path, offset, line))
+        return hits
+
+    def stats(self):
+        connection = self.connection
+        files, = connection.execute('SELECT COUNT(*) FROM files').fetchone()
+        words, postings, occurrences, size = connection.execute(
+            'SELECT COUNT(DISTINCT word), COUNT(*), COALESCE(SUM(count), 0), COALESCE(SUM(LENGTH(data)), 0) FROM postings'
+        ).fetchone()
+        return {
+            'files': files,
+            'words': words,
+            'postings': postings,
+            'occurrences': occurrences,
+            'posting_bytes': size,
+        }
+
+#######################################
+# MAIN
+#######################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build and query an inverted index of the words in source files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='index new and changed files')
+    build.add_argument('index', help='index database file')
+    build.add_argument('patterns', nargs='+', help="file globs, e.g. 'corpus/**/*.txt'")
+    build.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: CPU count)')
+    build.add_argument('--no-prune', action='store_true', help='keep files that no longer exist')
+
+    query = commands.add_parser('query', help='print where words occur')
+    query.add_argument('index', help='index database file')
+    query.add_argument('words', nargs='+')
+    query.add_argument('--limit', type=int, default=None, help='most occurrences printed per word')
+    query.add_argument('--files', action='store_true', help='only print files and counts')
+    query.add_argument('--json', action='store_true', help='write JSON lines')
+
+    stats = commands.add_parser('stats', help='print index size')
+    stats.add_argument('index', help='index database file')
+    args = parser.parse_args(argv)
+
+    with WordIndex(args.index) as index:
+        if args.command == 'build':
+            start = time.perf_counter()
+            summary = index.update(args.patterns, args.jobs, not args.no_prune)
+            summary['seconds'] = round(time.perf_counter() - start, 3)
+            print(json.dumps(summary), file=sys.stderr)
+            return 1 if summary['errors'] else 0
+
+        if args.command == 'stats':
+            print(json.dumps(index.stats()))
+            return 0
+
+        for word in args.words:
+            start = time.perf_counter()
+            if args.files:
+                hits = index.files(word)
+            else:
+                hits = index.lookup(word, args.limit)
+            seconds = time.perf_counter() - start
+
+            if args.json:
+                key = 'files' if args.files else 'hits'
+                print(json.dumps({'word': word, key: hits, 'seconds': round(seconds, 6)}))
+            elif args.files:
+                for path, count in hits:
+                    print(f'{word}\t{path}\t{count}')
+            else:
+                for path, offset, line in hits:
+                    print(f'{word}\t{path}:{line + 1}\t{offset}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())